@@ -0,0 +1,113 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import metrics
+from config import DB_PATH, ARCHIVE_DB_PATH, BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES, BACKUP_STEP_SLEEP
+
+logger = logging.getLogger(__name__)
+
+# ============ РЕЗЕРВНОЕ КОПИРОВАНИЕ ============
+
+def backup_file_sync(db_path: str, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> Dict:
+    """Онлайн-копия одной БД в сжатый снимок с ротацией
+
+    Копирование идёт через backup API по BACKUP_PAGES страниц с паузой
+    между шагами, поэтому писатели ждут не дольше одного шага.
+    """
+    started = time.monotonic()
+    backup_dir = Path(backup_dir)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(db_path).stem
+    target = backup_dir / f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.db.gz"
+    fd, raw_path = tempfile.mkstemp(prefix=f"{stem}-", suffix=".tmp", dir=backup_dir)
+    os.close(fd)
+    try:
+        src = sqlite3.connect(str(db_path), timeout=10.0, isolation_level=None)
+        dst = sqlite3.connect(raw_path)
+        try:
+            # Открытая транзакция чтения фиксирует снимок WAL: записи других
+            # соединений не перезапускают копирование с начала
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            # sleep в backup() срабатывает только при блокировке, паузу между шагами делаем сами
+            src.backup(dst, pages=BACKUP_PAGES, progress=lambda *_: time.sleep(BACKUP_STEP_SLEEP))
+            src.execute("COMMIT")
+        finally:
+            dst.close()
+            src.close()
+        raw_size = os.path.getsize(raw_path)
+        with open(raw_path, "rb") as fin, gzip.open(target, "wb", compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+    except Exception:
+        target.unlink(missing_ok=True)
+        raise
+    finally:
+        os.remove(raw_path)
+
+    return {
+        "path": str(target),
+        "size": target.stat().st_size,
+        "raw_size": raw_size,
+        "duration": time.monotonic() - started,
+        "removed": rotate_backups(backup_dir, stem, keep)
+    }
+
+def rotate_backups(backup_dir: Path, stem: str, keep: int) -> int:
+    """Удалить старые снимки БД stem, оставив keep последних"""
+    # Метка времени в имени — сортировка по имени совпадает с хронологической
+    snapshots = sorted(Path(backup_dir).glob(f"{stem}-*.db.gz"))
+    stale = snapshots[:-keep] if keep > 0 else snapshots
+    for path in stale:
+        path.unlink(missing_ok=True)
+    return len(stale)
+
+def backup_all_sync() -> List[Dict]:
+    """Снимки рабочей и архивной БД"""
+    return [backup_file_sync(path) for path in (DB_PATH, ARCHIVE_DB_PATH) if Path(path).exists()]
+
+def verify_backup_sync(path: str) -> Dict:
+    """Проверить, что снимок восстанавливается: распаковать и прогнать integrity_check"""
+    fd, raw_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        with gzip.open(path, "rb") as fin, open(raw_path, "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        conn = sqlite3.connect(raw_path)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            tables = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+        finally:
+            conn.close()
+        return {"ok": result == "ok", "result": result, "tables": tables}
+    except Exception as e:
+        return {"ok": False, "result": str(e), "tables": 0}
+    finally:
+        os.remove(raw_path)
+
+async def run_backup() -> List[Dict]:
+    """Снять и проверить резервные копии всех БД, обновить метрики"""
+    try:
+        results = await asyncio.to_thread(backup_all_sync)
+    except Exception:
+        metrics.inc("backup.failures")
+        raise
+    for result in results:
+        result["verify"] = await asyncio.to_thread(verify_backup_sync, result["path"])
+        if not result["verify"]["ok"]:
+            metrics.inc("backup.failures")
+            logger.error(f"❌ Снимок {result['path']} не прошёл проверку: {result['verify']['result']}")
+        logger.info(f"💾 Резервная копия {result['path']}: {result['size'] // 1024} КБ за {result['duration']:.1f} с")
+
+    metrics.inc("backup.runs")
+    metrics.set_gauge("backup.last_duration", sum(r["duration"] for r in results))
+    metrics.set_gauge("backup.last_size", sum(r["size"] for r in results))
+    return results
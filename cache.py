@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List
+
+import metrics
+from config import CACHE_MAX_ENTRIES, CACHE_TTL
+
+# ============ КЭШ ТОЧЕЧНЫХ ЧТЕНИЙ ============
+
+class TTLCache:
+    """Ограниченный LRU-кэш с временем жизни записей
+
+    None не кэшируется, поэтому get() отвечает None при промахе.
+    Потокобезопасен: синхронные функции БД выполняются в потоках asyncio.to_thread.
+    Запись, прочитанная до инвалидации, в кэш не попадает: load() запоминает
+    поколение кэша перед чтением и сохраняет результат, только если за время
+    чтения ничего не инвалидировалось. Значения должны быть неизменяемыми
+    (записи records), они отдаются вызывающим без копирования.
+    """
+
+    def __init__(self, name: str, maxsize: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Значение из кэша или None (промах считает load)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Значение из кэша, а при промахе — из loader() с сохранением"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        generation = self._generation
+        self.misses += 1
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._data[key] = (value, time.monotonic() + self.ttl)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, *keys: Hashable):
+        """Удалить записи по ключам"""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._data),
+        }
+
+
+_caches: List[TTLCache] = []
+
+def create_cache(name: str, maxsize: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL) -> TTLCache:
+    """Создать кэш и включить его в метрики (cache.<name>.hit_rate и др.)"""
+    cache = TTLCache(name, maxsize, ttl)
+    _caches.append(cache)
+    return cache
+
+def collect_cache_metrics():
+    for cache in _caches:
+        metrics.set_gauges(f"cache.{cache.name}.", cache.stats())
+
+metrics.register_collector(collect_cache_metrics)
@@ -0,0 +1,216 @@
+from typing import Any, Callable, Dict, Literal, NamedTuple, Optional, Tuple, Union, get_args, get_origin, get_type_hints
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.types import CallbackQuery
+
+# ============ ДАННЫЕ КНОПОК ============
+
+# Новый формат: "<префикс>:<поле>:<поле>", например "ap:15:12" (до 64 байт у Telegram).
+# Старый формат "<имя>_<поле>_<поле>" из уже отправленных сообщений тоже разбирается.
+
+class GiftPick(NamedTuple):
+    """Выбор подарка в каталоге"""
+    gift_id: int
+
+
+class ReceiptAsk(NamedTuple):
+    """«Отправить чек» после выбора подарка"""
+    gift_id: int
+
+
+class OrderPaid(NamedTuple):
+    """«Отправить чек» из старых сообщений, где заказ уже создан"""
+    order_id: int
+
+
+class OrderApprove(NamedTuple):
+    """Подтверждение заказа; anchor — первая строка страницы списка (0 — кнопка под чеком)"""
+    order_id: int
+    anchor: int = 0
+
+
+class OrderReject(NamedTuple):
+    """Отклонение заказа; anchor — как у OrderApprove"""
+    order_id: int
+    anchor: int = 0
+
+
+class OrdersPage(NamedTuple):
+    """Листание ожидающих заказов"""
+    direction: Literal["prev", "next", "at"]
+    cursor_id: int
+
+
+class PayCard(NamedTuple):
+    gift_id: int
+
+
+class PaySbp(NamedTuple):
+    gift_id: int
+
+
+class SendReceipt(NamedTuple):
+    gift_id: int
+
+
+class PostCancel(NamedTuple):
+    """Отмена отложенного поста"""
+    post_id: int
+
+
+# класс -> (префикс нового формата, имя старого формата или None для новых кнопок)
+PAYLOADS = {
+    GiftPick: ("g", "gift"),
+    ReceiptAsk: ("rc", "receipt"),
+    OrderPaid: ("pd", "paid"),
+    OrderApprove: ("ap", "approve"),
+    OrderReject: ("rj", "reject"),
+    OrdersPage: ("op", "orders_page"),
+    PayCard: ("pc", "pay_card"),
+    PaySbp: ("ps", "pay_sbp"),
+    SendReceipt: ("sr", "send_receipt"),
+    PostCancel: ("xp", None),
+}
+
+# Наибольшее значение, которое SQLite примет параметром запроса
+_MAX_ID = 2 ** 63 - 1
+
+
+def _converter(hint) -> Callable[[str], Any]:
+    """Проверка и приведение одного поля; ValueError — значение не подходит"""
+    if get_origin(hint) is Literal:
+        allowed = frozenset(get_args(hint))
+
+        def convert(value: str) -> str:
+            if value not in allowed:
+                raise ValueError(value)
+            return value
+        return convert
+
+    def convert_int(value: str) -> int:
+        # Только цифры: без знака, пробелов и подчёркиваний, которые пропускает int()
+        if not value.isascii() or not value.isdigit() or len(value) > 19:
+            raise ValueError(value)
+        number = int(value)
+        if number > _MAX_ID:
+            raise ValueError(value)
+        return number
+    return convert_int
+
+
+class _Spec(NamedTuple):
+    payload_type: type
+    converters: Tuple[Callable[[str], Any], ...]
+    required: int
+
+
+def _spec(payload_type: type) -> _Spec:
+    hints = get_type_hints(payload_type, include_extras=True)
+    converters = tuple(_converter(hints[name]) for name in payload_type._fields)
+    return _Spec(payload_type, converters, len(converters) - len(payload_type._field_defaults))
+
+
+_PREFIXES: Dict[type, str] = {}
+_BY_PREFIX: Dict[str, _Spec] = {}
+_BY_LEGACY: Dict[str, _Spec] = {}
+
+for _type, (_prefix, _legacy) in PAYLOADS.items():
+    if _prefix in _BY_PREFIX or _legacy in _BY_LEGACY:
+        raise ValueError(f"Префикс кнопки занят дважды: {_prefix} / {_legacy}")
+    _PREFIXES[_type] = _prefix
+    _BY_PREFIX[_prefix] = _spec(_type)
+    if _legacy is not None:
+        _BY_LEGACY[_legacy] = _BY_PREFIX[_prefix]
+
+
+def pack(payload: NamedTuple) -> str:
+    """callback_data для кнопки: GiftPick(3) -> "g:3" """
+    return ":".join((_PREFIXES[type(payload)], *map(str, payload)))
+
+
+def _build(spec: _Spec, args) -> Optional[NamedTuple]:
+    if not spec.required <= len(args) <= len(spec.converters):
+        return None
+    try:
+        return spec.payload_type(*(convert(arg) for convert, arg in zip(spec.converters, args)))
+    except ValueError:
+        return None
+
+
+def parse(data: Optional[str]) -> Optional[NamedTuple]:
+    """Разобрать callback_data нового или старого формата
+
+    Поля проверяются здесь один раз: числа — только цифры в пределах
+    INTEGER SQLite, строки-варианты — из своего Literal. None — данные не
+    относятся ни к одному классу или не прошли проверку.
+    """
+    if not data:
+        return None
+    prefix, sep, rest = data.partition(":")
+    if sep:
+        spec = _BY_PREFIX.get(prefix)
+        return _build(spec, rest.split(":")) if spec is not None else None
+
+    # Старый формат: имя из одного или двух слов, затем поля
+    parts = data.split("_")
+    spec = _BY_LEGACY.get("_".join(parts[:2]))
+    if spec is not None:
+        return _build(spec, parts[2:])
+    spec = _BY_LEGACY.get(parts[0])
+    return _build(spec, parts[1:]) if spec is not None else None
+
+# ============ МАРШРУТИЗАЦИЯ НАЖАТИЙ ============
+
+class CallbackDispatcher:
+    """Одна точка входа для всех нажатий inline-кнопок
+
+    Вместо цепочки фильтров по строке (каждый проверяется для каждого
+    нажатия) обработчик ищется одним обращением к dict: по самой строке
+    для постоянных кнопок ("back_to_admin") или по классу разобранных
+    данных. Обработчик получает разобранные данные аргументом payload
+    и остальные аргументы aiogram (state, bot, ...) по своей сигнатуре.
+    Повторная регистрация того же ключа — ошибка при импорте, а не
+    тихий перехват чужих нажатий.
+    """
+
+    def __init__(self, name: str = "callbacks"):
+        self._routes: Dict[Union[str, type], CallableObject] = {}
+        self.router = Router(name=name)
+        self.router.callback_query.register(self._dispatch, self._match)
+
+    def on(self, key: Union[str, type]):
+        """Декоратор: обработчик постоянной кнопки (строка) или класса данных"""
+        if not isinstance(key, str) and key not in _PREFIXES:
+            raise ValueError(f"Неизвестный класс данных кнопки: {key!r}")
+
+        def decorator(callback: Callable) -> Callable:
+            if key in self._routes:
+                raise ValueError(f"Кнопка {key!r} уже обрабатывается")
+            self._routes[key] = CallableObject(callback)
+            return callback
+        return decorator
+
+    def resolve(self, data: Optional[str]) -> Optional[Tuple[CallableObject, Optional[NamedTuple]]]:
+        """Обработчик и разобранные данные для callback_data или None"""
+        route = self._routes.get(data)
+        if route is not None:
+            return route, None
+        payload = parse(data)
+        if payload is None:
+            return None
+        route = self._routes.get(type(payload))
+        return (route, payload) if route is not None else None
+
+    def _match(self, callback: CallbackQuery):
+        resolved = self.resolve(callback.data)
+        if resolved is None:
+            return False
+        return {"callback_route": resolved[0], "payload": resolved[1]}
+
+    async def _dispatch(self, callback: CallbackQuery, callback_route: CallableObject, **data):
+        return await callback_route.call(callback, **data)
+
+
+dispatcher = CallbackDispatcher()
+on_callback = dispatcher.on
@@ -0,0 +1,124 @@
+"""Проверка: снимок резервной копии восстанавливается
+
+Запуск из корня репозитория: python checks/backup_restore.py
+
+Скрипт работает только с временными файлами (DB_PATH и BACKUP_DIR из
+окружения подменяются). Он наполняет БД журналом и снимает копию через
+run_backup, пока другой поток продолжает писать. Затем распаковывает
+снимок рядом и убеждается, что integrity_check проходит, схема и подарки
+совпадают с исходной БД, а журнал — ровно префикс исходного (копия
+согласована на момент начала, без «дыр» от параллельной записи).
+Повреждённый снимок verify_backup_sync должен отклонить.
+Код возврата 0 — все проверки пройдены.
+"""
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+WORKDIR = Path(tempfile.mkdtemp(prefix="backup-check-"))
+os.environ.update({
+    "DB_PATH": str(WORKDIR / "gift_bot.db"),
+    "ARCHIVE_DB_PATH": str(WORKDIR / "archive.db"),
+    "BACKUP_DIR": str(WORKDIR / "backups"),
+    # Мелкие шаги, чтобы копирование шло параллельно с записью
+    "BACKUP_PAGES": "8",
+    "BACKUP_STEP_SLEEP": "0.005",
+})
+# Бот не запускается, но config требует обязательные переменные
+for name, value in (("BOT_TOKEN", "0:check"), ("SUPER_ADMIN_ID_1", "1"), ("CHANNEL_ID", "-1")):
+    os.environ.setdefault(name, value)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import backup  # noqa: E402
+import database  # noqa: E402  (импорт создаёт схему)
+
+ROWS = 3000
+
+failures = []
+
+def check(ok: bool, what: str):
+    print(f"{'✅' if ok else '❌'} {what}")
+    if not ok:
+        failures.append(what)
+
+def rows(conn: sqlite3.Connection, sql: str, params=()):
+    return conn.execute(sql, params).fetchall()
+
+def fill():
+    """Журнал из ROWS записей от разных пользователей"""
+    for n in range(ROWS):
+        database.create_donation_sync(1000 + n % 97, 1 + n % 5, 100 + n, f"user{n % 97}",
+                                      receipt_id=f"photo:seed-{n}")
+
+def write_during_backup(stop: threading.Event, written: list):
+    n = 0
+    while not stop.is_set():
+        database.create_donation_sync(5000 + n % 13, 1, 50, receipt_id=f"photo:live-{n}")
+        n += 1
+    written.append(n)
+
+def restore(snapshot: str) -> Path:
+    restored = WORKDIR / "restored.db"
+    with gzip.open(snapshot, "rb") as fin, open(restored, "wb") as fout:
+        shutil.copyfileobj(fin, fout)
+    return restored
+
+def main() -> int:
+    fill()
+    stop, written = threading.Event(), []
+    writer = threading.Thread(target=write_during_backup, args=(stop, written))
+    writer.start()
+    try:
+        results = asyncio.run(backup.run_backup())
+    finally:
+        stop.set()
+        writer.join()
+
+    main_result = next((r for r in results if Path(r["path"]).name.startswith("gift_bot-")), None)
+    check(main_result is not None, "снимок рабочей БД создан")
+    if main_result is None:
+        return 1
+    check(all(r["verify"]["ok"] for r in results), "run_backup: все снимки прошли verify_backup_sync")
+    check(written[0] > 0, f"параллельная запись во время копирования: {written[0]} записей")
+
+    source = sqlite3.connect(os.environ["DB_PATH"])
+    copy = sqlite3.connect(str(restore(main_result["path"])))
+    try:
+        check(copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok", "восстановленная БД: integrity_check = ok")
+        schema = "SELECT type, name, sql FROM sqlite_master ORDER BY type, name"
+        check(rows(copy, schema) == rows(source, schema), "схема совпадает с исходной")
+        check(rows(copy, "SELECT * FROM gifts ORDER BY id") == rows(source, "SELECT * FROM gifts ORDER BY id"),
+              "подарки совпадают с исходными")
+        ids = [row[0] for row in rows(copy, "SELECT id FROM ledger ORDER BY id")]
+        last = ids[-1] if ids else 0
+        check(ROWS <= len(ids) and ids == list(range(1, last + 1)),
+              f"журнал без пропусков: {len(ids)} записей, в исходной {ROWS + written[0]}")
+        ledger = "SELECT * FROM ledger WHERE id <= ? ORDER BY id"
+        check(rows(copy, ledger, (last,)) == rows(source, ledger, (last,)), "записи журнала совпадают с исходными")
+    finally:
+        copy.close()
+        source.close()
+
+    broken = WORKDIR / "broken.db.gz"
+    with open(main_result["path"], "rb") as fin:
+        data = fin.read()
+    broken.write_bytes(data[:len(data) // 2])
+    check(not backup.verify_backup_sync(str(broken))["ok"], "обрезанный снимок отклонён")
+    with gzip.open(broken, "wb") as fout:
+        fout.write(b"not a database" * 100)
+    check(not backup.verify_backup_sync(str(broken))["ok"], "снимок не-БД отклонён")
+
+    print("OK" if not failures else f"FAILED: {len(failures)}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
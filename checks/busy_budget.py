@@ -0,0 +1,156 @@
+"""Проверка: конкурирующие писатели укладываются в бюджет ожидания
+
+Запуск из корня репозитория: python checks/busy_budget.py
+Число писателей и операций каждого: BUSY_CHECK_WRITERS (по умолчанию 200,
+как в требовании к нагрузке) и BUSY_CHECK_ITERATIONS (по умолчанию 10).
+
+Работает на временной БД.
+1. С бюджетом DB_BUSY_BUDGET и busy_timeout из config (как в работе бота)
+   WRITERS процессов одновременно создают и подтверждают заказы, а
+   отдельное соединение в начале держит блокировку записи секунду
+   (как долгая архивация). Ни одна запись не должна упасть, каждая
+   операция — уложиться в бюджет (плюс одно ожидание busy_timeout
+   последней попытки), все заказы — оказаться в БД.
+2. В отдельном процессе с бюджетом SHORT_BUDGET блокировка держится
+   дольше бюджета: запись должна сдаться с SQLITE_BUSY не раньше
+   бюджета и не позже бюджета плюс busy_timeout, а не висеть до
+   освобождения БД.
+Код возврата 0 — все проверки пройдены.
+"""
+import multiprocessing as mp
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Дочерние процессы (spawn) заново импортируют модуль и берут каталог из окружения
+WORKDIR = Path(os.environ.get("BUSY_CHECK_DIR") or tempfile.mkdtemp(prefix="busy-check-"))
+os.environ.update({
+    "BUSY_CHECK_DIR": str(WORKDIR),
+    "DB_PATH": str(WORKDIR / "gift_bot.db"),
+    "ARCHIVE_DB_PATH": str(WORKDIR / "archive.db"),
+})
+# Бот не запускается, но config требует обязательные переменные
+for name, value in (("BOT_TOKEN", "0:check"), ("SUPER_ADMIN_ID_1", "1"), ("CHANNEL_ID", "-1")):
+    os.environ.setdefault(name, value)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import DB_BUSY_BUDGET, DB_PRAGMAS  # noqa: E402
+
+BUSY_TIMEOUT = DB_PRAGMAS["busy_timeout"] / 1000
+# Бюджет и busy_timeout второй проверки (секунды): ждать 10 с по умолчанию незачем
+SHORT_BUDGET, SHORT_BUSY_TIMEOUT = 2.0, 0.1
+# Запас на планировщик ОС и сами запросы
+SLACK = 0.5
+WRITERS = int(os.environ.get("BUSY_CHECK_WRITERS", "200"))
+ITERATIONS = int(os.environ.get("BUSY_CHECK_ITERATIONS", "10"))
+
+failures = []
+
+def check(ok: bool, what: str):
+    print(f"{'✅' if ok else '❌'} {what}")
+    if not ok:
+        failures.append(what)
+
+def writer(n: int, ready, go, results):
+    import database
+    import metrics
+    ready.release()
+    go.wait()
+    slowest, errors = 0.0, []
+    for i in range(ITERATIONS):
+        started = time.monotonic()
+        try:
+            order_id = database.create_order_sync(1000 + n, 1 + i % 5, 100, f"user{n}")
+            if not database.confirm_order_sync(order_id, 1):
+                raise RuntimeError(f"заказ {order_id} не подтверждён")
+        except Exception as e:
+            errors.append(repr(e)[:80])
+        slowest = max(slowest, time.monotonic() - started)
+    counters = metrics.snapshot()["counters"]
+    results.put((slowest, errors, counters.get("db.busy_retries", 0)))
+
+def hold_write_lock() -> sqlite3.Connection:
+    blocker = sqlite3.connect(os.environ["DB_PATH"], isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    return blocker
+
+def contention():
+    import database
+    ctx = mp.get_context("spawn")
+    ready, go, results = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+    processes = [ctx.Process(target=writer, args=(n, ready, go, results)) for n in range(WRITERS)]
+    for process in processes:
+        process.start()
+    # Старт одновременный: ждём, пока все процессы импортируют модули
+    for _ in processes:
+        ready.acquire()
+    blocker = hold_write_lock()
+    go.set()
+    time.sleep(1)
+    blocker.execute("COMMIT")
+    blocker.close()
+    slowest, errors, retries = 0.0, [], 0
+    for _ in processes:
+        worst, errs, busy = results.get()
+        slowest, retries = max(slowest, worst), retries + busy
+        errors += errs
+    for process in processes:
+        process.join()
+
+    check(not errors, f"{WRITERS}×{ITERATIONS} записей без ошибок" + (f": {sorted(set(errors))[:3]}" if errors else ""))
+    check(retries > 0, f"конкуренция была: повторов при занятой БД {retries}")
+    limit = DB_BUSY_BUDGET + BUSY_TIMEOUT + SLACK
+    check(slowest <= limit, f"самая долгая операция {slowest:.2f} с (предел {limit:.2f} с)")
+    confirmed = database.get_statistics_sync()["total_orders"]
+    check(confirmed == WRITERS * ITERATIONS, f"подтверждено заказов {confirmed}/{WRITERS * ITERATIONS}")
+
+def blocked_writer(results):
+    import database
+    import metrics
+    blocker = hold_write_lock()
+    started = time.monotonic()
+    try:
+        database.create_order_sync(1, 1, 100)
+        error = None
+    except sqlite3.OperationalError as e:
+        error = e
+    elapsed = time.monotonic() - started
+    blocker.execute("ROLLBACK")
+    blocker.close()
+    busy = error is not None and database.is_busy_error(error)
+    results.put((repr(error), busy, elapsed, metrics.snapshot()["counters"].get("db.busy_failures", 0)))
+
+def exhausted_budget():
+    # Дочерний процесс читает бюджет из окружения при импорте config
+    os.environ.update({
+        "DB_BUSY_BUDGET": str(SHORT_BUDGET),
+        "DB_BUSY_TIMEOUT_MS": str(int(SHORT_BUSY_TIMEOUT * 1000)),
+    })
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=blocked_writer, args=(results,))
+    process.start()
+    error, busy, elapsed, busy_failures = results.get()
+    process.join()
+
+    check(busy, f"при блокировке дольше бюджета запись сдаётся: {error}")
+    check(SHORT_BUDGET <= elapsed <= SHORT_BUDGET + SHORT_BUSY_TIMEOUT + SLACK,
+          f"ожидание {elapsed:.2f} с в пределах бюджета {SHORT_BUDGET:g} с + busy_timeout")
+    check(busy_failures == 1, "отказ учтён в db.busy_failures")
+
+def main() -> int:
+    import database  # noqa: F401  (импорт создаёт схему до старта писателей)
+    contention()
+    exhausted_budget()
+    print("OK" if not failures else f"FAILED: {len(failures)}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
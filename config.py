@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,9 +20,132 @@ SUPPORT_ADMIN_ID = SUPER_ADMIN_ID
 CHANNEL_ID = os.getenv("CHANNEL_ID")
 DB_PATH = os.getenv("DB_PATH", "/data/gift_bot.db")
 
+# SQLite: размер пула соединений и профиль PRAGMA, применяемый к каждому соединению один раз
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -int(os.getenv("DB_CACHE_SIZE_KB", "16384")),
+    "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024))),
+    "temp_store": os.getenv("DB_TEMP_STORE", "MEMORY"),
+    "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT_MS", "1000")),
+    "wal_autocheckpoint": int(os.getenv("DB_WAL_AUTOCHECKPOINT", "1000")),
+    "journal_size_limit": int(os.getenv("DB_JOURNAL_SIZE_LIMIT", str(64 * 1024 * 1024))),
+}
+
+# Занятая БД: общий бюджет ожидания на вызов (секунды), начальная и максимальная
+# пауза между повторами (секунды); первая линия ожидания — busy_timeout выше
+DB_BUSY_BUDGET = float(os.getenv("DB_BUSY_BUDGET", "10"))
+DB_BUSY_BASE_DELAY = float(os.getenv("DB_BUSY_BASE_DELAY", "0.01"))
+DB_BUSY_MAX_DELAY = float(os.getenv("DB_BUSY_MAX_DELAY", "0.5"))
+
+# Потоковое чтение больших выборок: строк за одно чтение из БД
+DB_STREAM_CHUNK_SIZE = int(os.getenv("DB_STREAM_CHUNK_SIZE", "500"))
+
+# Кэш точечных чтений (заказ, подарок, пользователь): записей на кэш и время жизни (секунды)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+
+# Готовые тексты топа и статистики: предельный срок жизни без изменений данных (секунды)
+RENDER_CACHE_TTL = float(os.getenv("RENDER_CACHE_TTL", "300"))
+
+# Активность пользователей: сколько недавно виденных держать в памяти
+# и период пакетной записи last_active (секунды)
+USER_SEEN_CACHE_SIZE = int(os.getenv("USER_SEEN_CACHE_SIZE", "10000"))
+USER_ACTIVITY_FLUSH_INTERVAL = float(os.getenv("USER_ACTIVITY_FLUSH_INTERVAL", "60"))
+
+# Анти-флуд: не больше THROTTLE_LIMIT сообщений (и отдельно нажатий) от пользователя
+# за THROTTLE_WINDOW секунд; повтор той же кнопки чаще THROTTLE_REPEAT секунд
+# склеивается с первым; окна хранятся для THROTTLE_MAX_USERS последних пользователей
+THROTTLE_LIMIT = int(os.getenv("THROTTLE_LIMIT", "6"))
+THROTTLE_WINDOW = float(os.getenv("THROTTLE_WINDOW", "3"))
+THROTTLE_REPEAT = float(os.getenv("THROTTLE_REPEAT", "1"))
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "10000"))
+
+# Обработка апдейтов: одновременно работающих обработчиков, ожидающих апдейтов
+# пользователей вне сценариев, обработчиков, которые берут только апдейты
+# админов, и сколько секунд приём ждёт места в заполненной очереди
+# (не дождавшимся пользователям бот отвечает «повторите»)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "200"))
+UPDATE_ADMIN_WORKERS = int(os.getenv("UPDATE_ADMIN_WORKERS", "1"))
+UPDATE_QUEUE_WAIT = float(os.getenv("UPDATE_QUEUE_WAIT", "2"))
+
+# Планировщик: сколько последних запусков каждой задачи хранить в истории
+# и предельная длительность одного запуска (секунды)
+JOB_HISTORY_KEEP = int(os.getenv("JOB_HISTORY_KEEP", "100"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "3600"))
+
+# Отправка сообщений: не больше SEND_RATE в секунду на бота, не чаще раза в
+# SEND_CHAT_INTERVAL секунд в один чат; попыток при сетевых ошибках и флуд-контроле
+SEND_RATE = float(os.getenv("SEND_RATE", "25"))
+SEND_CHAT_INTERVAL = float(os.getenv("SEND_CHAT_INTERVAL", "1"))
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", "5"))
+
+# Очередь исходящих уведомлений (outbox): писем за один заход, попыток доставки,
+# пауза перед повтором (секунды, удваивается с каждой попыткой до OUTBOX_RETRY_MAX)
+# и сколько дней хранить доставленные (ключи от повторной отправки)
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "20"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "30"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "3600"))
+OUTBOX_KEEP_DAYS = int(os.getenv("OUTBOX_KEEP_DAYS", "30"))
+OUTBOX_PRUNE_INTERVAL = int(os.getenv("OUTBOX_PRUNE_INTERVAL", "86400"))
+
+# Этапы цели сбора (проценты), о достижении каждого пишем в канал один раз
+GOAL_MILESTONES = tuple(sorted(int(p) for p in os.getenv("GOAL_MILESTONES", "25,50,75,100").split(",")))
+
+# Обслуживание БД: период проверки (секунды), простой без записей перед checkpoint WAL
+# (секунды) и период ANALYZE/optimize (секунды)
+DB_MAINTENANCE_INTERVAL = int(os.getenv("DB_MAINTENANCE_INTERVAL", "30"))
+DB_IDLE_SECONDS = float(os.getenv("DB_IDLE_SECONDS", "5"))
+DB_OPTIMIZE_INTERVAL = int(os.getenv("DB_OPTIMIZE_INTERVAL", "21600"))
+
+# Архив завершённых заказов и транзакций (отдельный файл рядом с основной БД)
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", str(Path(DB_PATH).with_name("archive.db")))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "86400"))
+
+# Резервные копии: каталог, сколько хранить, период (секунды),
+# страниц за шаг онлайн-копирования и пауза между шагами (секунды)
+BACKUP_DIR = os.getenv("BACKUP_DIR", str(Path(DB_PATH).with_name("backups")))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "86400"))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.05"))
+
+# Экспорт журнала: строк за одно чтение из БД
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "500"))
+
+# FSM: размер кэша в памяти и период сброса изменений в БД (секунды)
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))
+
+# FSM: время жизни состояний по группам (секунды), период очистки и общий лимит записей
+FSM_DEFAULT_TTL = int(os.getenv("FSM_DEFAULT_TTL", "86400"))
+FSM_STATE_TTLS = {
+    "PaymentStates": int(os.getenv("FSM_TTL_PAYMENT", "3600")),
+    "PostStates": int(os.getenv("FSM_TTL_POST", "21600")),
+    "GalleryStates": int(os.getenv("FSM_TTL_GALLERY", "3600")),
+    "GiftStates": int(os.getenv("FSM_TTL_GIFT", "3600")),
+}
+FSM_SWEEP_INTERVAL = int(os.getenv("FSM_SWEEP_INTERVAL", "300"))
+FSM_MAX_ENTRIES = int(os.getenv("FSM_MAX_ENTRIES", "50000"))
+
+# Членство в админах: супер-админы из окружения плюс таблица admins.
+# Набор заполняет и обновляет database (при старте и в add_admin/remove_admin)
+_admin_ids = frozenset(SUPER_ADMIN_IDS)
+
+def set_admin_ids(user_ids) -> frozenset:
+    """Заменить набор админов из БД (супер-админы остаются всегда)"""
+    global _admin_ids
+    _admin_ids = frozenset(SUPER_ADMIN_IDS).union(user_ids)
+    return _admin_ids
+
 # Функция проверки админа
 def is_admin(user_id: int) -> bool:
-    return user_id in SUPER_ADMIN_IDS
+    return user_id in _admin_ids
 
 # Ссылки на социальные сети
 TWITCH_URL = "https://twitch.tv/lana"
@@ -33,6 +157,12 @@ OZON_BANK_NAME = os.getenv("OZON_BANK_NAME", "Озон Банк")
 OZON_RECEIVER = os.getenv("OZON_RECEIVER", "Александр Б.")
 OZON_SBP_QR_URL = os.getenv("OZON_SBP_QR_URL", "019d2edd-64d5-7781-87ea-fea6bf40d6cf")
 
+# Ожидающие заказы и транзакции старше этого срока помечаются как expired (часы)
+PENDING_EXPIRE_HOURS = int(os.getenv("PENDING_EXPIRE_HOURS", "168"))
+PENDING_SWEEP_INTERVAL = int(os.getenv("PENDING_SWEEP_INTERVAL", "3600"))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "200"))
+SWEEP_BATCH_PAUSE = float(os.getenv("SWEEP_BATCH_PAUSE", "0.1"))
+
 # ============ НАСТРОЙКИ ЦЕЛИ ПО УМОЛЧАНИЮ ============
 DEFAULT_GOAL_NAME = "Новый компьютер для стримов"
 DEFAULT_GOAL_AMOUNT = 250000
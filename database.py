@@ -1,11 +1,23 @@
 import sqlite3
 import logging
 import asyncio
-from typing import List, Dict, Any, Optional
+import json
+import os
+import random
+import threading
+import time
+from typing import List, Dict, Any, Optional, AsyncIterator, Iterator
 from pathlib import Path
 from contextlib import contextmanager
 
-from config import DB_PATH, SUPER_ADMIN_ID, SUPPORT_ADMIN_ID
+import metrics
+from cache import create_cache
+from records import Record, User, Gift, Order, Transaction, Hero, GalleryPhoto, record_factory
+from config import (
+    DB_PATH, ARCHIVE_DB_PATH, SUPER_ADMIN_ID, DB_POOL_SIZE, DB_PRAGMAS,
+    DB_BUSY_BUDGET, DB_BUSY_BASE_DELAY, DB_BUSY_MAX_DELAY, DB_STREAM_CHUNK_SIZE, GOAL_MILESTONES,
+    is_admin as is_admin_member, set_admin_ids
+)
 
 logger = logging.getLogger(__name__)
 
@@ -13,38 +25,275 @@ logger = logging.getLogger(__name__)
 DEFAULT_GOAL_NAME = "На мечту"
 DEFAULT_GOAL_AMOUNT = 150000
 
+# Колонки журнала пожертвований — общие для рабочей и архивной БД.
+# source: 'order' — заказ из каталога, 'transaction' — оплата по СБП,
+# 'adjustment' — ручная корректировка; legacy_id — id в старых таблицах orders/transactions;
+# receipt_id — чек, по которому создана запись (альбом или фото), не даёт записать его дважды.
+# Новые колонки добавляются только в конец: архив копируется через SELECT *
+LEDGER_COLUMNS = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL DEFAULT 'order',
+    legacy_id INTEGER,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    gift_id INTEGER,
+    gift_name TEXT,
+    amount INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    payment_method TEXT,
+    payment_details TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    confirmed_at TIMESTAMP,
+    confirmed_by INTEGER,
+    receipt_id TEXT
+"""
+
+TOP_HEROES_COLUMNS = """
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    total_amount INTEGER DEFAULT 0,
+    last_donate TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+"""
+
+# Машина статусов журнала: целевой статус -> из каких статусов в него можно перейти.
+# Сумма и участники записи не меняются, исправления оформляются строками 'adjustment'
+STATUS_TRANSITIONS = {
+    "confirmed": ("pending", "expired"),
+    "rejected": ("pending", "expired"),
+    "cancelled": ("pending",),
+    "expired": ("pending",),
+}
+
+# Статусы старых транзакций
+LEGACY_STATUSES = {"paid": "confirmed"}
+
+# Статусы, после которых запись больше не меняется и может уйти в архив
+FINAL_STATUSES = ("confirmed", "rejected", "cancelled", "expired")
+
 # ============ КОНТЕКСТНЫЙ МЕНЕДЖЕР ДЛЯ БД ============
 
 @contextmanager
-def get_db_cursor(commit: bool = True):
-    """Контекстный менеджер для безопасной работы с БД"""
-    conn = get_db_connection()
+def get_db_cursor(commit: bool = True, archive: bool = False):
+    """Контекстный менеджер для безопасной работы с БД
+
+    Соединение берётся из пула и возвращается в него после работы.
+    При commit=True транзакция открывается сразу как BEGIN IMMEDIATE:
+    в WAL отложенная транзакция, успевшая прочитать данные, при переходе
+    к записи получает SQLITE_BUSY без ожидания. Захват блокировки
+    и COMMIT повторяются при занятой БД (см. retry_on_busy).
+    archive=True подключает архивную БД как схему archive и создаёт
+    временное представление ledger_all (рабочие + архивные записи журнала);
+    такие соединения в пул не возвращаются.
+    Функции, зарегистрированные через after_commit, выполняются после COMMIT.
+    """
+    global _last_write
+    conn = open_db_connection() if archive else get_db_connection()
+    if archive:
+        attach_archive(conn)
     cursor = conn.cursor()
+    changes = conn.total_changes
+    outer_callbacks = getattr(_commit_callbacks, "pending", None)
+    callbacks = []
+    if commit:
+        _commit_callbacks.pending = callbacks
     try:
+        if commit:
+            retry_on_busy(lambda: conn.execute("BEGIN IMMEDIATE"))
         yield cursor
         if commit:
-            conn.commit()
+            retry_on_busy(conn.commit)
+            if conn.total_changes != changes:
+                _last_write = time.monotonic()
+            for callback in callbacks:
+                callback()
     except Exception as e:
         conn.rollback()
         logger.error(f"❌ Ошибка БД: {e}")
         raise
     finally:
-        conn.close()
+        if commit:
+            _commit_callbacks.pending = outer_callbacks
+        cursor.close()
+        if archive:
+            conn.close()
+        else:
+            release_db_connection(conn)
+
+# Отложенные до COMMIT функции текущей транзакции потока
+_commit_callbacks = threading.local()
+
+def after_commit(callback):
+    """Выполнить callback после COMMIT текущей транзакции get_db_cursor в этом потоке
+
+    При откате callback отбрасывается, вне транзакции выполняется сразу.
+    Так инвалидация кэша не опережает фиксацию: иначе параллельное чтение
+    успело бы положить в кэш ещё старую строку.
+    """
+    callbacks = getattr(_commit_callbacks, "pending", None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+def is_busy_error(error: Exception) -> bool:
+    """Ошибка из-за занятой БД (SQLITE_BUSY / SQLITE_LOCKED), которую имеет смысл повторить"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+def retry_on_busy(operation, budget: float = DB_BUSY_BUDGET):
+    """Выполнить operation, повторяя при занятой БД в пределах бюджета времени
+
+    Паузы растут экспоненциально от DB_BUSY_BASE_DELAY до DB_BUSY_MAX_DELAY,
+    каждая выбирается случайно в [0, пауза] — конкурирующие писатели
+    не просыпаются одновременно. Остальные ошибки пробрасываются сразу.
+    """
+    deadline = time.monotonic() + budget
+    delay = DB_BUSY_BASE_DELAY
+    while True:
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e):
+                raise
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.inc("db.busy_failures")
+                raise
+            metrics.inc("db.busy_retries")
+            time.sleep(min(random.uniform(0, delay), remaining))
+            delay = min(delay * 2, DB_BUSY_MAX_DELAY)
+
+def fetch_records(cursor, record_type: type, sql: str, params=()) -> List[Record]:
+    """Выполнить запрос и вернуть все строки как record_type
+
+    Строки читаются обычными кортежами, без промежуточных sqlite3.Row и dict.
+    """
+    cursor.row_factory = None
+    try:
+        cursor.execute(sql, params)
+        make = record_factory(record_type, cursor.description)
+        return [make(row) for row in cursor.fetchall()]
+    finally:
+        cursor.row_factory = sqlite3.Row
+
+def fetch_record(cursor, record_type: type, sql: str, params=()) -> Optional[Record]:
+    """Первая строка запроса как record_type или None"""
+    cursor.row_factory = None
+    try:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        return record_factory(record_type, cursor.description)(row) if row else None
+    finally:
+        cursor.row_factory = sqlite3.Row
 
 # ============ ПОДКЛЮЧЕНИЕ К БД ============
 
-def get_db_connection():
-    """Получить соединение с БД"""
+_pool: List[sqlite3.Connection] = []
+_pool_lock = threading.Lock()
+# Момент последней записи (time.monotonic) — по нему определяется простой для checkpoint
+_last_write = 0.0
+
+def open_db_connection() -> sqlite3.Connection:
+    """Открыть новое соединение и применить профиль PRAGMA"""
     db_dir = Path(DB_PATH).parent
     if db_dir and not db_dir.exists():
         db_dir.mkdir(parents=True, exist_ok=True)
     
     conn = sqlite3.connect(str(DB_PATH), timeout=10.0, check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode = WAL")
-    conn.execute("PRAGMA synchronous = NORMAL")
+    for name, value in DB_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+# Часть профиля PRAGMA, которая имеет смысл для соединения только на чтение
+READ_PRAGMAS = ("cache_size", "mmap_size", "temp_store", "busy_timeout")
+
+def open_read_connection(archive: bool = False) -> sqlite3.Connection:
+    """Отдельное соединение только на чтение для потоковых выборок
+
+    Долгое чтение не занимает соединение пула. archive=True подключает
+    архив как схему archive, если файл архива уже создан.
+    """
+    conn = sqlite3.connect(Path(DB_PATH).resolve().as_uri() + "?mode=ro", uri=True,
+                           timeout=10.0, check_same_thread=False)
+    for name in READ_PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {DB_PRAGMAS[name]}")
+    conn.execute("PRAGMA query_only = ON")
+    if archive and Path(ARCHIVE_DB_PATH).exists():
+        conn.execute("ATTACH DATABASE ? AS archive", (Path(ARCHIVE_DB_PATH).resolve().as_uri() + "?mode=ro",))
     return conn
 
+def get_db_connection() -> sqlite3.Connection:
+    """Получить соединение с БД из пула"""
+    with _pool_lock:
+        if _pool:
+            return _pool.pop()
+    return open_db_connection()
+
+def release_db_connection(conn: sqlite3.Connection):
+    """Вернуть соединение в пул (лишние закрываются)"""
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if len(_pool) < DB_POOL_SIZE:
+            _pool.append(conn)
+            return
+    conn.close()
+
+def close_db_pool():
+    """Закрыть все соединения пула"""
+    with _pool_lock:
+        conns, _pool[:] = list(_pool), []
+    for conn in conns:
+        conn.close()
+
+def attach_archive(conn: sqlite3.Connection):
+    """Подключить архивную БД и объединяющие представления к соединению"""
+    conn.execute("ATTACH DATABASE ? AS archive", (str(ARCHIVE_DB_PATH),))
+    conn.execute("PRAGMA archive.journal_mode = WAL")
+    conn.execute("PRAGMA archive.synchronous = NORMAL")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS archive.ledger ({LEDGER_COLUMNS})")
+    ensure_column(conn, "ledger", "receipt_id", "TEXT", schema="archive")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_ledger_created ON ledger(created_at)")
+    conn.execute("CREATE TEMP VIEW IF NOT EXISTS ledger_all AS SELECT * FROM main.ledger UNION ALL SELECT * FROM archive.ledger")
+    conn.commit()
+
+# ============ КЭШ ТОЧЕЧНЫХ ЧТЕНИЙ ============
+
+# Заказы по id, подарки по id, пользователи по user_id. Инвалидируют
+# их функции записи ниже (через after_commit), TTL страхует от правок в обход них
+order_cache = create_cache("orders")
+gift_cache = create_cache("gifts")
+user_cache = create_cache("users")
+
+def _invalidate_orders(ids):
+    if ids:
+        after_commit(lambda: order_cache.invalidate(*ids))
+
+# Версии данных для кэша готовых текстов (render.py): heroes — топ героев,
+# stats — сводная статистика, goal — цель и собранная сумма.
+# Растут после COMMIT каждой меняющей их записи
+_data_versions = {"heroes": 0, "stats": 0, "goal": 0}
+_versions_lock = threading.Lock()
+
+def bump_data_version(*names: str):
+    """Отметить изменение данных names после фиксации текущей транзакции"""
+    def bump():
+        with _versions_lock:
+            for name in names:
+                _data_versions[name] += 1
+    after_commit(bump)
+
+def data_version(*names: str) -> tuple:
+    """Текущие версии данных names"""
+    return tuple(_data_versions[name] for name in names)
+
 # ============ ИНИЦИАЛИЗАЦИЯ БД ============
 
 def init_database():
@@ -77,52 +326,12 @@ def init_database():
                 )
             """)
             
-            # Таблица заказов
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    gift_id INTEGER NOT NULL,
-                    gift_name TEXT,
-                    amount INTEGER NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    username TEXT,
-                    payment_method TEXT,
-                    payment_details TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    confirmed_at TIMESTAMP,
-                    confirmed_by INTEGER
-                )
-            """)
-            
-            # Таблица транзакций
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    order_id INTEGER,
-                    gift_id INTEGER,
-                    gift_name TEXT,
-                    amount INTEGER NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    payment_method TEXT,
-                    payment_details TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    confirmed_at TIMESTAMP,
-                    confirmed_by INTEGER
-                )
-            """)
+            # Журнал пожертвований (заказы, транзакции и корректировки)
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS ledger ({LEDGER_COLUMNS})")
+            ensure_column(cursor, "ledger", "receipt_id", "TEXT")
             
             # Таблица топа героев
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS top_heroes (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    total_amount INTEGER DEFAULT 0,
-                    last_donate TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS top_heroes ({TOP_HEROES_COLUMNS})")
             
             # Таблица галереи
             cursor.execute("""
@@ -166,15 +375,139 @@ def init_database():
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # Счётчик цели: собрано всего (ведётся транзакциями подтверждения),
+            # последний объявленный этап в процентах и номер цели (растёт при смене)
+            ensure_column(cursor, "settings", "goal_collected", "INTEGER")
+            ensure_column(cursor, "settings", "goal_milestone", "INTEGER NOT NULL DEFAULT 0")
+            ensure_column(cursor, "settings", "goal_version", "INTEGER NOT NULL DEFAULT 0")
+            
+            # Итоги по строкам, перенесённым в архив (чтобы агрегаты оставались верными)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS stats_rollup (
+                    source TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    cnt INTEGER NOT NULL DEFAULT 0,
+                    amount INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (source, status)
+                )
+            """)
+            
+            # Таблица состояний FSM
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    expires_at REAL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            ensure_column(cursor, "fsm_storage", "expires_at", "REAL")
+            
+            # Задачи планировщика: время следующего запуска (unix) и аренда на время выполнения
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                    name TEXT PRIMARY KEY,
+                    schedule TEXT NOT NULL,
+                    next_run_at REAL NOT NULL,
+                    last_run_at REAL,
+                    last_status TEXT,
+                    lease_owner TEXT,
+                    lease_until REAL
+                )
+            """)
+            
+            # Отложенные посты в канал: status — scheduled, sending, sent, failed, cancelled
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS scheduled_posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT NOT NULL,
+                    photo TEXT,
+                    publish_at REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'scheduled',
+                    created_by INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at REAL,
+                    message_id INTEGER,
+                    error TEXT
+                )
+            """)
+            
+            # Исходящие уведомления: пишутся в той же транзакции, что и изменение,
+            # о котором сообщают; dedup_key не даёт поставить одно уведомление дважды.
+            # chat_id без типа: id пользователя числом или @канал строкой, как передали.
+            # status — pending, sending, sent, failed
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    dedup_key TEXT NOT NULL UNIQUE,
+                    chat_id NOT NULL,
+                    text TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    sent_at REAL,
+                    error TEXT
+                )
+            """)
+            
+            # История запусков задач планировщика
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS job_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_name TEXT NOT NULL,
+                    scheduled_for REAL,
+                    started_at REAL NOT NULL,
+                    finished_at REAL,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    error TEXT
+                )
+            """)
             
             # Индексы
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_status ON transactions(status)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_top_heroes_amount ON top_heroes(total_amount DESC)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_fsm_expires ON fsm_storage(expires_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_storage(updated_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job_name, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_posts_due ON scheduled_posts(status, publish_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+        
+        migrate_to_ledger()
+        
+        with get_db_cursor() as cursor:
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_ledger_status_created ON ledger(status, created_at, id)")
+            # Покрывающий индекс для сумм по статусу и по героям (статистика, цель, топ)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_ledger_status_user ON ledger(status, user_id, amount)")
+            # Каждый чек — своя запись; повторно присланный тот же чек не создаёт вторую.
+            # Прежний индекс «одна ожидающая на пару (пользователь, подарок)» склеивал
+            # разные оплаты одного подарка — убираем его
+            cursor.execute("DROP INDEX IF EXISTS idx_ledger_pending_user_gift")
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_ledger_receipt
+                ON ledger(receipt_id) WHERE receipt_id IS NOT NULL
+            """)
+            # Подписи к чекам до переноса в журнал ссылаются на прежние id транзакций
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ledger_legacy_transaction
+                ON ledger(legacy_id) WHERE source = 'transaction' AND legacy_id IS NOT NULL
+            """)
+            # Новые записи не должны получать номера, уже занятые в старых подписях
+            cursor.execute("""
+                UPDATE sqlite_sequence
+                SET seq = (SELECT MAX(legacy_id) FROM ledger WHERE source = 'transaction')
+                WHERE name = 'ledger' AND seq < (SELECT MAX(legacy_id) FROM ledger WHERE source = 'transaction')
+            """)
         
         init_default_gifts()
         init_settings()
+        with get_db_cursor() as cursor:
+            # Первый запуск со счётчиком цели: считаем по журналу один раз
+            cursor.execute("SELECT goal_collected FROM settings WHERE id = 1")
+            row = cursor.fetchone()
+            if row is not None and row[0] is None:
+                _resync_goal(cursor)
+        load_admins_sync()
         
         logger.info("✅ База данных инициализирована")
         return True
@@ -182,6 +515,80 @@ def init_database():
         logger.error(f"❌ Ошибка инициализации БД: {e}")
         raise
 
+def migrate_to_ledger():
+    """Однократный перенос orders и transactions (рабочих и архивных) в журнал
+
+    Заказы сохраняют свои id — на них ссылаются кнопки уже отправленных чеков.
+    Транзакции получают новые id выше всех заказов и всех прежних id
+    транзакций, прежний хранится в legacy_id (по нему /approve находит
+    транзакцию из старой подписи), статус 'paid' становится 'confirmed'. Архивные строки возвращаются в рабочую БД и уйдут
+    в архив заново при следующей архивации. Старые таблицы переименовываются
+    в *_legacy. Суммы в топе героев сверх подтверждённых в журнале (ручные
+    добавления) записываются строками 'adjustment'.
+    """
+    columns = "user_id, username, gift_id, gift_name, amount, payment_method, payment_details, created_at, confirmed_at, confirmed_by"
+    with get_db_cursor(archive=True) as cursor:
+        legacy = []
+        for schema in ("main", "archive"):
+            cursor.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name IN ('orders', 'transactions')")
+            legacy += [(schema, row['name']) for row in cursor.fetchall()]
+        if not legacy:
+            return
+        # Заказы первыми: их явные id не должны пересечься с выданными транзакциям
+        legacy.sort(key=lambda item: item[1] != "orders")
+        
+        # Временный индекс делает повторный запуск после сбоя безопасным
+        cursor.execute("CREATE INDEX IF NOT EXISTS main.idx_ledger_legacy ON ledger(source, legacy_id)")
+        migrated = 0
+        base = None
+        for schema, table in legacy:
+            if table == "orders":
+                cursor.execute(f"""
+                    INSERT OR IGNORE INTO main.ledger (id, source, legacy_id, status, {columns})
+                    SELECT id, 'order', id, COALESCE(status, 'pending'), {columns} FROM {schema}.orders
+                """)
+            else:
+                if base is None:
+                    # Заказы уже перенесены: новые id транзакций не совпадут ни с заказом,
+                    # ни с прежним номером транзакции
+                    base = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM main.ledger").fetchone()[0]
+                    for other_schema, other in legacy:
+                        if other == "transactions":
+                            top = cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {other_schema}.transactions").fetchone()[0]
+                            base = max(base, top)
+                cursor.execute(f"""
+                    INSERT INTO main.ledger (id, source, legacy_id, status, {columns})
+                    SELECT ? + t.id, 'transaction', t.id,
+                        CASE t.status WHEN 'paid' THEN 'confirmed' ELSE COALESCE(t.status, 'pending') END,
+                        t.user_id, u.username, t.gift_id, t.gift_name, t.amount, t.payment_method,
+                        t.payment_details, t.created_at, t.confirmed_at, t.confirmed_by
+                    FROM {schema}.transactions t LEFT JOIN main.users u ON u.user_id = t.user_id
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM main.ledger l WHERE l.source = 'transaction' AND l.legacy_id = t.id
+                    )
+                    ORDER BY t.id
+                """, (base,))
+            migrated += cursor.rowcount
+        
+        for schema, table in legacy:
+            if schema == "main":
+                cursor.execute(f"ALTER TABLE main.{table} RENAME TO {table}_legacy")
+            else:
+                cursor.execute(f"DROP TABLE archive.{table}")
+        cursor.execute("DROP INDEX main.idx_ledger_legacy")
+        # Архивные строки снова в рабочей БД — их итоги пересчитаются при архивации
+        cursor.execute("DELETE FROM main.stats_rollup")
+        
+        adjusted = _reconcile_top_heroes(cursor)
+        _resync_goal(cursor)
+        logger.info(f"✅ Журнал пожертвований: перенесено {migrated} записей, корректировок топа {adjusted}")
+
+def ensure_column(cursor, table: str, column: str, definition: str, schema: str = "main"):
+    """Добавить колонку в существующую таблицу, если её ещё нет"""
+    columns = cursor.execute(f"PRAGMA {schema}.table_info({table})").fetchall()
+    if column not in [row[1] for row in columns]:
+        cursor.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {column} {definition}")
+
 def init_settings():
     """Инициализация настроек"""
     try:
@@ -228,51 +635,77 @@ def init_default_gifts():
 def register_user_sync(user_id: int, username: str = None, first_name: str = None, last_name: str = None):
     """Регистрация пользователя"""
     try:
-        with get_db_cursor() as cursor:
-            cursor.execute("""
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, last_active)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """, (user_id, username, first_name, last_name))
+        upsert_users_sync([(user_id, username, first_name, last_name)])
     except Exception as e:
         logger.error(f"Ошибка регистрации: {e}")
 
-def get_user_sync(user_id: int) -> Optional[Dict]:
+def upsert_users_sync(users: List[tuple]) -> int:
+    """Добавить или обновить профили [(user_id, username, first_name, last_name), ...]
+
+    Существующая строка обновляется на месте (id и registered_at сохраняются),
+    last_active становится текущим временем.
+    """
+    with get_db_cursor() as cursor:
+        cursor.executemany("""
+            INSERT INTO users (user_id, username, first_name, last_name, last_active)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                last_active = excluded.last_active
+        """, users)
+        ids = [user[0] for user in users]
+        after_commit(lambda: user_cache.invalidate(*ids))
+        bump_data_version("stats")
+        return len(users)
+
+def touch_users_sync(touches: List[tuple]) -> int:
+    """Пакетно обновить last_active [(user_id, unix-время), ...] известных пользователей"""
+    with get_db_cursor() as cursor:
+        cursor.executemany("UPDATE users SET last_active = datetime(?, 'unixepoch') WHERE user_id = ?",
+                           [(seen_at, user_id) for user_id, seen_at in touches])
+        ids = [user_id for user_id, _ in touches]
+        after_commit(lambda: user_cache.invalidate(*ids))
+        return cursor.rowcount
+
+def get_user_sync(user_id: int) -> Optional[User]:
     """Получить пользователя"""
     try:
-        with get_db_cursor(commit=False) as cursor:
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        return user_cache.load(user_id, lambda: _load_user(user_id))
     except Exception as e:
         logger.error(f"Ошибка получения пользователя: {e}")
         return None
 
+def _load_user(user_id: int) -> Optional[User]:
+    with get_db_cursor(commit=False) as cursor:
+        return fetch_record(cursor, User, "SELECT * FROM users WHERE user_id = ?", (user_id,))
+
 # ============ ФУНКЦИИ ДЛЯ ПОДАРКОВ ============
 
-def get_all_gifts_sync(active_only: bool = True) -> List[Dict]:
+def get_all_gifts_sync(active_only: bool = True) -> List[Gift]:
     """Получить все подарки"""
     try:
         with get_db_cursor(commit=False) as cursor:
             if active_only:
-                cursor.execute("SELECT * FROM gifts WHERE is_active = 1 ORDER BY price")
-            else:
-                cursor.execute("SELECT * FROM gifts ORDER BY price")
-            return [dict(row) for row in cursor.fetchall()]
+                return fetch_records(cursor, Gift, "SELECT * FROM gifts WHERE is_active = 1 ORDER BY price")
+            return fetch_records(cursor, Gift, "SELECT * FROM gifts ORDER BY price")
     except Exception as e:
         logger.error(f"Ошибка получения подарков: {e}")
         return []
 
-def get_gift_by_id_sync(gift_id: int) -> Optional[Dict]:
+def get_gift_by_id_sync(gift_id: int) -> Optional[Gift]:
     """Получить подарок по ID"""
     try:
-        with get_db_cursor(commit=False) as cursor:
-            cursor.execute("SELECT * FROM gifts WHERE id = ?", (gift_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        return gift_cache.load(gift_id, lambda: _load_gift(gift_id))
     except Exception as e:
         logger.error(f"Ошибка получения подарка: {e}")
         return None
 
+def _load_gift(gift_id: int) -> Optional[Gift]:
+    with get_db_cursor(commit=False) as cursor:
+        return fetch_record(cursor, Gift, "SELECT * FROM gifts WHERE id = ?", (gift_id,))
+
 def add_gift_sync(name: str, price: int, description: str = "", icon: str = "🎁") -> int:
     """Добавить подарок"""
     try:
@@ -300,6 +733,7 @@ def update_gift_sync(gift_id: int, **kwargs) -> bool:
                 return True
             values.append(gift_id)
             cursor.execute(f"UPDATE gifts SET {', '.join(fields)} WHERE id = ?", values)
+            after_commit(lambda: gift_cache.invalidate(gift_id))
             return cursor.rowcount > 0
     except Exception as e:
         logger.error(f"Ошибка обновления подарка: {e}")
@@ -310,100 +744,245 @@ def delete_gift_sync(gift_id: int) -> bool:
     try:
         with get_db_cursor() as cursor:
             cursor.execute("DELETE FROM gifts WHERE id = ?", (gift_id,))
+            after_commit(lambda: gift_cache.invalidate(gift_id))
             return cursor.rowcount > 0
     except Exception as e:
         logger.error(f"Ошибка удаления подарка: {e}")
         return False
 
-# ============ ФУНКЦИИ ДЛЯ ЗАКАЗОВ ============
+# ============ ЖУРНАЛ ПОЖЕРТВОВАНИЙ ============
+
+def _set_status(cursor, ledger_id: int, status: str, confirmed_by: int = None) -> bool:
+    """Перевести запись журнала в новый статус, если переход разрешён"""
+    allowed = STATUS_TRANSITIONS[status]
+    placeholders = ",".join("?" * len(allowed))
+    if status in ("confirmed", "rejected"):
+        cursor.execute(f"""
+            UPDATE ledger SET status = ?, confirmed_at = CURRENT_TIMESTAMP, confirmed_by = ?
+            WHERE id = ? AND status IN ({placeholders})
+        """, (status, confirmed_by, ledger_id, *allowed))
+    else:
+        cursor.execute(f"UPDATE ledger SET status = ? WHERE id = ? AND status IN ({placeholders})",
+                     (status, ledger_id, *allowed))
+    if cursor.rowcount > 0:
+        _invalidate_orders([ledger_id])
+        bump_data_version("stats")
+        return True
+    return False
+
+def _set_status_notify(cursor, ledger_id: int, status: str, confirmed_by: int = None, notify=None) -> bool:
+    """_set_status и уведомления notify(order) об этом переходе в той же транзакции"""
+    if not _set_status(cursor, ledger_id, status, confirmed_by):
+        return False
+    if notify is not None:
+        order = fetch_record(cursor, Order, "SELECT * FROM ledger WHERE id = ?", (ledger_id,))
+        _enqueue_outbox(cursor, notify(order))
+    return True
+
+def create_donation_sync(user_id: int, gift_id: int, amount: int, username: str = None,
+                         source: str = "order", payment_method: str = None, receipt_id: str = None) -> int:
+    """Создать ожидающую запись в журнале для присланного чека
 
-def create_order_sync(user_id: int, gift_id: int, amount: int, username: str = None) -> int:
-    """Создать заказ"""
-    logger.info(f"📦 Создание заказа: user={user_id}, gift={gift_id}, amount={amount}")
+    Каждый чек — отдельная оплата и отдельная запись, даже на тот же
+    подарок. receipt_id (альбом или фото чека) делает вызов идемпотентным:
+    для уже записанного чека возвращается его запись.
+    """
+    logger.info(f"📦 Новое пожертвование ({source}): user={user_id}, gift={gift_id}, amount={amount}")
     try:
+        gift = get_gift_by_id_sync(gift_id)
+        gift_name = gift['name'] if gift else f"Подарок #{gift_id}"
         with get_db_cursor() as cursor:
-            gift = get_gift_by_id_sync(gift_id)
-            gift_name = gift['name'] if gift else f"Подарок #{gift_id}"
-            cursor.execute("""
-                INSERT INTO orders (user_id, gift_id, gift_name, amount, status, username, created_at)
-                VALUES (?, ?, ?, ?, 'pending', ?, CURRENT_TIMESTAMP)
-            """, (user_id, gift_id, gift_name, amount, username))
-            order_id = cursor.lastrowid
-            logger.info(f"✅ Заказ создан: #{order_id}")
-            return order_id
+            try:
+                cursor.execute("""
+                    INSERT INTO ledger (source, user_id, username, gift_id, gift_name, amount, status, payment_method, receipt_id, created_at)
+                    VALUES (?, ?, COALESCE(?, (SELECT username FROM users WHERE user_id = ?)), ?, ?, ?, 'pending', ?, ?, CURRENT_TIMESTAMP)
+                """, (source, user_id, username, user_id, gift_id, gift_name, amount, payment_method, receipt_id))
+            except sqlite3.IntegrityError:
+                # Этот чек уже записан (второе фото альбома, повторная отправка)
+                cursor.execute("SELECT id FROM ledger WHERE receipt_id = ?", (receipt_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    raise
+                metrics.inc("orders.duplicate_receipt")
+                logger.info(f"♻️ Чек уже записан в заказ #{row['id']}")
+                return row['id']
+            ledger_id = cursor.lastrowid
+            bump_data_version("stats")
+            metrics.inc("orders.created")
+            logger.info(f"✅ Заказ создан: #{ledger_id}")
+            return ledger_id
     except Exception as e:
         logger.error(f"Ошибка создания заказа: {e}")
         raise
 
-def get_order_sync(order_id: int) -> Optional[Dict]:
-    """Получить заказ по ID"""
+# ============ ФУНКЦИИ ДЛЯ ЗАКАЗОВ ============
+
+def create_order_sync(user_id: int, gift_id: int, amount: int, username: str = None, receipt_id: str = None) -> int:
+    """Создать заказ из каталога подарков"""
+    return create_donation_sync(user_id, gift_id, amount, username, source="order", receipt_id=receipt_id)
+
+def get_order_sync(order_id: int) -> Optional[Order]:
+    """Получить запись журнала по ID"""
     try:
-        with get_db_cursor(commit=False) as cursor:
-            cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        return order_cache.load(order_id, lambda: _load_order(order_id))
     except Exception as e:
         logger.error(f"Ошибка получения заказа: {e}")
         return None
 
-def get_pending_orders_sync(limit: int = 100) -> List[Dict]:
+def _load_order(order_id: int) -> Optional[Order]:
+    with get_db_cursor(commit=False) as cursor:
+        return fetch_record(cursor, Order, "SELECT * FROM ledger WHERE id = ?", (order_id,))
+
+def get_pending_orders_sync(limit: int = 100) -> List[Order]:
     """Получить ожидающие заказы"""
     try:
         with get_db_cursor(commit=False) as cursor:
-            cursor.execute("""
+            return fetch_records(cursor, Order, """
                 SELECT o.*, u.username as user_username, u.first_name
-                FROM orders o LEFT JOIN users u ON o.user_id = u.user_id
+                FROM ledger o LEFT JOIN users u ON o.user_id = u.user_id
                 WHERE o.status = 'pending' ORDER BY o.created_at DESC LIMIT ?
             """, (limit,))
-            return [dict(row) for row in cursor.fetchall()]
     except Exception as e:
         logger.error(f"Ошибка получения заказов: {e}")
         return []
 
-def get_all_orders_sync(limit: int = 100) -> List[Dict]:
-    """Получить все заказы"""
+def get_pending_orders_page_sync(limit: int = 10, cursor_id: int = None, direction: str = "next") -> Dict:
+    """Страница ожидающих заказов (keyset-пагинация по created_at, id)
+
+    direction: "next" — заказы старше cursor_id, "prev" — новее cursor_id,
+    "at" — начиная с cursor_id включительно. Без cursor_id — первая страница.
+    """
+    empty = {"orders": [], "has_prev": False, "has_next": False, "total": 0}
+    base = """
+        SELECT o.*, u.username as user_username, u.first_name
+        FROM ledger o LEFT JOIN users u ON o.user_id = u.user_id
+        WHERE o.status = 'pending'
+    """
+    anchor = "(SELECT created_at, id FROM ledger WHERE id = ?)"
     try:
         with get_db_cursor(commit=False) as cursor:
-            cursor.execute("SELECT * FROM orders ORDER BY created_at DESC LIMIT ?", (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+            if cursor_id is None:
+                rows = fetch_records(cursor, Order, base + " ORDER BY o.created_at DESC, o.id DESC LIMIT ?", (limit,))
+            elif direction == "prev":
+                rows = fetch_records(cursor, Order,
+                                     base + f" AND (o.created_at, o.id) > {anchor} ORDER BY o.created_at ASC, o.id ASC LIMIT ?",
+                                     (cursor_id, limit))[::-1]
+            else:
+                op = "<=" if direction == "at" else "<"
+                rows = fetch_records(cursor, Order,
+                                     base + f" AND (o.created_at, o.id) {op} {anchor} ORDER BY o.created_at DESC, o.id DESC LIMIT ?",
+                                     (cursor_id, limit))
+
+            cursor.execute("SELECT COUNT(*) FROM ledger WHERE status = 'pending'")
+            total = cursor.fetchone()[0]
+            if not rows:
+                return {**empty, "total": total}
+
+            first, last = rows[0], rows[-1]
+            cursor.execute("""
+                SELECT EXISTS(SELECT 1 FROM ledger WHERE status = 'pending' AND (created_at, id) > (?, ?))
+            """, (first.created_at, first.id))
+            has_prev = bool(cursor.fetchone()[0])
+            cursor.execute("""
+                SELECT EXISTS(SELECT 1 FROM ledger WHERE status = 'pending' AND (created_at, id) < (?, ?))
+            """, (last.created_at, last.id))
+            has_next = bool(cursor.fetchone()[0])
+
+            return {
+                "orders": rows,
+                "has_prev": has_prev,
+                "has_next": has_next,
+                "total": total
+            }
+    except Exception as e:
+        logger.error(f"Ошибка получения страницы заказов: {e}")
+        return empty
+
+def get_all_orders_sync(limit: int = 100) -> List[Order]:
+    """Получить все записи журнала (включая архивные)"""
+    try:
+        with get_db_cursor(commit=False, archive=True) as cursor:
+            return fetch_records(cursor, Order, """
+                SELECT o.*, u.username as user_username, u.first_name
+                FROM ledger_all o LEFT JOIN users u ON o.user_id = u.user_id
+                ORDER BY o.created_at DESC LIMIT ?
+            """, (limit,))
     except Exception as e:
         logger.error(f"Ошибка получения всех заказов: {e}")
         return []
 
-def confirm_order_sync(order_id: int, confirmed_by: int = None) -> bool:
-    """Подтвердить заказ"""
+def iter_records_sync(record_type: type, queries: List[tuple], chunk_size: int = DB_STREAM_CHUNK_SIZE,
+                      archive: bool = False) -> Iterator[List[Record]]:
+    """Генератор пачек записей record_type по запросам queries [(sql, params), ...]
+
+    Запросы выполняются по очереди на отдельном соединении только на чтение
+    в одной транзакции, то есть по одному снимку БД. Строки читаются через
+    fetchmany, поэтому в памяти одновременно не больше одной пачки.
+    Пока генератор не закрыт, снимок держит WAL от полного checkpoint.
+    """
+    conn = open_read_connection(archive)
+    try:
+        conn.execute("BEGIN")
+        for sql, params in queries:
+            cursor = conn.execute(sql, params)
+            make = record_factory(record_type, cursor.description)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [make(row) for row in rows]
+    finally:
+        conn.close()
+
+def iter_ledger_sync(date_from: str = None, date_to: str = None, statuses: tuple = None,
+                     chunk_size: int = DB_STREAM_CHUNK_SIZE) -> Iterator[List[Order]]:
+    """Генератор пачек записей журнала (включая архив) за период по created_at
+
+    date_from и date_to — даты 'YYYY-MM-DD' включительно.
+    Сначала идёт архив, затем рабочая БД — каждая по возрастанию id.
+    """
+    conditions, params = [], []
+    if date_from:
+        conditions.append("created_at >= date(?)")
+        params.append(date_from)
+    if date_to:
+        conditions.append("created_at < date(?, '+1 day')")
+        params.append(date_to)
+    if statuses:
+        conditions.append(f"status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    schemas = ("archive", "main") if Path(ARCHIVE_DB_PATH).exists() else ("main",)
+    queries = [(f"SELECT * FROM {schema}.ledger {where} ORDER BY id", params) for schema in schemas]
+    return iter_records_sync(Order, queries, chunk_size, archive=True)
+
+def confirm_order_sync(order_id: int, confirmed_by: int = None, notify=None) -> bool:
+    """Подтвердить заказ и добавить сумму в топ героев одной транзакцией
+
+    notify(order, position) — уведомления о подтверждении для outbox
+    (см. enqueue_outbox); они записываются в той же транзакции, поэтому
+    подтверждение без уведомления или уведомление без подтверждения
+    невозможны. position — место героя в топе уже с этой суммой.
+    """
     try:
         with get_db_cursor() as cursor:
-            cursor.execute("""
-                SELECT user_id, amount, username FROM orders 
-                WHERE id = ? AND status = 'pending'
-            """, (order_id,))
-            order = cursor.fetchone()
-            if not order:
+            if not _set_status(cursor, order_id, "confirmed", confirmed_by):
                 return False
-            
-            cursor.execute("""
-                UPDATE orders SET status = 'confirmed', confirmed_at = CURRENT_TIMESTAMP, confirmed_by = ?
-                WHERE id = ?
-            """, (confirmed_by, order_id))
-            
-            if cursor.rowcount > 0:
-                update_top_heroes_sync(order['user_id'], order['amount'], order['username'])
-                return True
-            return False
+            order = fetch_record(cursor, Order, "SELECT * FROM ledger WHERE id = ?", (order_id,))
+            _add_to_top_heroes(cursor, order['user_id'], order['amount'], order['username'])
+            _add_to_goal(cursor, order['amount'])
+            if notify is not None:
+                _enqueue_outbox(cursor, notify(order, _hero_position(cursor, order['user_id'])))
+            return True
     except Exception as e:
         logger.error(f"Ошибка подтверждения заказа: {e}")
         return False
 
-def reject_order_sync(order_id: int, confirmed_by: int = None) -> bool:
-    """Отклонить заказ"""
+def reject_order_sync(order_id: int, confirmed_by: int = None, notify=None) -> bool:
+    """Отклонить заказ; notify(order) — уведомления для outbox в той же транзакции"""
     try:
         with get_db_cursor() as cursor:
-            cursor.execute("""
-                UPDATE orders SET status = 'rejected', confirmed_at = CURRENT_TIMESTAMP, confirmed_by = ?
-                WHERE id = ? AND status = 'pending'
-            """, (confirmed_by, order_id))
-            return cursor.rowcount > 0
+            return _set_status_notify(cursor, order_id, "rejected", confirmed_by, notify)
     except Exception as e:
         logger.error(f"Ошибка отклонения заказа: {e}")
         return False
@@ -412,106 +991,258 @@ def cancel_order_sync(order_id: int) -> bool:
     """Отменить заказ"""
     try:
         with get_db_cursor() as cursor:
-            cursor.execute("UPDATE orders SET status = 'cancelled' WHERE id = ? AND status = 'pending'", (order_id,))
-            return cursor.rowcount > 0
+            return _set_status(cursor, order_id, "cancelled")
     except Exception as e:
         logger.error(f"Ошибка отмены заказа: {e}")
         return False
 
+def expire_pending_batch_sync(older_than_hours: int, after_id: int = 0, batch_size: int = 200) -> tuple:
+    """Перевести в 'expired' одну пачку зависших ожидающих записей журнала
+
+    Пачки выбираются по возрастанию id начиная после after_id, каждая — в своей
+    короткой транзакции. Возвращает (число изменённых строк, id для следующей пачки или None).
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            SELECT id, created_at < datetime('now', ?) AS stale FROM ledger
+            WHERE status = 'pending' AND id > ? ORDER BY id LIMIT ?
+        """, (f"-{older_than_hours} hours", after_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return 0, None
+        stale_ids = [row['id'] for row in rows if row['stale']]
+        touched = 0
+        if stale_ids:
+            placeholders = ",".join("?" * len(stale_ids))
+            cursor.execute(f"""
+                UPDATE ledger SET status = 'expired'
+                WHERE id IN ({placeholders}) AND status = 'pending'
+            """, stale_ids)
+            touched = cursor.rowcount
+            _invalidate_orders(stale_ids)
+            bump_data_version("stats")
+        next_id = rows[-1]['id'] if len(rows) == batch_size else None
+        return touched, next_id
+
 # ============ ФУНКЦИИ ДЛЯ ТРАНЗАКЦИЙ ============
 
-def add_transaction_sync(user_id: int, gift_id: int, amount: int, payment_method: str = None) -> int:
-    """Добавить транзакцию"""
-    try:
-        with get_db_cursor() as cursor:
-            gift = get_gift_by_id_sync(gift_id)
-            gift_name = gift['name'] if gift else f"Подарок #{gift_id}"
-            cursor.execute("""
-                INSERT INTO transactions (user_id, gift_id, gift_name, amount, status, payment_method, created_at)
-                VALUES (?, ?, ?, ?, 'pending', ?, CURRENT_TIMESTAMP)
-            """, (user_id, gift_id, gift_name, amount, payment_method))
-            return cursor.lastrowid
-    except Exception as e:
-        logger.error(f"Ошибка добавления транзакции: {e}")
-        raise
+def add_transaction_sync(user_id: int, gift_id: int, amount: int, payment_method: str = None,
+                         username: str = None, receipt_id: str = None) -> int:
+    """Добавить транзакцию (оплата по реквизитам)"""
+    return create_donation_sync(user_id, gift_id, amount, username, source="transaction",
+                                payment_method=payment_method, receipt_id=receipt_id)
 
-def update_transaction_status_sync(transaction_id: int, status: str, confirmed_by: int = None) -> bool:
-    """Обновить статус транзакции"""
+def update_transaction_status_sync(transaction_id: int, status: str, confirmed_by: int = None, notify=None) -> bool:
+    """Обновить статус транзакции (старый статус 'paid' означает 'confirmed')
+
+    notify — как у confirm_order_sync для 'confirmed' и как у reject_order_sync для остальных.
+    """
+    status = LEGACY_STATUSES.get(status, status)
+    if status == "confirmed":
+        return confirm_order_sync(transaction_id, confirmed_by, notify)
+    if status not in STATUS_TRANSITIONS:
+        logger.error(f"Недопустимый статус транзакции: {status}")
+        return False
     try:
         with get_db_cursor() as cursor:
-            cursor.execute("""
-                UPDATE transactions SET status = ?, confirmed_at = CURRENT_TIMESTAMP, confirmed_by = ?
-                WHERE id = ?
-            """, (status, confirmed_by, transaction_id))
-            return cursor.rowcount > 0
+            return _set_status_notify(cursor, transaction_id, status, confirmed_by, notify)
     except Exception as e:
         logger.error(f"Ошибка обновления статуса: {e}")
         return False
 
-def get_pending_transactions_sync(limit: int = 50) -> List[Dict]:
-    """Получить ожидающие транзакции"""
-    try:
-        with get_db_cursor(commit=False) as cursor:
-            cursor.execute("""
-                SELECT t.*, u.username, u.first_name
-                FROM transactions t LEFT JOIN users u ON t.user_id = u.user_id
-                WHERE t.status = 'pending' ORDER BY t.created_at DESC LIMIT ?
-            """, (limit,))
-            return [dict(row) for row in cursor.fetchall()]
-    except Exception as e:
-        logger.error(f"Ошибка получения транзакций: {e}")
-        return []
+def find_orders_by_number_sync(number: int) -> List[Order]:
+    """Записи журнала, на которые может указывать номер из /approve и /reject
 
-def get_all_transactions_sync(limit: int = 100) -> List[Dict]:
-    """Получить все транзакции"""
+    Номер — id записи журнала, но в подписях к чекам, отправленным до
+    переноса в журнал, стоит прежний id транзакции (legacy_id). Если номер
+    подходит к нескольким записям, выбирать должен админ.
+    """
     try:
         with get_db_cursor(commit=False) as cursor:
-            cursor.execute("""
-                SELECT t.*, u.username, u.first_name
-                FROM transactions t LEFT JOIN users u ON t.user_id = u.user_id
-                ORDER BY t.created_at DESC LIMIT ?
-            """, (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+            return fetch_records(cursor, Order, """
+                SELECT * FROM ledger WHERE id = ?
+                UNION
+                SELECT * FROM ledger WHERE source = 'transaction' AND legacy_id = ?
+                ORDER BY id
+            """, (number, number))
     except Exception as e:
-        logger.error(f"Ошибка получения транзакций: {e}")
+        logger.error(f"Ошибка поиска заказа по номеру: {e}")
         return []
 
+def get_pending_transactions_sync(limit: int = 50) -> List[Transaction]:
+    """Получить ожидающие транзакции (алиас ожидающих записей журнала)"""
+    return get_pending_orders_sync(limit)
+
+def get_all_transactions_sync(limit: int = 100) -> List[Transaction]:
+    """Получить все транзакции (алиас всех записей журнала)"""
+    return get_all_orders_sync(limit)
+
+# ============ АРХИВ ============
+
+def archive_batch_sync(older_than_days: int, batch_size: int = 500) -> int:
+    """Перенести одну пачку завершённых записей журнала старше срока в архивную БД
+
+    Сначала строки копируются в архив (повторное копирование безопасно),
+    затем в одной транзакции рабочей БД пополняются итоги stats_rollup
+    и строки удаляются. Возвращает число перенесённых строк.
+    """
+    statuses = ",".join("?" * len(FINAL_STATUSES))
+    with get_db_cursor(archive=True) as cursor:
+        cursor.execute(f"""
+            SELECT id FROM main.ledger
+            WHERE status IN ({statuses}) AND created_at < datetime('now', ?)
+            ORDER BY id LIMIT ?
+        """, (*FINAL_STATUSES, f"-{older_than_days} days", batch_size))
+        ids = [row['id'] for row in cursor.fetchall()]
+        if not ids:
+            return 0
+        placeholders = ",".join("?" * len(ids))
+        cursor.execute(f"INSERT OR IGNORE INTO archive.ledger SELECT * FROM main.ledger WHERE id IN ({placeholders})", ids)
+        cursor.execute(f"""
+            INSERT INTO stats_rollup (source, status, cnt, amount)
+            SELECT source, status, COUNT(*), COALESCE(SUM(amount), 0)
+            FROM main.ledger WHERE id IN ({placeholders}) GROUP BY source, status
+            ON CONFLICT(source, status) DO UPDATE SET
+                cnt = cnt + excluded.cnt, amount = amount + excluded.amount
+        """, ids)
+        cursor.execute(f"DELETE FROM main.ledger WHERE id IN ({placeholders})", ids)
+        _invalidate_orders(ids)
+        return len(ids)
+
 # ============ ФУНКЦИИ ДЛЯ ТОПА ГЕРОЕВ ============
 
-def update_top_heroes_sync(user_id: int, amount: int, username: str = None):
-    """Обновить топ героев"""
+def _add_to_top_heroes(cursor, user_id: int, amount: int, username: str = None):
+    """Прибавить сумму герою в рамках текущей транзакции"""
+    cursor.execute("""
+        INSERT INTO top_heroes (user_id, username, total_amount, last_donate, updated_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET
+            total_amount = total_amount + excluded.total_amount,
+            username = COALESCE(excluded.username, username),
+            last_donate = excluded.last_donate,
+            updated_at = excluded.updated_at
+    """, (user_id, username, amount))
+    bump_data_version("heroes", "stats")
+
+def update_top_heroes_sync(user_id: int, amount: int, username: str = None, added_by: int = None):
+    """Ручное добавление в топ героев: корректировка в журнале и сумма героя одной транзакцией"""
     try:
         with get_db_cursor() as cursor:
-            cursor.execute("SELECT total_amount FROM top_heroes WHERE user_id = ?", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                new_total = row[0] + amount
-                cursor.execute("""
-                    UPDATE top_heroes SET total_amount = ?, last_donate = CURRENT_TIMESTAMP, 
-                        updated_at = CURRENT_TIMESTAMP, username = COALESCE(?, username)
-                    WHERE user_id = ?
-                """, (new_total, username, user_id))
-            else:
-                cursor.execute("""
-                    INSERT INTO top_heroes (user_id, username, total_amount, last_donate)
-                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                """, (user_id, username, amount))
+            cursor.execute("""
+                INSERT INTO ledger (source, user_id, username, gift_name, amount, status, created_at, confirmed_at, confirmed_by)
+                VALUES ('adjustment', ?, ?, 'Ручное добавление', ?, 'confirmed', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?)
+            """, (user_id, username, amount, added_by))
+            _add_to_top_heroes(cursor, user_id, amount, username)
+            _add_to_goal(cursor, amount)
     except Exception as e:
         logger.error(f"Ошибка обновления топа: {e}")
 
-def get_top_heroes_sync(limit: int = 10) -> List[Dict]:
+def _reconcile_top_heroes(cursor) -> int:
+    """Записать в журнал корректировки на суммы топа сверх подтверждённых пожертвований
+
+    Курсор должен быть открыт с archive=True: суммы считаются и по архиву.
+    """
+    cursor.execute("""
+        INSERT INTO main.ledger (source, user_id, username, gift_name, amount, status, created_at, confirmed_at)
+        SELECT 'adjustment', h.user_id, h.username, 'Корректировка топа', h.total_amount - COALESCE(l.total, 0),
+            'confirmed', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM main.top_heroes h
+        LEFT JOIN (
+            SELECT user_id, SUM(amount) AS total FROM ledger_all WHERE status = 'confirmed' GROUP BY user_id
+        ) l ON l.user_id = h.user_id
+        WHERE h.total_amount > COALESCE(l.total, 0)
+    """)
+    return cursor.rowcount
+
+def rebuild_top_heroes_sync(with_stats: bool = False) -> Dict:
+    """Пересчитать топ героев по подтверждённым записям журнала (включая архив)
+
+    Новый топ собирается одним GROUP BY в теневую таблицу и подменяет
+    старый в той же транзакции записи, так что подтверждения не теряются.
+    with_stats=True заодно пересчитывает итоги stats_rollup по архиву.
+    Возвращает изменившихся героев и общее число героев.
+    """
+    with get_db_cursor(archive=True) as cursor:
+        bump_data_version("heroes", "stats")
+        cursor.execute("DROP TABLE IF EXISTS main.top_heroes_new")
+        cursor.execute(f"CREATE TABLE main.top_heroes_new ({TOP_HEROES_COLUMNS})")
+        # Голое поле username берётся из строки с MAX(...) — последнее известное имя
+        cursor.execute("""
+            INSERT INTO main.top_heroes_new (user_id, username, total_amount, last_donate, updated_at)
+            SELECT l.user_id, COALESCE(l.username, h.username), l.total, l.last_donate, CURRENT_TIMESTAMP
+            FROM (
+                SELECT user_id, username, SUM(amount) AS total,
+                    MAX(COALESCE(confirmed_at, created_at)) AS last_donate
+                FROM ledger_all WHERE status = 'confirmed' GROUP BY user_id
+            ) l LEFT JOIN main.top_heroes h ON h.user_id = l.user_id
+            WHERE l.total > 0
+        """)
+        cursor.execute("""
+            SELECT n.user_id, COALESCE(n.username, o.username) AS username,
+                COALESCE(o.total_amount, 0) AS old_amount, n.total_amount AS new_amount
+            FROM main.top_heroes_new n LEFT JOIN main.top_heroes o ON o.user_id = n.user_id
+            WHERE o.total_amount IS NOT n.total_amount
+            UNION ALL
+            SELECT o.user_id, o.username, o.total_amount, 0
+            FROM main.top_heroes o
+            WHERE o.total_amount > 0 AND o.user_id NOT IN (SELECT user_id FROM main.top_heroes_new)
+            ORDER BY 4 DESC
+        """)
+        changed = [dict(row) for row in cursor.fetchall()]
+        
+        cursor.execute("DROP TABLE main.top_heroes")
+        cursor.execute("ALTER TABLE main.top_heroes_new RENAME TO top_heroes")
+        cursor.execute("CREATE INDEX main.idx_top_heroes_amount ON top_heroes(total_amount DESC)")
+        cursor.execute("SELECT COUNT(*) FROM main.top_heroes")
+        heroes = cursor.fetchone()[0]
+        
+        if with_stats:
+            cursor.execute("DELETE FROM main.stats_rollup")
+            cursor.execute("""
+                INSERT INTO main.stats_rollup (source, status, cnt, amount)
+                SELECT source, status, COUNT(*), COALESCE(SUM(amount), 0)
+                FROM archive.ledger GROUP BY source, status
+            """)
+        _resync_goal(cursor)
+        logger.info(f"🏆 Топ героев пересобран: героев {heroes}, изменилось {len(changed)}")
+        return {"changed": changed, "heroes": heroes}
+
+def _hero_position(cursor, user_id: int) -> Optional[int]:
+    cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM top_heroes t WHERE t.total_amount > h.total_amount) + 1
+        FROM top_heroes h WHERE h.user_id = ?
+    """, (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def get_hero_position_sync(user_id: int) -> Optional[int]:
+    """Место героя в топе"""
+    try:
+        with get_db_cursor(commit=False) as cursor:
+            return _hero_position(cursor, user_id)
+    except Exception as e:
+        logger.error(f"Ошибка получения места в топе: {e}")
+        return None
+
+def get_top_heroes_sync(limit: int = 10) -> List[Hero]:
     """Получить топ героев"""
     try:
         with get_db_cursor(commit=False) as cursor:
-            cursor.execute("""
+            return fetch_records(cursor, Hero, """
                 SELECT user_id, username, total_amount, last_donate
                 FROM top_heroes WHERE total_amount > 0 ORDER BY total_amount DESC LIMIT ?
             """, (limit,))
-            return [dict(row) for row in cursor.fetchall()]
     except Exception as e:
         logger.error(f"Ошибка получения топа: {e}")
         return []
 
+def iter_top_heroes_sync(chunk_size: int = DB_STREAM_CHUNK_SIZE) -> Iterator[List[Hero]]:
+    """Генератор пачек всего топа героев по убыванию суммы"""
+    return iter_records_sync(Hero, [("""
+        SELECT user_id, username, total_amount, last_donate, updated_at
+        FROM top_heroes WHERE total_amount > 0 ORDER BY total_amount DESC
+    """, ())], chunk_size)
+
 # ============ ФУНКЦИИ ДЛЯ ГАЛЕРЕИ ============
 
 def add_gallery_photo_sync(file_id: str, description: str = "", added_by: int = None) -> int:
@@ -525,12 +1256,13 @@ def add_gallery_photo_sync(file_id: str, description: str = "", added_by: int =
         logger.error(f"Ошибка добавления фото: {e}")
         raise
 
-def get_gallery_photos_sync(limit: int = 50) -> List[Dict]:
+def get_gallery_photos_sync(limit: int = 50) -> List[GalleryPhoto]:
     """Получить фото из галереи"""
     try:
         with get_db_cursor(commit=False) as cursor:
-            cursor.execute("SELECT id, file_id, description, added_by, added_at FROM gallery ORDER BY added_at DESC LIMIT ?", (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+            return fetch_records(cursor, GalleryPhoto,
+                                 "SELECT id, file_id, description, added_by, added_at FROM gallery ORDER BY added_at DESC LIMIT ?",
+                                 (limit,))
     except Exception as e:
         logger.error(f"Ошибка получения галереи: {e}")
         return []
@@ -545,18 +1277,34 @@ def delete_gallery_photo_sync(photo_id: int) -> bool:
         logger.error(f"Ошибка удаления фото: {e}")
         return False
 
+def iter_gallery_photos_sync(chunk_size: int = DB_STREAM_CHUNK_SIZE) -> Iterator[List[GalleryPhoto]]:
+    """Генератор пачек всей галереи, новые фото первыми"""
+    return iter_records_sync(GalleryPhoto, [(
+        "SELECT id, file_id, description, added_by, added_at FROM gallery ORDER BY added_at DESC", ()
+    )], chunk_size)
+
 # ============ АДМИН ФУНКЦИИ ============
 
+_admins_lock = threading.Lock()
+
+def load_admins_sync() -> frozenset:
+    """Перечитать таблицу admins в набор админов config
+
+    Под блокировкой: последним набор заменяет тот, кто последним читал таблицу.
+    При ошибке остаётся прежний набор.
+    """
+    with _admins_lock:
+        try:
+            with get_db_cursor(commit=False) as cursor:
+                cursor.execute("SELECT user_id FROM admins")
+                return set_admin_ids(row['user_id'] for row in cursor.fetchall())
+        except Exception as e:
+            logger.error(f"Ошибка загрузки админов: {e}")
+            return None
+
 def is_admin_sync(user_id: int) -> bool:
-    """Проверка является ли пользователь админом"""
-    if user_id == SUPER_ADMIN_ID or user_id == SUPPORT_ADMIN_ID:
-        return True
-    try:
-        with get_db_cursor(commit=False) as cursor:
-            cursor.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id,))
-            return cursor.fetchone() is not None
-    except Exception:
-        return False
+    """Проверка является ли пользователь админом (без запроса к БД)"""
+    return is_admin_member(user_id)
 
 def is_super_admin_sync(user_id: int) -> bool:
     """Проверка супер-админа"""
@@ -567,6 +1315,7 @@ def add_admin_sync(user_id: int, added_by: int = None) -> bool:
     try:
         with get_db_cursor() as cursor:
             cursor.execute("INSERT OR IGNORE INTO admins (user_id, added_by) VALUES (?, ?)", (user_id, added_by))
+            after_commit(load_admins_sync)
             return cursor.rowcount > 0
     except Exception:
         return False
@@ -576,6 +1325,7 @@ def remove_admin_sync(user_id: int) -> bool:
     try:
         with get_db_cursor() as cursor:
             cursor.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
+            after_commit(load_admins_sync)
             return cursor.rowcount > 0
     except Exception:
         return False
@@ -589,6 +1339,71 @@ def log_admin_action_sync(admin_id: int, action: str, details: str = None):
     except Exception as e:
         logger.error(f"Ошибка логирования: {e}")
 
+# ============ ФУНКЦИИ ДЛЯ FSM ============
+
+def load_fsm_entry_sync(key: str) -> Optional[tuple]:
+    """Загрузить состояние, данные и срок жизни записи FSM по ключу"""
+    try:
+        with get_db_cursor(commit=False) as cursor:
+            cursor.execute("SELECT state, data, expires_at FROM fsm_storage WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return row['state'], json.loads(row['data']) if row['data'] else {}, row['expires_at']
+    except Exception as e:
+        logger.error(f"Ошибка загрузки FSM: {e}")
+        return None
+
+def save_fsm_entries_sync(entries: List[tuple]):
+    """Сохранить пачку записей FSM (key, state, data, expires_at) одной транзакцией
+
+    Записи без состояния и без данных удаляются.
+    """
+    upserts = [(key, state, json.dumps(data, ensure_ascii=False), expires_at)
+               for key, state, data, expires_at in entries if state is not None or data]
+    deletes = [(key,) for key, state, data, _ in entries if state is None and not data]
+    with get_db_cursor() as cursor:
+        if upserts:
+            cursor.executemany("""
+                INSERT INTO fsm_storage (key, state, data, expires_at, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data,
+                    expires_at = excluded.expires_at, updated_at = excluded.updated_at
+            """, upserts)
+        if deletes:
+            cursor.executemany("DELETE FROM fsm_storage WHERE key = ?", deletes)
+
+def sweep_fsm_entries_sync(now: float, max_entries: int) -> Dict[str, int]:
+    """Удалить просроченные записи FSM и самые давние сверх лимита"""
+    with get_db_cursor() as cursor:
+        cursor.execute("DELETE FROM fsm_storage WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        expired = cursor.rowcount
+        cursor.execute("SELECT COUNT(*) FROM fsm_storage")
+        overflow = cursor.fetchone()[0] - max_entries
+        evicted = 0
+        if overflow > 0:
+            cursor.execute("""
+                DELETE FROM fsm_storage WHERE key IN (
+                    SELECT key FROM fsm_storage ORDER BY updated_at ASC LIMIT ?
+                )
+            """, (overflow,))
+            evicted = cursor.rowcount
+        return {"expired": expired, "evicted": evicted}
+
+def count_fsm_states_sync() -> Dict[str, int]:
+    """Количество живых записей FSM по состояниям"""
+    try:
+        with get_db_cursor(commit=False) as cursor:
+            cursor.execute("""
+                SELECT COALESCE(state, 'none') AS state, COUNT(*) AS cnt
+                FROM fsm_storage GROUP BY state
+            """)
+            return {row['state']: row['cnt'] for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Ошибка подсчёта состояний FSM: {e}")
+        return {}
+
 # ============ СТАТИСТИКА И ЦЕЛИ ============
 
 def get_statistics_sync() -> Dict:
@@ -597,11 +1412,17 @@ def get_statistics_sync() -> Dict:
         with get_db_cursor(commit=False) as cursor:
             cursor.execute("SELECT COUNT(*) FROM users")
             total_users = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'confirmed'")
-            total_orders = cursor.fetchone()[0]
-            cursor.execute("SELECT COALESCE(SUM(amount), 0) FROM orders WHERE status = 'confirmed'")
-            total_amount = cursor.fetchone()[0] or 0
-            cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'pending'")
+            # Подтверждённые суммы из журнала по всем источникам плюс итоги архива
+            cursor.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM ledger WHERE status = 'confirmed')
+                        + COALESCE((SELECT SUM(cnt) FROM stats_rollup WHERE status = 'confirmed'), 0),
+                    (SELECT COALESCE(SUM(amount), 0) FROM ledger WHERE status = 'confirmed')
+                        + COALESCE((SELECT SUM(amount) FROM stats_rollup WHERE status = 'confirmed'), 0)
+            """)
+            total_orders, total_amount = cursor.fetchone()
+            total_amount = total_amount or 0
+            cursor.execute("SELECT COUNT(*) FROM ledger WHERE status = 'pending'")
             total_pending = cursor.fetchone()[0]
             return {
                 "total_users": total_users,
@@ -623,18 +1444,27 @@ def update_stats_cache_sync() -> Dict:
     """Обновить кэш статистики"""
     return get_statistics_sync()
 
-def get_goal_progress_sync() -> dict:
-    """Получить прогресс цели"""
-    try:
-        with get_db_cursor(commit=False) as cursor:
-            cursor.execute("SELECT goal_name, goal_amount FROM settings WHERE id = 1")
-            row = cursor.fetchone()
-            goal_name = row[0] if row else DEFAULT_GOAL_NAME
-            goal_amount = row[1] if row else DEFAULT_GOAL_AMOUNT
-    except Exception:
-        goal_name, goal_amount = DEFAULT_GOAL_NAME, DEFAULT_GOAL_AMOUNT
-    
-    collected = get_statistics_sync()['total_amount']
+# Кто формирует объявления об этапах цели: callback(goal, milestone) -> уведомления для outbox
+_goal_announcer = None
+
+# Последнее прочитанное состояние цели: (версия данных goal, строка settings)
+_goal_snapshot = None
+
+def set_goal_announcer(callback):
+    """Функция, формирующая объявления об этапах цели (см. _add_to_goal)"""
+    global _goal_announcer
+    _goal_announcer = callback
+
+def _goal_milestone(collected: int, target: int) -> int:
+    """Наибольший пройденный этап цели в процентах (0 — ни одного)"""
+    if target <= 0:
+        return 0
+    return max((m for m in GOAL_MILESTONES if collected * 100 >= m * target), default=0)
+
+def _goal_progress(row) -> dict:
+    goal_name = row['goal_name'] if row else DEFAULT_GOAL_NAME
+    goal_amount = row['goal_amount'] if row else DEFAULT_GOAL_AMOUNT
+    collected = (row['goal_collected'] if row else None) or 0
     percent = min(int(collected / goal_amount * 100), 100) if goal_amount > 0 else 0
     bars = "█" * (percent // 5) + "░" * (20 - (percent // 5))
     
@@ -644,15 +1474,97 @@ def get_goal_progress_sync() -> dict:
         "collected": collected,
         "percent": percent,
         "bars": bars,
-        "remaining": max(0, goal_amount - collected)
+        "remaining": max(0, goal_amount - collected),
+        "milestone": row['goal_milestone'] if row else 0,
+        "version": row['goal_version'] if row else 0,
     }
 
+_GOAL_COLUMNS = "goal_name, goal_amount, goal_collected, goal_milestone, goal_version"
+
+def _add_to_goal(cursor, amount: int):
+    """Прибавить подтверждённую сумму к цели в рамках текущей транзакции
+
+    Если сумма перевела цель через новый этап (GOAL_MILESTONES), этап
+    запоминается в settings и объявление ставится в outbox той же
+    транзакцией — каждый этап объявляется один раз, даже если сумма
+    потом уменьшится корректировкой. Пройденные разом этапы объявляются
+    одним сообщением о наибольшем.
+    """
+    cursor.execute(f"UPDATE settings SET goal_collected = COALESCE(goal_collected, 0) + ? WHERE id = 1 RETURNING {_GOAL_COLUMNS}",
+                   (amount,))
+    row = cursor.fetchone()
+    if row is None:
+        return
+    bump_data_version("goal")
+    milestone = _goal_milestone(row['goal_collected'], row['goal_amount'])
+    if milestone <= row['goal_milestone']:
+        return
+    cursor.execute("UPDATE settings SET goal_milestone = ? WHERE id = 1", (milestone,))
+    metrics.inc("goal.milestones")
+    logger.info(f"🎯 Цель «{row['goal_name']}»: пройден этап {milestone}%")
+    if _goal_announcer is not None:
+        goal = _goal_progress(row)
+        goal['milestone'] = milestone
+        _enqueue_outbox(cursor, _goal_announcer(goal, milestone))
+
+def _resync_goal(cursor):
+    """Пересчитать собранную сумму по журналу и итогам архива без объявлений
+
+    Этапы, пройденные за время пересчёта, отмечаются как объявленные.
+    """
+    cursor.execute("""
+        SELECT (SELECT COALESCE(SUM(amount), 0) FROM main.ledger WHERE status = 'confirmed')
+            + COALESCE((SELECT SUM(amount) FROM main.stats_rollup WHERE status = 'confirmed'), 0)
+    """)
+    collected = cursor.fetchone()[0]
+    cursor.execute("SELECT goal_amount, goal_milestone FROM main.settings WHERE id = 1")
+    row = cursor.fetchone()
+    if row is None:
+        return
+    milestone = max(row['goal_milestone'], _goal_milestone(collected, row['goal_amount']))
+    cursor.execute("UPDATE main.settings SET goal_collected = ?, goal_milestone = ? WHERE id = 1", (collected, milestone))
+    bump_data_version("goal")
+
+def get_goal_progress_sync() -> dict:
+    """Получить прогресс цели
+
+    Собранная сумма берётся из счётчика в settings, а не пересчётом
+    статистики; прочитанная строка хранится в памяти до следующего
+    изменения цели (версия данных goal).
+    """
+    global _goal_snapshot
+    # Версию читаем до запроса в БД: запись, успевшая после, сменит версию
+    version = data_version("goal")
+    snapshot = _goal_snapshot
+    if snapshot is not None and snapshot[0] == version:
+        return _goal_progress(snapshot[1])
+    try:
+        with get_db_cursor(commit=False) as cursor:
+            cursor.execute(f"SELECT {_GOAL_COLUMNS} FROM settings WHERE id = 1")
+            row = cursor.fetchone()
+    except Exception:
+        return _goal_progress(None)
+    row = dict(row) if row else None
+    _goal_snapshot = (version, row)
+    return _goal_progress(row)
+
 def set_goal_sync(goal_name: str, goal_amount: int) -> bool:
-    """Установить цель"""
+    """Установить цель
+
+    Этапы, уже пройденные собранной суммой, новой цели не объявляются:
+    их показывает пост о новом сборе.
+    """
     try:
         with get_db_cursor() as cursor:
-            cursor.execute("UPDATE settings SET goal_name = ?, goal_amount = ?, updated_at = CURRENT_TIMESTAMP WHERE id = 1",
-                         (goal_name, goal_amount))
+            cursor.execute("SELECT goal_collected FROM settings WHERE id = 1")
+            row = cursor.fetchone()
+            milestone = _goal_milestone((row[0] if row else None) or 0, goal_amount)
+            cursor.execute("""
+                UPDATE settings SET goal_name = ?, goal_amount = ?, goal_milestone = ?,
+                    goal_version = goal_version + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = 1
+            """, (goal_name, goal_amount, milestone))
+            bump_data_version("goal")
             return cursor.rowcount > 0
     except Exception as e:
         logger.error(f"Ошибка установки цели: {e}")
@@ -670,33 +1582,283 @@ def update_goal_sync(goal_name: str = None, goal_amount: int = None) -> bool:
         goal_amount = goal['target']
     return set_goal_sync(goal_name, goal_amount)
 
+# ============ ПЛАНИРОВЩИК ============
+
+def load_jobs_sync() -> Dict[str, Dict]:
+    """Сохранённое состояние задач планировщика по имени"""
+    with get_db_cursor(commit=False) as cursor:
+        cursor.execute("SELECT name, schedule, next_run_at, last_run_at, last_status, lease_owner, lease_until FROM scheduled_jobs")
+        return {row['name']: dict(row) for row in cursor.fetchall()}
+
+def save_job_sync(name: str, schedule: str, next_run_at: float):
+    """Записать расписание задачи и время следующего запуска"""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO scheduled_jobs (name, schedule, next_run_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET schedule = excluded.schedule, next_run_at = excluded.next_run_at
+        """, (name, schedule, next_run_at))
+
+def start_job_run_sync(name: str, owner: str, scheduled_for: float, now: float, lease_until: float) -> Optional[int]:
+    """Взять аренду задачи и записать начало запуска
+
+    Аренда не даёт запустить задачу второй раз, пока она выполняется,
+    в том числе другому процессу бота (например, при перекрытии деплоев).
+    Запуски, оставшиеся в 'running' после падения, помечаются 'interrupted'.
+    Возвращает id записи истории или None, если аренда занята.
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            UPDATE scheduled_jobs SET lease_owner = ?, lease_until = ?
+            WHERE name = ? AND (lease_until IS NULL OR lease_until <= ?)
+        """, (owner, lease_until, name, now))
+        if cursor.rowcount == 0:
+            return None
+        cursor.execute("UPDATE job_runs SET status = 'interrupted' WHERE job_name = ? AND status = 'running'", (name,))
+        cursor.execute("INSERT INTO job_runs (job_name, scheduled_for, started_at) VALUES (?, ?, ?)",
+                       (name, scheduled_for, now))
+        return cursor.lastrowid
+
+def finish_job_run_sync(run_id: int, name: str, owner: str, status: str, error: Optional[str],
+                        finished_at: float, next_run_at: float, keep_runs: int = 100):
+    """Записать итог запуска, следующий запуск и снять аренду; история — последние keep_runs запусков"""
+    with get_db_cursor() as cursor:
+        cursor.execute("UPDATE job_runs SET finished_at = ?, status = ?, error = ? WHERE id = ?",
+                       (finished_at, status, error, run_id))
+        cursor.execute("""
+            UPDATE scheduled_jobs
+            SET next_run_at = ?, last_run_at = ?, last_status = ?, lease_owner = NULL, lease_until = NULL
+            WHERE name = ? AND lease_owner = ?
+        """, (next_run_at, finished_at, status, name, owner))
+        cursor.execute("""
+            DELETE FROM job_runs WHERE job_name = ? AND id <= (
+                SELECT id FROM job_runs WHERE job_name = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+            )
+        """, (name, name, keep_runs))
+
+def get_job_runs_sync(name: str = None, limit: int = 20) -> List[Dict]:
+    """Последние запуски задач (всех или одной)"""
+    with get_db_cursor(commit=False) as cursor:
+        if name:
+            cursor.execute("SELECT * FROM job_runs WHERE job_name = ? ORDER BY id DESC LIMIT ?", (name, limit))
+        else:
+            cursor.execute("SELECT * FROM job_runs ORDER BY id DESC LIMIT ?", (limit,))
+        return [dict(row) for row in cursor.fetchall()]
+
+# ============ ОТЛОЖЕННЫЕ ПОСТЫ ============
+
+def add_scheduled_post_sync(text: str, photo: Optional[str], publish_at: float, created_by: int = None) -> int:
+    """Запланировать пост в канал на publish_at (unix)"""
+    with get_db_cursor() as cursor:
+        cursor.execute("INSERT INTO scheduled_posts (text, photo, publish_at, created_by) VALUES (?, ?, ?, ?)",
+                       (text, photo, publish_at, created_by))
+        return cursor.lastrowid
+
+def get_scheduled_posts_sync(limit: int = 20) -> List[Dict]:
+    """Ожидающие публикации посты, ближайшие первыми"""
+    with get_db_cursor(commit=False) as cursor:
+        cursor.execute("""
+            SELECT id, text, photo, publish_at, created_by FROM scheduled_posts
+            WHERE status = 'scheduled' ORDER BY publish_at LIMIT ?
+        """, (limit,))
+        return [dict(row) for row in cursor.fetchall()]
+
+def cancel_scheduled_post_sync(post_id: int) -> bool:
+    """Отменить пост, если он ещё не начал публиковаться"""
+    with get_db_cursor() as cursor:
+        cursor.execute("UPDATE scheduled_posts SET status = 'cancelled' WHERE id = ? AND status = 'scheduled'", (post_id,))
+        return cursor.rowcount > 0
+
+def next_scheduled_post_at_sync() -> Optional[float]:
+    """Время ближайшего ожидающего поста (по индексу status, publish_at)"""
+    with get_db_cursor(commit=False) as cursor:
+        cursor.execute("SELECT MIN(publish_at) FROM scheduled_posts WHERE status = 'scheduled'")
+        return cursor.fetchone()[0]
+
+def claim_due_posts_sync(now: float, limit: int = 10) -> List[Dict]:
+    """Забрать подошедшие посты на публикацию (scheduled -> sending)"""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            UPDATE scheduled_posts SET status = 'sending'
+            WHERE id IN (
+                SELECT id FROM scheduled_posts WHERE status = 'scheduled' AND publish_at <= ?
+                ORDER BY publish_at LIMIT ?
+            )
+            RETURNING id, text, photo, publish_at, created_by
+        """, (now, limit))
+        return sorted((dict(row) for row in cursor.fetchall()), key=lambda post: post['publish_at'])
+
+def finish_scheduled_post_sync(post_id: int, status: str, message_id: int = None, error: str = None):
+    """Записать итог публикации поста"""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            UPDATE scheduled_posts SET status = ?, message_id = ?, error = ?, sent_at = ?
+            WHERE id = ? AND status = 'sending'
+        """, (status, message_id, error, time.time(), post_id))
+
+def requeue_sending_posts_sync() -> int:
+    """Вернуть в очередь посты, публикация которых прервалась остановкой бота"""
+    with get_db_cursor() as cursor:
+        cursor.execute("UPDATE scheduled_posts SET status = 'scheduled' WHERE status = 'sending'")
+        return cursor.rowcount
+
+# ============ ИСХОДЯЩИЕ УВЕДОМЛЕНИЯ (OUTBOX) ============
+
+# Вызывается после COMMIT транзакции, поставившей уведомления (из потока БД)
+_outbox_listener = None
+
+def set_outbox_listener(callback):
+    """Функция, которую будить после постановки уведомлений (воркер доставки)"""
+    global _outbox_listener
+    _outbox_listener = callback
+
+def _outbox_enqueued():
+    if _outbox_listener is not None:
+        _outbox_listener()
+
+def _enqueue_outbox(cursor, messages) -> int:
+    """Поставить уведомления в outbox в рамках текущей транзакции
+
+    messages — (dedup_key, chat_id, text); уведомление с уже известным
+    dedup_key пропускается. Воркер доставки будится после COMMIT.
+    Возвращает число поставленных.
+    """
+    now = time.time()
+    added = 0
+    for dedup_key, chat_id, text in messages or ():
+        cursor.execute("""
+            INSERT INTO outbox (dedup_key, chat_id, text, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(dedup_key) DO NOTHING
+        """, (dedup_key, chat_id, text, now, now))
+        added += cursor.rowcount
+    if added:
+        metrics.inc("outbox.enqueued", added)
+        after_commit(_outbox_enqueued)
+    return added
+
+def enqueue_outbox_sync(messages) -> int:
+    """Поставить уведомления отдельной транзакцией"""
+    with get_db_cursor() as cursor:
+        return _enqueue_outbox(cursor, messages)
+
+def next_outbox_at_sync() -> Optional[float]:
+    """Время ближайшей попытки доставки (по индексу status, next_attempt_at)"""
+    with get_db_cursor(commit=False) as cursor:
+        cursor.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'")
+        return cursor.fetchone()[0]
+
+def claim_outbox_sync(now: float, limit: int = 20) -> List[Dict]:
+    """Забрать подошедшие уведомления на доставку (pending -> sending)"""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            UPDATE outbox SET status = 'sending', attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM outbox WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at LIMIT ?
+            )
+            RETURNING id, dedup_key, chat_id, text, attempts
+        """, (now, limit))
+        return sorted((dict(row) for row in cursor.fetchall()), key=lambda message: message['id'])
+
+def finish_outbox_sync(message_id: int, status: str, error: str = None, next_attempt_at: float = None):
+    """Итог попытки: 'sent', 'failed' или 'pending' с временем следующей попытки"""
+    with get_db_cursor() as cursor:
+        cursor.execute("""
+            UPDATE outbox SET status = ?, error = ?, sent_at = ?,
+                next_attempt_at = COALESCE(?, next_attempt_at)
+            WHERE id = ? AND status = 'sending'
+        """, (status, error, time.time() if status == "sent" else None, next_attempt_at, message_id))
+
+def requeue_sending_outbox_sync() -> int:
+    """Вернуть в очередь уведомления, доставка которых прервалась остановкой бота"""
+    with get_db_cursor() as cursor:
+        cursor.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+        return cursor.rowcount
+
+def prune_outbox_sync(older_than_days: int) -> int:
+    """Удалить доставленные и брошенные уведомления старше срока"""
+    with get_db_cursor() as cursor:
+        cursor.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < ?",
+                       (time.time() - older_than_days * 86400,))
+        return cursor.rowcount
+
+def count_outbox_sync() -> Dict[str, int]:
+    """Число уведомлений по статусам"""
+    with get_db_cursor(commit=False) as cursor:
+        cursor.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+# ============ ОБСЛУЖИВАНИЕ БД ============
+
+def seconds_since_write() -> float:
+    """Сколько секунд прошло с последней записи в БД"""
+    return time.monotonic() - _last_write
+
+def wal_size() -> int:
+    """Текущий размер WAL-файла в байтах"""
+    try:
+        return os.path.getsize(f"{DB_PATH}-wal")
+    except OSError:
+        return 0
+
+def checkpoint_wal_sync(mode: str = "PASSIVE") -> Dict[str, int]:
+    """Перенести кадры WAL в основной файл
+
+    PASSIVE не ждёт читателей и писателей: переносит то, что можно
+    прямо сейчас. lag — кадры, оставшиеся в WAL после checkpoint.
+    """
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"Неизвестный режим checkpoint: {mode}")
+    with get_db_cursor(commit=False) as cursor:
+        cursor.execute(f"PRAGMA wal_checkpoint({mode})")
+        busy, wal_frames, checkpointed = cursor.fetchone()
+    return {"busy": busy, "wal_frames": max(wal_frames, 0), "lag": max(wal_frames - checkpointed, 0)}
+
+def optimize_database_sync():
+    """Обновить статистику планировщика
+
+    ANALYZE с analysis_limit ограничивает число просматриваемых строк
+    на индекс, поэтому на больших таблицах он занимает доли секунды.
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute("PRAGMA analysis_limit = 1000")
+        cursor.execute("ANALYZE")
+        cursor.execute("PRAGMA optimize")
+
 # ============ АСИНХРОННЫЕ ОБЁРТКИ ============
 
 async def init_db(): return await asyncio.to_thread(init_database)
 async def register_user(user_id, username=None, first_name=None, last_name=None): return await asyncio.to_thread(register_user_sync, user_id, username, first_name, last_name)
-async def get_user(user_id): return await asyncio.to_thread(get_user_sync, user_id)
+async def upsert_users(users): return await asyncio.to_thread(upsert_users_sync, users)
+async def touch_users(touches): return await asyncio.to_thread(touch_users_sync, touches)
+async def get_user(user_id): return user_cache.get(user_id) or await asyncio.to_thread(get_user_sync, user_id)
 async def get_all_gifts(active_only=True): return await asyncio.to_thread(get_all_gifts_sync, active_only)
-async def get_gift_by_id(gift_id): return await asyncio.to_thread(get_gift_by_id_sync, gift_id)
+async def get_gift_by_id(gift_id): return gift_cache.get(gift_id) or await asyncio.to_thread(get_gift_by_id_sync, gift_id)
 async def add_gift(name, price, description="", icon="🎁"): return await asyncio.to_thread(add_gift_sync, name, price, description, icon)
 async def update_gift(gift_id, **kwargs): return await asyncio.to_thread(update_gift_sync, gift_id, **kwargs)
 async def delete_gift(gift_id): return await asyncio.to_thread(delete_gift_sync, gift_id)
-async def create_order(user_id, gift_id, amount, username=None): return await asyncio.to_thread(create_order_sync, user_id, gift_id, amount, username)
-async def get_order(order_id): return await asyncio.to_thread(get_order_sync, order_id)
+async def create_order(user_id, gift_id, amount, username=None, receipt_id=None): return await asyncio.to_thread(create_order_sync, user_id, gift_id, amount, username, receipt_id)
+async def get_order(order_id): return order_cache.get(order_id) or await asyncio.to_thread(get_order_sync, order_id)
 async def get_pending_orders(limit=100): return await asyncio.to_thread(get_pending_orders_sync, limit)
+async def get_pending_orders_page(limit=10, cursor_id=None, direction="next"): return await asyncio.to_thread(get_pending_orders_page_sync, limit, cursor_id, direction)
 async def get_all_orders(limit=100): return await asyncio.to_thread(get_all_orders_sync, limit)
-async def confirm_order(order_id, confirmed_by=None): return await asyncio.to_thread(confirm_order_sync, order_id, confirmed_by)
-async def reject_order(order_id, confirmed_by=None): return await asyncio.to_thread(reject_order_sync, order_id, confirmed_by)
+async def confirm_order(order_id, confirmed_by=None, notify=None): return await asyncio.to_thread(confirm_order_sync, order_id, confirmed_by, notify)
+async def reject_order(order_id, confirmed_by=None, notify=None): return await asyncio.to_thread(reject_order_sync, order_id, confirmed_by, notify)
 async def cancel_order(order_id): return await asyncio.to_thread(cancel_order_sync, order_id)
-async def add_transaction(user_id, gift_id, amount, payment_method=None): return await asyncio.to_thread(add_transaction_sync, user_id, gift_id, amount, payment_method)
-async def update_transaction_status(transaction_id, status, confirmed_by=None): return await asyncio.to_thread(update_transaction_status_sync, transaction_id, status, confirmed_by)
+async def expire_pending_batch(older_than_hours, after_id=0, batch_size=200): return await asyncio.to_thread(expire_pending_batch_sync, older_than_hours, after_id, batch_size)
+async def add_transaction(user_id, gift_id, amount, payment_method=None, username=None, receipt_id=None): return await asyncio.to_thread(add_transaction_sync, user_id, gift_id, amount, payment_method, username, receipt_id)
+async def update_transaction_status(transaction_id, status, confirmed_by=None, notify=None): return await asyncio.to_thread(update_transaction_status_sync, transaction_id, status, confirmed_by, notify)
+async def find_orders_by_number(number): return await asyncio.to_thread(find_orders_by_number_sync, number)
 async def get_pending_transactions(limit=50): return await asyncio.to_thread(get_pending_transactions_sync, limit)
 async def get_all_transactions(limit=100): return await asyncio.to_thread(get_all_transactions_sync, limit)
-async def update_top_heroes(user_id, amount, username=None): return await asyncio.to_thread(update_top_heroes_sync, user_id, amount, username)
+async def archive_batch(older_than_days, batch_size=500): return await asyncio.to_thread(archive_batch_sync, older_than_days, batch_size)
+async def update_top_heroes(user_id, amount, username=None, added_by=None): return await asyncio.to_thread(update_top_heroes_sync, user_id, amount, username, added_by)
+async def rebuild_top_heroes(with_stats=False): return await asyncio.to_thread(rebuild_top_heroes_sync, with_stats)
+async def get_hero_position(user_id): return await asyncio.to_thread(get_hero_position_sync, user_id)
 async def get_top_heroes(limit=10): return await asyncio.to_thread(get_top_heroes_sync, limit)
 async def add_gallery_photo(file_id, description="", added_by=None): return await asyncio.to_thread(add_gallery_photo_sync, file_id, description, added_by)
 async def get_gallery_photos(limit=50): return await asyncio.to_thread(get_gallery_photos_sync, limit)
 async def delete_gallery_photo(photo_id): return await asyncio.to_thread(delete_gallery_photo_sync, photo_id)
-async def is_admin(user_id): return await asyncio.to_thread(is_admin_sync, user_id)
+async def is_admin(user_id): return is_admin_sync(user_id)
 async def is_super_admin(user_id): return await asyncio.to_thread(is_super_admin_sync, user_id)
 async def add_admin(user_id, added_by=None): return await asyncio.to_thread(add_admin_sync, user_id, added_by)
 async def remove_admin(user_id): return await asyncio.to_thread(remove_admin_sync, user_id)
@@ -707,6 +1869,77 @@ async def update_stats_cache(): return await asyncio.to_thread(update_stats_cach
 async def get_goal_progress(): return await asyncio.to_thread(get_goal_progress_sync)
 async def set_goal(goal_name, goal_amount): return await asyncio.to_thread(set_goal_sync, goal_name, goal_amount)
 async def update_goal(goal_name=None, goal_amount=None): return await asyncio.to_thread(update_goal_sync, goal_name, goal_amount)
+async def load_jobs(): return await asyncio.to_thread(load_jobs_sync)
+async def save_job(name, schedule, next_run_at): return await asyncio.to_thread(save_job_sync, name, schedule, next_run_at)
+async def start_job_run(name, owner, scheduled_for, now, lease_until): return await asyncio.to_thread(start_job_run_sync, name, owner, scheduled_for, now, lease_until)
+async def finish_job_run(run_id, name, owner, status, error, finished_at, next_run_at, keep_runs=100): return await asyncio.to_thread(finish_job_run_sync, run_id, name, owner, status, error, finished_at, next_run_at, keep_runs)
+async def get_job_runs(name=None, limit=20): return await asyncio.to_thread(get_job_runs_sync, name, limit)
+async def add_scheduled_post(text, photo, publish_at, created_by=None): return await asyncio.to_thread(add_scheduled_post_sync, text, photo, publish_at, created_by)
+async def get_scheduled_posts(limit=20): return await asyncio.to_thread(get_scheduled_posts_sync, limit)
+async def cancel_scheduled_post(post_id): return await asyncio.to_thread(cancel_scheduled_post_sync, post_id)
+async def next_scheduled_post_at(): return await asyncio.to_thread(next_scheduled_post_at_sync)
+async def claim_due_posts(now, limit=10): return await asyncio.to_thread(claim_due_posts_sync, now, limit)
+async def finish_scheduled_post(post_id, status, message_id=None, error=None): return await asyncio.to_thread(finish_scheduled_post_sync, post_id, status, message_id, error)
+async def requeue_sending_posts(): return await asyncio.to_thread(requeue_sending_posts_sync)
+async def enqueue_outbox(messages): return await asyncio.to_thread(enqueue_outbox_sync, messages)
+async def next_outbox_at(): return await asyncio.to_thread(next_outbox_at_sync)
+async def claim_outbox(now, limit=20): return await asyncio.to_thread(claim_outbox_sync, now, limit)
+async def finish_outbox(message_id, status, error=None, next_attempt_at=None): return await asyncio.to_thread(finish_outbox_sync, message_id, status, error, next_attempt_at)
+async def requeue_sending_outbox(): return await asyncio.to_thread(requeue_sending_outbox_sync)
+async def prune_outbox(older_than_days): return await asyncio.to_thread(prune_outbox_sync, older_than_days)
+async def count_outbox(): return await asyncio.to_thread(count_outbox_sync)
+async def checkpoint_wal(mode="PASSIVE"): return await asyncio.to_thread(checkpoint_wal_sync, mode)
+async def optimize_database(): return await asyncio.to_thread(optimize_database_sync)
+
+# ============ ПОТОКОВОЕ ЧТЕНИЕ ============
+
+async def stream_chunks(chunks: Iterator[List[Record]]) -> AsyncIterator[List[Record]]:
+    """Асинхронный итератор пачек синхронного генератора chunks
+
+    Следующая пачка читается в отдельном потоке только после того, как
+    потребитель запросил её, поэтому чтение не обгоняет обработку
+    и в памяти держится одна пачка. Генератор закрывается вместе с итератором.
+    """
+    try:
+        while True:
+            rows = await asyncio.to_thread(next, chunks, None)
+            if rows is None:
+                return
+            yield rows
+    finally:
+        try:
+            chunks.close()
+        except ValueError:
+            # Отмена посреди чтения: генератор ещё выполняется в потоке
+            # и закроет соединение, когда будет собран
+            pass
+
+async def stream_rows(chunks: Iterator[List[Record]]) -> AsyncIterator[Record]:
+    """Асинхронный итератор отдельных записей генератора пачек chunks"""
+    async for rows in stream_chunks(chunks):
+        for row in rows:
+            yield row
+
+def iter_orders(statuses: tuple = None, date_from: str = None, date_to: str = None,
+                chunk_size: int = DB_STREAM_CHUNK_SIZE) -> AsyncIterator[Order]:
+    """Все записи журнала (включая архив) по одной; фильтры как у iter_ledger_sync"""
+    return stream_rows(iter_ledger_sync(date_from, date_to, statuses, chunk_size))
+
+def iter_transactions(statuses: tuple = None, date_from: str = None, date_to: str = None,
+                      chunk_size: int = DB_STREAM_CHUNK_SIZE) -> AsyncIterator[Transaction]:
+    """Все транзакции по одной (алиас iter_orders, как get_all_transactions)"""
+    return iter_orders(statuses, date_from, date_to, chunk_size)
+
+def iter_ledger_chunks(date_from: str = None, date_to: str = None, statuses: tuple = None,
+                       chunk_size: int = DB_STREAM_CHUNK_SIZE) -> AsyncIterator[List[Order]]:
+    """Записи журнала пачками — для выгрузок, которые пишут пачку целиком"""
+    return stream_chunks(iter_ledger_sync(date_from, date_to, statuses, chunk_size))
+
+def iter_top_heroes(chunk_size: int = DB_STREAM_CHUNK_SIZE) -> AsyncIterator[Hero]:
+    return stream_rows(iter_top_heroes_sync(chunk_size))
+
+def iter_gallery_photos(chunk_size: int = DB_STREAM_CHUNK_SIZE) -> AsyncIterator[GalleryPhoto]:
+    return stream_rows(iter_gallery_photos_sync(chunk_size))
 
 # ============ ИНИЦИАЛИЗАЦИЯ ============
 init_database()
@@ -0,0 +1,64 @@
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+from typing import List, Tuple
+
+import aiofiles
+
+import metrics
+from config import EXPORT_CHUNK_SIZE
+from database import iter_ledger_chunks, FINAL_STATUSES
+from records import Order
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_STATUSES = ("pending",) + FINAL_STATUSES
+EXPORT_COLUMNS = (
+    "id", "source", "legacy_id", "created_at", "confirmed_at", "confirmed_by",
+    "user_id", "username", "gift_id", "gift_name", "amount", "status", "payment_method"
+)
+_pick = Order.picker(*EXPORT_COLUMNS)
+
+# ============ ЭКСПОРТ ЖУРНАЛА ============
+
+def format_rows(rows: List[Order], fmt: str) -> str:
+    """Пачка строк журнала в виде текста CSV или JSONL"""
+    if fmt == "jsonl":
+        return "".join(json.dumps(dict(zip(EXPORT_COLUMNS, _pick(row))), ensure_ascii=False) + "\n" for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(map(_pick, rows))
+    return buffer.getvalue()
+
+async def export_ledger(fmt: str = "csv", date_from: str = None, date_to: str = None,
+                        statuses: tuple = None) -> Tuple[str, int]:
+    """Выгрузить журнал во временный файл, вернуть (путь, число строк)
+
+    Пачки читаются из БД потоково (iter_ledger_chunks) и дописываются в файл
+    через aiofiles, так что ни память, ни цикл событий не зависят от объёма.
+    Удалить файл после отправки должен вызывающий.
+    """
+    fd, path = tempfile.mkstemp(prefix="ledger_", suffix=f".{fmt}")
+    os.close(fd)
+    chunks = iter_ledger_chunks(date_from, date_to, statuses, EXPORT_CHUNK_SIZE)
+    count = 0
+    try:
+        async with aiofiles.open(path, "w", encoding="utf-8", newline="") as f:
+            if fmt == "csv":
+                # BOM — чтобы Excel сразу открыл кириллицу
+                await f.write("\ufeff" + ",".join(EXPORT_COLUMNS) + "\r\n")
+            async for rows in chunks:
+                await f.write(format_rows(rows, fmt))
+                count += len(rows)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        await chunks.aclose()
+
+    metrics.inc("export.rows", count)
+    logger.info(f"📤 Выгрузка журнала: {count} строк ({fmt})")
+    return path, count
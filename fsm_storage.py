@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import metrics
+from config import (
+    FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL, FSM_DEFAULT_TTL, FSM_STATE_TTLS,
+    FSM_SWEEP_INTERVAL, FSM_MAX_ENTRIES
+)
+from database import load_fsm_entry_sync, save_fsm_entries_sync, sweep_fsm_entries_sync, count_fsm_states_sync
+
+logger = logging.getLogger(__name__)
+
+# (состояние, данные, момент истечения по time.time())
+Entry = Tuple[Optional[str], Dict[str, Any], Optional[float]]
+EMPTY: Entry = (None, {}, None)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite с LRU-кэшем в памяти и отложенной записью
+
+    Чтение обслуживается из кэша, изменения копятся и сбрасываются в БД
+    одной транзакцией раз в flush_interval секунд и при закрытии.
+    Записи живут не дольше TTL своей группы состояний; фоновая очистка
+    удаляет просроченные и держит общее число записей в пределах max_entries.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = FSM_CACHE_SIZE,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        default_ttl: int = FSM_DEFAULT_TTL,
+        state_ttls: Dict[str, int] = None,
+        sweep_interval: int = FSM_SWEEP_INTERVAL,
+        max_entries: int = FSM_MAX_ENTRIES,
+    ):
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.default_ttl = default_ttl
+        self.state_ttls = FSM_STATE_TTLS if state_ttls is None else state_ttls
+        self.sweep_interval = sweep_interval
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, Entry]" = OrderedDict()
+        self._dirty: Dict[str, Entry] = {}
+        self._flushing: Dict[str, Entry] = {}
+        self._flush_lock = asyncio.Lock()
+        self._tasks = []
+        self._closed = False
+
+    def ttl_for(self, state: Optional[str]) -> int:
+        """TTL записи по группе состояния ("PaymentStates:waiting_for_receipt" -> "PaymentStates")"""
+        if not state:
+            return self.default_ttl
+        return self.state_ttls.get(state.split(":", 1)[0], self.default_ttl)
+
+    # ============ КЭШ ============
+
+    async def _get_entry(self, key: StorageKey) -> Entry:
+        k = self.key_builder.build(key)
+        entry = self._cache.get(k)
+        if entry is not None:
+            self._cache.move_to_end(k)
+        else:
+            # Вытесненная из кэша, но ещё не записанная запись
+            entry = self._dirty.get(k) or self._flushing.get(k)
+            if entry is None:
+                entry = await asyncio.to_thread(load_fsm_entry_sync, k) or EMPTY
+                # Пока читали из БД, запись могла измениться
+                entry = self._cache.get(k, entry)
+            self._remember(k, entry)
+        if entry[2] is not None and entry[2] <= time.time():
+            metrics.inc("fsm.expired")
+            self._put_raw(k, EMPTY)
+            return EMPTY
+        return entry
+
+    def _remember(self, k: str, entry: Entry):
+        self._cache[k] = entry
+        self._cache.move_to_end(k)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            metrics.inc("fsm.cache_evicted")
+
+    def _put_raw(self, k: str, entry: Entry):
+        self._remember(k, entry)
+        self._dirty[k] = entry
+        self._ensure_tasks()
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        expires_at = time.time() + self.ttl_for(state) if state is not None or data else None
+        self._put_raw(self.key_builder.build(key), (state, data, expires_at))
+
+    # ============ ФОНОВЫЕ ЗАДАЧИ ============
+
+    def _ensure_tasks(self):
+        if not self._tasks and not self._closed:
+            self._tasks = [
+                asyncio.create_task(self._flush_loop()),
+                asyncio.create_task(self._sweep_loop()),
+            ]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сброса FSM в БД: {e}")
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка очистки FSM: {e}")
+
+    async def flush(self):
+        """Записать накопленные изменения в БД"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            entries = [(k, *entry) for k, entry in self._flushing.items()]
+            try:
+                await asyncio.to_thread(save_fsm_entries_sync, entries)
+            except Exception:
+                # Возвращаем в очередь всё, что не было перезаписано за время сброса
+                for k, entry in self._flushing.items():
+                    self._dirty.setdefault(k, entry)
+                raise
+            finally:
+                self._flushing = {}
+
+    async def sweep(self) -> Dict[str, int]:
+        """Удалить просроченные записи из памяти и БД, обновить метрики"""
+        now = time.time()
+        expired_keys = [k for k, (_, _, expires_at) in self._cache.items()
+                        if expires_at is not None and expires_at <= now]
+        for k in expired_keys:
+            del self._cache[k]
+            # Просроченная запись удаляется и из БД при ближайшем сбросе
+            self._dirty[k] = EMPTY
+
+        await self.flush()
+        result = await asyncio.to_thread(sweep_fsm_entries_sync, now, self.max_entries)
+        result["expired"] += len(expired_keys)
+        if result["evicted"]:
+            # Кэш мог держать вытесненные из БД записи — сбрасываем его целиком
+            self._cache.clear()
+        metrics.inc("fsm.expired", result["expired"])
+        metrics.inc("fsm.evicted", result["evicted"])
+
+        states = await asyncio.to_thread(count_fsm_states_sync)
+        metrics.set_gauges("fsm.state.", states)
+        metrics.set_gauge("fsm.entries", sum(states.values()))
+        metrics.set_gauge("fsm.cache_size", len(self._cache))
+        if result["expired"] or result["evicted"]:
+            logger.info(f"🧹 FSM: удалено просроченных {result['expired']}, вытеснено {result['evicted']}")
+        return result
+
+    # ============ ИНТЕРФЕЙС BaseStorage ============
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data, _ = await self._get_entry(key)
+        self._put(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self._get_entry(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _, _ = await self._get_entry(key)
+        self._put(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self._get_entry(key)
+        return data.copy()
+
+    async def close(self) -> None:
+        """Остановить фоновые задачи и записать всё, что осталось
+
+        Dispatcher закрывает хранилище в своём shutdown, до того как
+        on_shutdown доработает принятые апдейты; их изменения копятся
+        в _dirty без фоновых задач, и повторный close() их записывает.
+        """
+        if self._closed:
+            await self.flush()
+            return
+        self._closed = True
+        tasks, self._tasks = self._tasks, []
+        # Под блокировкой сброс не может быть прерван посреди записи
+        async with self._flush_lock:
+            for task in tasks:
+                task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        logger.info("✅ Состояния FSM сохранены")
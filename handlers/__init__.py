@@ -2,6 +2,7 @@ from .start import router as start_router
 from .gifts import router as gifts_router
 from .admin import router as admin_router
 from .ozon_payments import router as ozon_router
+from callbacks import dispatcher as callbacks_dispatcher
 
-# Список роутеров для подключения
-routers = [start_router, gifts_router, admin_router, ozon_router]
+# Список роутеров для подключения; нажатия inline-кнопок разбирает callbacks_dispatcher
+routers = [callbacks_dispatcher.router, start_router, gifts_router, admin_router, ozon_router]
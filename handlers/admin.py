@@ -1,40 +1,38 @@
+import html
 import logging
+import os
+import time
+from datetime import datetime
 from aiogram import Router, types
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
 
 from database import (
-    get_pending_orders, confirm_order, reject_order, get_order,
+    get_pending_orders, get_pending_orders_page, confirm_order, reject_order, get_order,
     add_gallery_photo, get_gallery_photos, delete_gallery_photo,
     add_gift, get_all_gifts, update_gift, delete_gift,
-    get_statistics, get_top_heroes,
-    set_goal, get_goal_progress
+    rebuild_top_heroes,
+    set_goal, get_goal_progress, get_job_runs,
+    add_scheduled_post, get_scheduled_posts, cancel_scheduled_post,
+    count_outbox, set_goal_announcer
 )
-from keyboards import get_admin_keyboard, get_main_keyboard, get_cancel_keyboard, get_confirm_post_keyboard, get_back_to_admin_keyboard
-from config import SUPER_ADMIN_IDS, is_admin, CHANNEL_ID
+from keyboards import get_admin_keyboard, get_main_keyboard, get_cancel_keyboard, get_confirm_post_keyboard, get_back_to_admin_keyboard, get_pending_orders_page_keyboard
+from config import SUPER_ADMIN_IDS, is_admin, CHANNEL_ID, PENDING_EXPIRE_HOURS
+from jobs import sweep_stale_pending
+from export import export_ledger, EXPORT_FORMATS, EXPORT_STATUSES
+from backup import run_backup
+from render import render_top, render_statistics
+from scheduler import scheduler
+from callbacks import on_callback, pack, OrderApprove, OrderReject, OrdersPage, PostCancel
+from posts import publish_post, parse_publish_time, post_publisher
+import metrics
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# ============ КЛАВИАТУРА ДЛЯ ПОСТА В КАНАЛЕ ============
-
-def get_channel_post_keyboard():
-    """Клавиатура для поста в канале (только ссылки - ТОЛЬКО ТАК РАБОТАЕТ В КАНАЛЕ)"""
-    bot_username = "GiftFlowDB_bot"
-    twitch_url = "https://www.twitch.tv/lanatwitchh"
-    instagram_url = "https://www.instagram.com/lanawolfyy"
-    telegram_channel_url = "https://t.me/lanatwitchh"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📺 Twitch", url=twitch_url)],
-        [InlineKeyboardButton(text="📷 Instagram", url=instagram_url)],
-        [InlineKeyboardButton(text="🎁 Подарки", url=f"https://t.me/{bot_username}?start=gifts")],
-        [InlineKeyboardButton(text="❓ Помощь", url=f"https://t.me/{bot_username}?start=help")]
-    ])
-    return keyboard
-
 # ============ АДМИН-ПАНЕЛЬ ============
 
 @router.message(lambda message: message.text == "👑 Админ-панель")
@@ -53,147 +51,170 @@ async def admin_panel(message: types.Message, state: FSMContext):
 
 # ============ УПРАВЛЕНИЕ ЗАКАЗАМИ ============
 
+ORDERS_PAGE_SIZE = 10
+
+def render_pending_orders_page(page):
+    """Текст страницы ожидающих заказов"""
+    if not page['orders']:
+        return "📭 Нет ожидающих заказов."
+    
+    text = f"📦 <b>Ожидают подтверждения: {page['total']}</b>\n\n"
+    for order in page['orders']:
+        username = order.get('username') or order.get('user_username')
+        user = f"@{username}" if username else order.get('first_name') or order['user_id']
+        text += (
+            f"🆔 <b>#{order['id']}</b> · 🎁 {order['gift_name']} · 💰 {order['amount']}₽\n"
+            f"└ 👤 {user} ({order['user_id']})\n"
+        )
+    return text
+
+async def show_pending_orders_page(message: types.Message, cursor_id: int = None, direction: str = "next", edit: bool = False):
+    """Показать страницу ожидающих заказов (новым сообщением или правкой текущего)"""
+    page = await get_pending_orders_page(ORDERS_PAGE_SIZE, cursor_id, direction)
+    if not page['orders'] and cursor_id is not None and page['total'] > 0:
+        # Якорный заказ ушёл со страницы — начинаем с первой
+        page = await get_pending_orders_page(ORDERS_PAGE_SIZE)
+    
+    text = render_pending_orders_page(page)
+    keyboard = get_pending_orders_page_keyboard(page['orders'], page['has_prev'], page['has_next']) if page['orders'] else None
+    
+    if edit:
+        try:
+            await message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            # Содержимое не изменилось — Telegram отвечает ошибкой, это не страшно
+            if "message is not modified" not in str(e):
+                raise
+    else:
+        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
 @router.message(lambda message: message.text == "📦 Управление заказами")
 async def manage_orders(message: types.Message):
     """Показать список ожидающих заказов"""
     if not is_admin(message.from_user.id):
         return
     
-    orders = get_pending_orders()
-    
-    if not orders:
-        await message.answer("📭 Нет ожидающих заказов.")
+    await show_pending_orders_page(message)
+
+@on_callback(OrdersPage)
+async def orders_page_callback(callback: types.CallbackQuery, payload: OrdersPage):
+    """Листание списка ожидающих заказов"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
         return
     
-    for order in orders:
+    await show_pending_orders_page(callback.message, payload.cursor_id or None, payload.direction, edit=True)
+    await callback.answer()
+
+# ============ ПОДТВЕРЖДЕНИЕ/ОТКЛОНЕНИЕ (CALLBACK) ============
+
+def order_thanks_messages(order, position):
+    """Благодарность от первого лица (Ланы) — в outbox транзакцией подтверждения"""
+    thanks_message = (
+        f"✨ <b>СПАСИБО ТЕБЕ ЗА ПОДАРОК!</b> ✨\n\n"
+        f"🎁 <b>{order['gift_name']}</b>\n"
+        f"💰 Сумма: <b>{order['amount']:,}₽</b>\n\n"
+        f"❤️ <b>Я очень тронута!</b> Твоя поддержка очень важна для меня.\n\n"
+        f"🏆 Ты уже в <b>Топе героев</b>!\n"
+        f"📊 Посмотреть топ можно в главном меню.\n\n"
+        f"💫 <i>Спасибо, что ты со мной! Твоя забота даёт мне силы и вдохновение.</i>\n\n"
+        f"🔗 Подписывайся на мой канал: @lanatwitchh\n\n"
+        f"С любовью, <b>Лана</b> ❤️"
+    )
+    return [(f"order:{order['id']}:confirmed", order['user_id'], thanks_message)]
+
+def order_rejected_messages(order):
+    """Сообщение об отклонении — в outbox транзакцией отклонения"""
+    reject_message = (
+        f"❌ <b>Подарок не подтверждён</b>\n\n"
+        f"🎁 {order['gift_name']}\n\n"
+        f"⚠️ <b>Причина:</b> чек не прошёл проверку.\n\n"
+        f"📸 Пожалуйста, отправьте <b>чёткий скриншот</b> перевода из банка.\n"
+        f"Скриншот должен содержать:\n"
+        f"• Сумму перевода\n"
+        f"• Дату и время\n"
+        f"• Номер заказа или комментарий\n\n"
+        f"❓ Вопросы: @lanatwitchh\n\n"
+        f"🔄 Ты можешь снова выбрать подарок и отправить новый чек.\n\n"
+        f"С любовью, <b>Лана</b> ❤️"
+    )
+    return [(f"order:{order['id']}:rejected", order['user_id'], reject_message)]
+
+def goal_milestone_messages(goal, milestone):
+    """Объявление в канал о пройденном этапе цели — в outbox транзакцией подтверждения"""
+    if not CHANNEL_ID:
+        return []
+    if milestone >= 100:
         text = (
-            f"🆔 <b>Заказ #{order['id']}</b>\n"
-            f"🎁 Подарок: {order['gift_name']}\n"
-            f"💰 Сумма: {order['amount']}₽\n"
-            f"👤 Пользователь: @{order.get('username', 'нет username')}\n"
-            f"🆔 ID: {order['user_id']}\n"
+            f"🎉 <b>ЦЕЛЬ ДОСТИГНУТА!</b> 🎉\n\n"
+            f"🎯 {goal['name']}\n"
+            f"💰 Собрано: {goal['collected']:,}₽\n"
+            f"🎯 Цель: {goal['target']:,}₽\n\n"
+            f"❤️ Спасибо всем, кто поддерживал!\n"
+            f"💫 Скоро новая цель!"
         )
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"approve_{order['id']}"),
-                InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{order['id']}")
-            ]
-        ])
-        
-        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+    else:
+        text = (
+            f"🔥 <b>{milestone}% ЦЕЛИ СОБРАНО!</b>\n\n"
+            f"🎯 {goal['name']}\n"
+            f"💰 Собрано: {goal['collected']:,}₽ из {goal['target']:,}₽\n\n"
+            f"{goal['bars']} {goal['percent']}%\n\n"
+            f"💫 До цели: {goal['remaining']:,}₽\n\n"
+            f"💳 Поддержать: @GiftFlowDB_bot"
+        )
+    return [(f"goal:{goal['version']}:{milestone}", CHANNEL_ID, text)]
 
-# ============ ПОДТВЕРЖДЕНИЕ/ОТКЛОНЕНИЕ (CALLBACK) ============
+set_goal_announcer(goal_milestone_messages)
+
+@on_callback(OrderApprove)
+async def approve_order_callback(callback: types.CallbackQuery, payload: OrderApprove):
+    """Подтверждение заказа по кнопке
 
-@router.callback_query(lambda c: c.data and c.data.startswith("approve_"))
-async def approve_order_callback(callback: types.CallbackQuery):
-    """Подтверждение заказа по кнопке"""
+    Благодарность записывается в outbox вместе с подтверждением и уходит
+    фоновой доставкой: ответ админу не ждёт Telegram API. Этапы цели
+    отслеживает то же подтверждение (см. goal_milestone_messages).
+    """
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа", show_alert=True)
         return
     
-    order_id = int(callback.data.split("_")[1])
-    success = confirm_order(order_id)
-    
-    if success:
-        order = get_order(order_id)
-        if order:
-            user_id = order['user_id']
-            gift_name = order['gift_name']
-            amount = order['amount']
-            
-            # ========== БЛАГОДАРНОСТЬ ОТ ПЕРВОГО ЛИЦА (ЛАНА) ==========
-            thanks_message = (
-                f"✨ <b>СПАСИБО ТЕБЕ ЗА ПОДАРОК!</b> ✨\n\n"
-                f"🎁 <b>{gift_name}</b>\n"
-                f"💰 Сумма: <b>{amount:,}₽</b>\n\n"
-                f"❤️ <b>Я очень тронута!</b> Твоя поддержка очень важна для меня.\n\n"
-                f"🏆 Ты уже в <b>Топе героев</b>!\n"
-                f"📊 Посмотреть топ можно в главном меню.\n\n"
-                f"💫 <i>Спасибо, что ты со мной! Твоя забота даёт мне силы и вдохновение.</i>\n\n"
-                f"🔗 Подписывайся на мой канал: @lanatwitchh\n\n"
-                f"С любовью, <b>Лана</b> ❤️"
-            )
-            
-            await callback.bot.send_message(
-                user_id,
-                thanks_message,
-                parse_mode="HTML"
-            )
-            
-            # Обновляем сообщение в админке
-            await callback.message.edit_caption(
-                caption=f"✅ ЗАКАЗ #{order_id} ПОДТВЕРЖДЁН\nПользователь уведомлён.\nСумма: {amount}₽\nПодарок: {gift_name}",
-                reply_markup=None
-            )
-            await callback.answer("Подтверждено! Пользователю отправлена благодарность.")
-            
-            # ========== ПРОВЕРКА ПРОГРЕССА ЦЕЛИ ==========
-            progress = get_goal_progress()
-            
-            # Если цель достигнута (собрано >= цели)
-            if progress['collected'] >= progress['target']:
-                await callback.bot.send_message(
-                    CHANNEL_ID,
-                    f"🎉 <b>ЦЕЛЬ ДОСТИГНУТА!</b> 🎉\n\n"
-                    f"🎯 {progress['name']}\n"
-                    f"💰 Собрано: {progress['collected']:,}₽\n"
-                    f"🎯 Цель: {progress['target']:,}₽\n\n"
-                    f"❤️ Спасибо всем, кто поддерживал!\n"
-                    f"💫 Скоро новая цель!",
-                    parse_mode="HTML"
-                )
-            
-        else:
-            await callback.answer("Заказ не найден", show_alert=True)
-    else:
+    order_id = payload.order_id
+    if not await confirm_order(order_id, confirmed_by=callback.from_user.id, notify=order_thanks_messages):
         await callback.answer("Ошибка подтверждения", show_alert=True)
+        return
+    await callback.answer("Подтверждено! Благодарность отправляется пользователю.")
+    
+    # Обновляем сообщение в админке: чек или страница списка заказов
+    if payload.anchor:
+        await show_pending_orders_page(callback.message, payload.anchor, "at", edit=True)
+        return
+    caption = f"✅ ЗАКАЗ #{order_id} ПОДТВЕРЖДЁН\nБлагодарность в очереди отправки."
+    # Подтверждение уже записано; без строки заказа (ошибка чтения) подпись короче
+    order = await get_order(order_id)
+    if order:
+        caption += f"\nСумма: {order['amount']}₽\nПодарок: {order['gift_name']}"
+    await callback.message.edit_caption(caption=caption, reply_markup=None)
 
-@router.callback_query(lambda c: c.data and c.data.startswith("reject_"))
-async def reject_order_callback(callback: types.CallbackQuery):
-    """Отклонение заказа по кнопке"""
+@on_callback(OrderReject)
+async def reject_order_callback(callback: types.CallbackQuery, payload: OrderReject):
+    """Отклонение заказа по кнопке (уведомление — через outbox, как при подтверждении)"""
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа", show_alert=True)
         return
     
-    order_id = int(callback.data.split("_")[1])
-    success = reject_order(order_id)
+    order_id = payload.order_id
+    if not await reject_order(order_id, confirmed_by=callback.from_user.id, notify=order_rejected_messages):
+        await callback.answer("Ошибка отклонения", show_alert=True)
+        return
+    await callback.answer("Отклонено! Пользователь получит уведомление.")
     
-    if success:
-        order = get_order(order_id)
-        if order:
-            user_id = order['user_id']
-            gift_name = order['gift_name']
-            
-            reject_message = (
-                f"❌ <b>Подарок не подтверждён</b>\n\n"
-                f"🎁 {gift_name}\n\n"
-                f"⚠️ <b>Причина:</b> чек не прошёл проверку.\n\n"
-                f"📸 Пожалуйста, отправьте <b>чёткий скриншот</b> перевода из банка.\n"
-                f"Скриншот должен содержать:\n"
-                f"• Сумму перевода\n"
-                f"• Дату и время\n"
-                f"• Номер заказа или комментарий\n\n"
-                f"❓ Вопросы: @lanatwitchh\n\n"
-                f"🔄 Ты можешь снова выбрать подарок и отправить новый чек.\n\n"
-                f"С любовью, <b>Лана</b> ❤️"
-            )
-            
-            await callback.bot.send_message(
-                user_id,
-                reject_message,
-                parse_mode="HTML"
-            )
-            
-            await callback.message.edit_caption(
-                caption=f"❌ ЗАКАЗ #{order_id} ОТКЛОНЁН\nПользователь уведомлён.",
-                reply_markup=None
-            )
-            await callback.answer("Отклонено! Пользователь уведомлён.")
-        else:
-            await callback.answer("Заказ не найден", show_alert=True)
+    if payload.anchor:
+        await show_pending_orders_page(callback.message, payload.anchor, "at", edit=True)
     else:
-        await callback.answer("Ошибка отклонения", show_alert=True)
+        await callback.message.edit_caption(
+            caption=f"❌ ЗАКАЗ #{order_id} ОТКЛОНЁН\nУведомление в очереди отправки.",
+            reply_markup=None
+        )
 
 # ============ СТАТИСТИКА ============
 
@@ -203,23 +224,7 @@ async def show_statistics(message: types.Message):
     if not is_admin(message.from_user.id):
         return
     
-    stats = get_statistics()
-    heroes = get_top_heroes(limit=3)
-    
-    top_text = ""
-    for i, hero in enumerate(heroes, 1):
-        top_text += f"{i}. @{hero.get('username', 'anon')} — {hero['total_amount']}₽\n"
-    
-    text = (
-        f"📊 <b>СТАТИСТИКА</b>\n\n"
-        f"💰 Всего собрано: {stats['total_amount']:,}₽\n"
-        f"🎁 Всего подарков: {stats['total_orders']}\n"
-        f"👥 Участников: {stats['total_users']}\n"
-        f"⏳ Ожидает проверки: {stats['total_pending']}\n\n"
-        f"🏆 <b>Топ-3 героев:</b>\n{top_text}"
-    )
-    
-    await message.answer(text, parse_mode="HTML")
+    await message.answer(await render_statistics(), parse_mode="HTML")
 
 # ============ СОЗДАНИЕ ПОСТА (FSM) ============
 
@@ -227,6 +232,7 @@ class PostStates(StatesGroup):
     waiting_for_post_text = State()
     waiting_for_post_photo = State()
     waiting_for_post_confirmation = State()
+    waiting_for_publish_time = State()
 
 @router.message(lambda message: message.text == "✏️ Создать пост")
 async def create_post(message: types.Message, state: FSMContext):
@@ -266,7 +272,7 @@ async def get_post_text(message: types.Message, state: FSMContext):
         ])
     )
 
-@router.callback_query(lambda c: c.data == "skip_photo")
+@on_callback("skip_photo")
 async def skip_photo(callback: types.CallbackQuery, state: FSMContext):
     """Пропуск фото"""
     await state.update_data(post_photo=None)
@@ -318,31 +324,15 @@ async def invalid_post_photo(message: types.Message):
         parse_mode="HTML"
     )
 
-@router.callback_query(lambda c: c.data == "confirm_post")
+@on_callback("confirm_post")
 async def confirm_post(callback: types.CallbackQuery, state: FSMContext):
     """Подтверждение публикации поста с кнопками"""
     data = await state.get_data()
     post_text = data.get('post_text', '')
     post_photo = data.get('post_photo')
     
-    channel_keyboard = get_channel_post_keyboard()
-    
     try:
-        if post_photo:
-            await callback.bot.send_photo(
-                CHANNEL_ID,
-                post_photo,
-                caption=post_text,
-                parse_mode="HTML",
-                reply_markup=channel_keyboard
-            )
-        else:
-            await callback.bot.send_message(
-                CHANNEL_ID,
-                post_text,
-                parse_mode="HTML",
-                reply_markup=channel_keyboard
-            )
+        await publish_post(callback.bot, post_text, post_photo)
         
         await callback.message.answer(
             "✅ <b>Пост успешно опубликован в канале с кнопками!</b>\n\n"
@@ -374,7 +364,7 @@ async def confirm_post(callback: types.CallbackQuery, state: FSMContext):
         reply_markup=get_admin_keyboard()
     )
 
-@router.callback_query(lambda c: c.data == "edit_post_text")
+@on_callback("edit_post_text")
 async def edit_post_text(callback: types.CallbackQuery, state: FSMContext):
     """Редактирование текста поста"""
     await state.set_state(PostStates.waiting_for_post_text)
@@ -387,7 +377,7 @@ async def edit_post_text(callback: types.CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-@router.callback_query(lambda c: c.data == "edit_post_photo")
+@on_callback("edit_post_photo")
 async def edit_post_photo(callback: types.CallbackQuery, state: FSMContext):
     """Редактирование фото поста"""
     await state.set_state(PostStates.waiting_for_post_photo)
@@ -402,7 +392,7 @@ async def edit_post_photo(callback: types.CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-@router.callback_query(lambda c: c.data == "cancel_post")
+@on_callback("cancel_post")
 async def cancel_post(callback: types.CallbackQuery, state: FSMContext):
     """Отмена создания поста"""
     await state.clear()
@@ -415,6 +405,97 @@ async def cancel_post(callback: types.CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
+# ============ ОТЛОЖЕННЫЕ ПОСТЫ ============
+
+@on_callback("schedule_post")
+async def schedule_post(callback: types.CallbackQuery, state: FSMContext):
+    """Запросить время публикации поста"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа!", show_alert=True)
+        return
+    
+    await state.set_state(PostStates.waiting_for_publish_time)
+    await callback.message.answer(
+        "⏰ <b>Когда опубликовать?</b>\n\n"
+        f"Сейчас: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
+        "Отправьте время в одном из форматов:\n"
+        "• <code>19:00</code> — сегодня (или завтра, если время прошло)\n"
+        "• <code>25.10 19:00</code>\n"
+        "• <code>25.10.2026 19:00</code>\n\n"
+        "❌ Отмена - /cancel",
+        parse_mode="HTML",
+        reply_markup=get_cancel_keyboard()
+    )
+    await callback.answer()
+
+@router.message(PostStates.waiting_for_publish_time)
+async def get_publish_time(message: types.Message, state: FSMContext):
+    """Сохранить пост в очередь на указанное время"""
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("❌ Создание поста отменено.", reply_markup=get_admin_keyboard())
+        return
+    
+    publish_at = parse_publish_time(message.text or "")
+    if publish_at is None:
+        await message.answer("❌ Не понял время. Пример: <code>19:00</code> или <code>25.10 19:00</code>", parse_mode="HTML")
+        return
+    
+    data = await state.get_data()
+    post_id = await add_scheduled_post(data.get('post_text', ''), data.get('post_photo'), publish_at.timestamp(), message.from_user.id)
+    post_publisher.wake()
+    await state.clear()
+    await message.answer(
+        f"🗓 <b>Пост #{post_id} запланирован</b> на {publish_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+        "Очередь — «🗓 Отложенные посты».",
+        parse_mode="HTML",
+        reply_markup=get_admin_keyboard()
+    )
+
+async def render_scheduled_posts():
+    """Текст и клавиатура очереди отложенных постов"""
+    posts = await get_scheduled_posts(limit=20)
+    if not posts:
+        return "🗓 Отложенных постов нет.", None
+    
+    text = "🗓 <b>ОТЛОЖЕННЫЕ ПОСТЫ</b>\n\n"
+    buttons = []
+    for post in posts:
+        preview = html.escape(post['text'][:60]) + ("…" if len(post['text']) > 60 else "")
+        when = datetime.fromtimestamp(post['publish_at']).strftime('%d.%m %H:%M')
+        text += f"#{post['id']} — {when}{' 🖼' if post['photo'] else ''}\n<i>{preview}</i>\n\n"
+        buttons.append([InlineKeyboardButton(text=f"❌ Отменить #{post['id']}", callback_data=pack(PostCancel(post['id'])))])
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@router.message(lambda message: message.text == "🗓 Отложенные посты")
+async def show_scheduled_posts(message: types.Message):
+    """Очередь отложенных постов"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    text, keyboard = await render_scheduled_posts()
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@on_callback(PostCancel)
+async def cancel_scheduled_post_callback(callback: types.CallbackQuery, payload: PostCancel):
+    """Отмена отложенного поста"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа!", show_alert=True)
+        return
+    
+    if await cancel_scheduled_post(payload.post_id):
+        post_publisher.wake()
+        await callback.answer(f"Пост #{payload.post_id} отменён")
+    else:
+        await callback.answer("Пост уже опубликован или отменён", show_alert=True)
+    
+    text, keyboard = await render_scheduled_posts()
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+
 # ============ УПРАВЛЕНИЕ ГАЛЕРЕЕЙ ============
 
 class GalleryStates(StatesGroup):
@@ -428,7 +509,7 @@ async def manage_gallery(message: types.Message):
         await message.answer("❌ Нет доступа.")
         return
     
-    images = get_gallery_photos(limit=20)
+    images = await get_gallery_photos(limit=20)
     
     if not images:
         await message.answer(
@@ -450,7 +531,7 @@ async def manage_gallery(message: types.Message):
     
     await message.answer("Выберите действие:", reply_markup=keyboard)
 
-@router.callback_query(lambda c: c.data == "add_gallery_photo")
+@on_callback("add_gallery_photo")
 async def add_gallery_photo_prompt(callback: types.CallbackQuery, state: FSMContext):
     """Запрос на добавление фото в галерею"""
     if not is_admin(callback.from_user.id):
@@ -490,7 +571,7 @@ async def skip_gallery_description(message: types.Message, state: FSMContext):
     data = await state.get_data()
     photo_id = data.get('photo_id')
     
-    success = add_gallery_photo(photo_id, "")
+    success = await add_gallery_photo(photo_id, "", message.from_user.id)
     
     await state.clear()
     if success:
@@ -504,7 +585,7 @@ async def save_gallery_description(message: types.Message, state: FSMContext):
     data = await state.get_data()
     photo_id = data.get('photo_id')
     
-    success = add_gallery_photo(photo_id, message.text)
+    success = await add_gallery_photo(photo_id, message.text, message.from_user.id)
     
     await state.clear()
     if success:
@@ -516,7 +597,7 @@ async def save_gallery_description(message: types.Message, state: FSMContext):
     else:
         await message.answer("❌ Ошибка при добавлении фото.", reply_markup=get_admin_keyboard())
 
-@router.callback_query(lambda c: c.data == "delete_gallery_photo")
+@on_callback("delete_gallery_photo")
 async def delete_gallery_photo_prompt(callback: types.CallbackQuery):
     """Запрос ID фото для удаления"""
     if not is_admin(callback.from_user.id):
@@ -540,7 +621,7 @@ async def delete_gallery_photo_by_id(message: types.Message):
         return
     
     photo_id = int(message.text)
-    success = delete_gallery_photo(photo_id)
+    success = await delete_gallery_photo(photo_id)
     
     if success:
         await message.answer(f"✅ Фото #{photo_id} удалено из галереи.", reply_markup=get_admin_keyboard())
@@ -640,7 +721,7 @@ async def skip_gift_icon(message: types.Message, state: FSMContext):
     await state.update_data(gift_icon="🎁")
     data = await state.get_data()
     
-    success = add_gift(
+    success = await add_gift(
         name=data['gift_name'],
         price=data['gift_price'],
         description=data.get('gift_description', ''),
@@ -674,7 +755,7 @@ async def get_gift_icon(message: types.Message, state: FSMContext):
     await state.update_data(gift_icon=icon)
     data = await state.get_data()
     
-    success = add_gift(
+    success = await add_gift(
         name=data['gift_name'],
         price=data['gift_price'],
         description=data.get('gift_description', ''),
@@ -703,20 +784,7 @@ async def admin_top_heroes(message: types.Message):
         await message.answer("❌ Нет доступа.")
         return
     
-    heroes = get_top_heroes(limit=20)
-    
-    if not heroes:
-        await message.answer("🏆 Топ героев пока пуст.")
-        return
-    
-    text = "🏆 <b>Топ героев (админ-панель)</b>\n\n"
-    for i, hero in enumerate(heroes[:10], 1):
-        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
-        medal = medals.get(i, f"{i}.")
-        username = hero.get('username') or f"user_{hero['user_id']}"
-        text += f"{medal} @{username} — {hero['total_amount']:,}₽\n"
-    
-    await message.answer(text, parse_mode="HTML")
+    await message.answer(await render_top("admin", limit=10), parse_mode="HTML")
 
 # ============ КОМАНДА ДЛЯ УСТАНОВКИ ЦЕЛИ ============
 
@@ -753,10 +821,12 @@ async def set_goal_command(message: types.Message):
         return
     
     # Сохраняем цель
-    set_goal(goal_name, goal_amount)
+    if not await set_goal(goal_name, goal_amount):
+        await message.answer("❌ Не удалось сохранить цель.")
+        return
     
     # Получаем прогресс
-    progress = get_goal_progress()
+    progress = await get_goal_progress()
     
     # Формируем пост для канала
     post_text = f"""
@@ -784,9 +854,158 @@ async def set_goal_command(message: types.Message):
     except Exception as e:
         await message.answer(f"❌ Ошибка отправки в канал: {e}")
 
+# ============ ОЧИСТКА ЗАВИСШИХ ЗАКАЗОВ ============
+
+@router.message(Command("sweep"))
+async def sweep_command(message: types.Message):
+    """Вручную просрочить зависшие ожидающие заказы: /sweep [часы]"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    args = message.text.split()
+    try:
+        hours = int(args[1]) if len(args) > 1 else PENDING_EXPIRE_HOURS
+    except ValueError:
+        await message.answer("❌ Использование: /sweep [часы]")
+        return
+    
+    touched = await sweep_stale_pending(hours)
+    await message.answer(
+        f"🧹 <b>Очистка завершена</b> (старше {hours} ч)\n\n"
+        f"📦 Заказов просрочено: {touched}",
+        parse_mode="HTML"
+    )
+
+# ============ ВЫГРУЗКА ЖУРНАЛА ============
+
+# Ограничение Bot API на размер отправляемого документа
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+@router.message(Command("export"))
+async def export_command(message: types.Message):
+    """Выгрузка журнала: /export [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] [статус|all] [csv|jsonl]"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    dates, statuses, fmt = [], ("confirmed",), "csv"
+    for arg in message.text.split()[1:]:
+        if arg in EXPORT_FORMATS:
+            fmt = arg
+        elif arg == "all":
+            statuses = None
+        elif arg in EXPORT_STATUSES:
+            statuses = (arg,)
+        else:
+            try:
+                dates.append(datetime.strptime(arg, "%Y-%m-%d").strftime("%Y-%m-%d"))
+            except ValueError:
+                await message.answer(
+                    "❌ Использование: /export [с] [по] [статус|all] [csv|jsonl]\n"
+                    "Пример: <code>/export 2026-09-01 2026-09-30 confirmed csv</code>\n"
+                    f"Статусы: {', '.join(EXPORT_STATUSES)}",
+                    parse_mode="HTML"
+                )
+                return
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+    
+    await message.answer("⏳ Готовлю выгрузку...")
+    path, count = await export_ledger(fmt, date_from, date_to, statuses)
+    try:
+        size = os.path.getsize(path)
+        if size > MAX_DOCUMENT_SIZE:
+            await message.answer(f"❌ Файл слишком большой ({size // 1024 // 1024} МБ). Сузьте период.")
+            return
+        filename = f"donations_{date_from or 'start'}_{date_to or 'now'}_{'-'.join(statuses) if statuses else 'all'}.{fmt}"
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"📤 Записей: {count}"
+        )
+    finally:
+        os.remove(path)
+
+# ============ РЕЗЕРВНОЕ КОПИРОВАНИЕ ============
+
+@router.message(Command("backup"))
+async def backup_command(message: types.Message):
+    """Снять резервную копию БД вручную"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    await message.answer("⏳ Создаю резервную копию...")
+    try:
+        results = await run_backup()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка резервного копирования: {e}")
+        return
+    
+    text = "💾 <b>Резервная копия готова</b>\n\n"
+    for result in results:
+        verify = result['verify']
+        text += (
+            f"📁 <code>{os.path.basename(result['path'])}</code>\n"
+            f"⏱ {result['duration']:.2f} с, 📦 {result['size'] / 1024:.0f} КБ "
+            f"(БД {result['raw_size'] / 1024:.0f} КБ)\n"
+            f"{'✅ Проверка пройдена' if verify['ok'] else '❌ Проверка не пройдена: ' + verify['result']}\n"
+        )
+        if result['removed']:
+            text += f"🗑 Удалено старых копий: {result['removed']}\n"
+        text += "\n"
+    
+    await message.answer(text, parse_mode="HTML")
+
+# ============ ПЛАНИРОВЩИК ============
+
+def _format_ts(ts) -> str:
+    return datetime.fromtimestamp(ts).strftime("%d.%m %H:%M") if ts else "—"
+
+@router.message(Command("jobs"))
+async def show_jobs(message: types.Message):
+    """Задачи планировщика и последние запуски"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    text = "📅 <b>ЗАДАЧИ</b>\n\n"
+    for job in sorted(scheduler.jobs.values(), key=lambda job: job.next_run_at or 0):
+        state = "▶️ выполняется" if job.task is not None else f"⏭ {_format_ts(job.next_run_at)}"
+        text += f"<code>{job.name}</code> ({job.schedule}): {state}, последний: {job.last_status or '—'}\n"
+    
+    runs = await get_job_runs(limit=10)
+    if runs:
+        text += "\n<b>Последние запуски:</b>\n"
+        for run in runs:
+            duration = f"{run['finished_at'] - run['started_at']:.1f} с" if run['finished_at'] else "—"
+            text += f"{_format_ts(run['started_at'])} <code>{run['job_name']}</code>: {run['status']}, {duration}\n"
+    
+    queued = await count_outbox()
+    if queued:
+        text += "\n<b>Уведомления:</b> " + ", ".join(f"{status}: {count}" for status, count in sorted(queued.items())) + "\n"
+    
+    await message.answer(text, parse_mode="HTML")
+
+# ============ МЕТРИКИ ============
+
+@router.message(Command("metrics"))
+async def show_metrics(message: types.Message):
+    """Показать счётчики и показатели работы бота"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    snapshot = metrics.snapshot()
+    text = "📈 <b>МЕТРИКИ</b>\n"
+    for title, values in (("Показатели", snapshot['gauges']), ("Счётчики", snapshot['counters'])):
+        if values:
+            text += f"\n<b>{title}:</b>\n"
+            for name in sorted(values):
+                text += f"<code>{name}</code>: {values[name]:g}\n"
+    if not snapshot['gauges'] and not snapshot['counters']:
+        text += "\nПока нет данных."
+    
+    await message.answer(text, parse_mode="HTML")
+
 # ============ ВОЗВРАТ В АДМИНКУ ============
 
-@router.callback_query(lambda c: c.data == "back_to_admin")
+@on_callback("back_to_admin")
 async def back_to_admin(callback: types.CallbackQuery, state: FSMContext):
     """Возврат в админ-панель"""
     if not is_admin(callback.from_user.id):
@@ -824,7 +1043,7 @@ async def add_top_manually(message: types.Message):
         amount = int(args[3])
         
         from database import update_top_heroes
-        update_top_heroes(user_id, amount, username)
+        await update_top_heroes(user_id, amount, username, added_by=message.from_user.id)
         
         await message.answer(f"✅ @{username} добавлен в топ с суммой {amount}₽")
         
@@ -837,45 +1056,38 @@ async def check_top(message: types.Message):
     if not is_admin(message.from_user.id):
         return
     
-    from database import get_top_heroes
-    heroes = get_top_heroes(limit=10)
-    
-    if not heroes:
-        await message.answer("📭 Топ пуст")
-        return
-    
-    text = "📊 <b>ТЕКУЩИЙ ТОП</b>\n\n"
-    for i, hero in enumerate(heroes, 1):
-        text += f"{i}. @{hero.get('username', 'unknown')} — {hero['total_amount']}₽\n"
-    
-    await message.answer(text, parse_mode="HTML")
-@router.message(Command("sync_stats"))
-async def sync_statistics(message: types.Message):
-    """Синхронизировать статистику из top_heroes в orders"""
+    await message.answer(await render_top("check", limit=10), parse_mode="HTML")
+
+@router.message(Command("rebuild_heroes"))
+async def rebuild_heroes(message: types.Message):
+    """Пересчитать топ героев по журналу: /rebuild_heroes [stats]"""
     if not is_admin(message.from_user.id):
         return
     
-    from database import get_db_connection, get_top_heroes
+    with_stats = "stats" in message.text.split()[1:]
+    started = time.monotonic()
+    try:
+        result = await rebuild_top_heroes(with_stats)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка пересчёта: {e}")
+        return
+    elapsed = time.monotonic() - started
     
-    heroes = get_top_heroes(limit=100)
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    changed = result['changed']
+    text = (
+        f"🏆 <b>Топ героев пересчитан</b> за {elapsed:.2f} с\n\n"
+        f"👥 Героев: {result['heroes']}\n"
+        f"✏️ Изменилось: {len(changed)}\n"
+    )
+    if with_stats:
+        text += "📊 Итоги архива пересчитаны\n"
+    if changed:
+        text += "\n"
+        for hero in changed[:20]:
+            delta = hero['new_amount'] - hero['old_amount']
+            name = html.escape(hero['username'] or str(hero['user_id']))
+            text += f"@{name}: {hero['old_amount']}₽ → {hero['new_amount']}₽ ({delta:+}₽)\n"
+        if len(changed) > 20:
+            text += f"… и ещё {len(changed) - 20}\n"
     
-    added = 0
-    for hero in heroes:
-        # Проверяем, есть ли уже заказ у этого пользователя
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE user_id = ? AND status = 'confirmed'", (hero['user_id'],))
-        count = cursor.fetchone()[0]
-        
-        if count == 0 and hero['total_amount'] > 0:
-            # Создаём виртуальный заказ для статистики
-            cursor.execute("""
-                INSERT INTO orders (user_id, username, gift_name, amount, status, confirmed_at)
-                VALUES (?, ?, 'Ручное добавление', ?, 'confirmed', CURRENT_TIMESTAMP)
-            """, (hero['user_id'], hero.get('username'), hero['total_amount']))
-            added += 1
-    
-    conn.commit()
-    conn.close()
-    
-    await message.answer(f"✅ Статистика синхронизирована! Добавлено {added} записей в orders.\n\nТеперь /stats покажет правильные цифры.")
+    await message.answer(text, parse_mode="HTML")
@@ -5,7 +5,9 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from database import get_all_gifts, create_order, get_gift_by_id
+from callbacks import on_callback, pack, GiftPick, ReceiptAsk, OrderPaid, OrderApprove, OrderReject
 from config import OZON_BANK_NAME, SUPPORT_ADMIN_ID
+import metrics
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -24,7 +26,7 @@ def get_gifts_keyboard(gifts):
     for i, gift in enumerate(gifts, 1):
         row.append(InlineKeyboardButton(
             text=f"{gift['icon']} {gift['name']} - {gift['price']}₽",
-            callback_data=f"gift_{gift['id']}"
+            callback_data=pack(GiftPick(gift['id']))
         ))
         if i % 2 == 0:
             keyboard.append(row)
@@ -63,24 +65,19 @@ async def show_gifts_catalog(message: types.Message):
 
 # ============ ОБРАБОТКА ВЫБОРА ПОДАРКА ============
 
-@router.callback_query(lambda c: c.data and c.data.startswith("gift_"))
-async def gift_selected(callback: types.CallbackQuery):
+@on_callback(GiftPick)
+async def gift_selected(callback: types.CallbackQuery, payload: GiftPick):
     """Обработка выбора подарка"""
     try:
-        gift_id = int(callback.data.split("_")[1])
+        gift_id = payload.gift_id
         gift = await get_gift_by_id(gift_id)
         
         if not gift:
             await callback.answer("Подарок не найден!", show_alert=True)
             return
         
-        # Создаём заказ
-        order_id = await create_order(
-            user_id=callback.from_user.id,
-            gift_id=gift_id,
-            amount=gift['price'],
-            username=callback.from_user.username
-        )
+        # Заказ создаётся только при получении чека — просмотр каталога не пишет в БД
+        metrics.inc("gifts.selected")
         
         # Ссылка для оплаты с комментарием
         user_id = callback.from_user.id
@@ -99,7 +96,7 @@ async def gift_selected(callback: types.CallbackQuery):
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="💳 Оплатить по ссылке", url=payment_link)],
-            [InlineKeyboardButton(text="📸 Отправить чек об оплате", callback_data=f"paid_{order_id}")],
+            [InlineKeyboardButton(text="📸 Отправить чек об оплате", callback_data=pack(ReceiptAsk(gift_id)))],
             [InlineKeyboardButton(text="🔙 Назад к подаркам", callback_data="back_to_gifts_catalog")]
         ])
         
@@ -117,11 +114,39 @@ async def gift_selected(callback: types.CallbackQuery):
 
 # ============ ОБРАБОТКА ОПЛАТЫ (отправка чека) ============
 
-@router.callback_query(lambda c: c.data and c.data.startswith("paid_"))
-async def payment_paid(callback: types.CallbackQuery, state: FSMContext):
+@on_callback(ReceiptAsk)
+async def receipt_requested(callback: types.CallbackQuery, state: FSMContext, payload: ReceiptAsk):
     """Пользователь нажал «Отправить чек об оплате»"""
     try:
-        order_id = int(callback.data.split("_")[1])
+        gift_id = payload.gift_id
+        gift = await get_gift_by_id(gift_id)
+        
+        if not gift:
+            await callback.answer("Подарок не найден!", show_alert=True)
+            return
+        
+        await state.update_data(gift_id=gift_id, order_id=None)
+        await state.set_state(PaymentStates.waiting_for_receipt)
+        
+        await callback.message.edit_text(
+            f"📸 <b>Отправьте скриншот чека</b>\n\n"
+            f"🎁 {gift['icon']} {gift['name']} — {gift['price']:,}₽\n\n"
+            f"Отправьте фото чека одним сообщением.\n"
+            f"После проверки я подтвержу подарок.\n\n"
+            f"❌ Отмена - /cancel",
+            parse_mode="HTML"
+        )
+        await callback.answer()
+        
+    except Exception as e:
+        logger.error(f"Ошибка receipt_requested: {e}")
+        await callback.answer("Ошибка, попробуйте снова", show_alert=True)
+
+@on_callback(OrderPaid)
+async def payment_paid(callback: types.CallbackQuery, state: FSMContext, payload: OrderPaid):
+    """Кнопка «Отправить чек» из старых сообщений, где заказ уже создан"""
+    try:
+        order_id = payload.order_id
         
         await state.update_data(order_id=order_id)
         await state.set_state(PaymentStates.waiting_for_receipt)
@@ -143,11 +168,40 @@ async def payment_paid(callback: types.CallbackQuery, state: FSMContext):
 
 # ============ ПОЛУЧЕНИЕ ЧЕКА ============
 
+def receipt_key(message: types.Message) -> str:
+    """Ключ чека для журнала: все фото одного альбома — один чек"""
+    if message.media_group_id:
+        return f"album:{message.chat.id}:{message.media_group_id}"
+    return f"photo:{message.photo[-1].file_unique_id}"
+
 @router.message(PaymentStates.waiting_for_receipt, lambda message: message.photo)
 async def receive_receipt(message: types.Message, state: FSMContext):
-    """Получение скриншота чека"""
+    """Получение скриншота чека
+
+    Если чек не удалось записать или передать админу, состояние остаётся:
+    пользователь присылает тот же чек ещё раз, и по receipt_key он
+    попадёт в тот же заказ, а не создаст второй.
+    """
     data = await state.get_data()
     order_id = data.get('order_id')
+    gift_id = data.get('gift_id')
+    
+    if not order_id and gift_id:
+        gift = await get_gift_by_id(gift_id)
+        if gift:
+            # Каждый чек — свой заказ; фото одного альбома и повторно присланный чек — один
+            try:
+                order_id = await create_order(
+                    user_id=message.from_user.id,
+                    gift_id=gift_id,
+                    amount=gift['price'],
+                    username=message.from_user.username,
+                    receipt_id=receipt_key(message)
+                )
+            except Exception as e:
+                logger.error(f"Ошибка receive_receipt: {e}")
+                await message.answer("❌ Ошибка при сохранении чека. Отправьте его ещё раз через минуту.")
+                return
     
     if not order_id:
         await message.answer(
@@ -161,8 +215,8 @@ async def receive_receipt(message: types.Message, state: FSMContext):
     
     # Кнопки для админа
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ ПОДТВЕРДИТЬ", callback_data=f"approve_{order_id}")],
-        [InlineKeyboardButton(text="❌ ОТКЛОНИТЬ", callback_data=f"reject_{order_id}")]
+        [InlineKeyboardButton(text="✅ ПОДТВЕРДИТЬ", callback_data=pack(OrderApprove(order_id)))],
+        [InlineKeyboardButton(text="❌ ОТКЛОНИТЬ", callback_data=pack(OrderReject(order_id)))]
     ])
     
     admin_text = (
@@ -172,13 +226,18 @@ async def receive_receipt(message: types.Message, state: FSMContext):
         f"🆔 ID: {message.from_user.id}\n"
     )
     
-    await message.bot.send_photo(
-        SUPPORT_ADMIN_ID,
-        photo=photo.file_id,
-        caption=admin_text,
-        parse_mode="HTML",
-        reply_markup=keyboard
-    )
+    try:
+        await message.bot.send_photo(
+            SUPPORT_ADMIN_ID,
+            photo=photo.file_id,
+            caption=admin_text,
+            parse_mode="HTML",
+            reply_markup=keyboard
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отправки чека админу: {e}")
+        await message.answer("❌ Не удалось передать чек на проверку. Отправьте его ещё раз через минуту.")
+        return
     
     await message.answer(
         "✅ <b>Чек получен!</b>\n\n"
@@ -202,14 +261,14 @@ async def invalid_receipt(message: types.Message):
 
 # ============ ВОЗВРАТ В КАТАЛОГ ============
 
-@router.callback_query(lambda c: c.data == "back_to_gifts_catalog")
+@on_callback("back_to_gifts_catalog")
 async def back_to_gifts_catalog(callback: types.CallbackQuery):
     """Возврат в каталог подарков"""
     await callback.message.delete()
     await show_gifts_catalog(callback.message)
     await callback.answer()
 
-@router.callback_query(lambda c: c.data == "back_to_main_menu")
+@on_callback("back_to_main_menu")
 async def back_to_main_menu(callback: types.CallbackQuery, state: FSMContext):
     """Возврат в главное меню"""
     from handlers.start import start_command
@@ -4,8 +4,13 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from database import add_transaction, get_gift_by_id, register_user, is_admin, get_pending_transactions, get_all_transactions, update_transaction_status
+from database import (
+    add_transaction, get_gift_by_id, is_admin, get_pending_transactions, get_order, find_orders_by_number,
+    update_transaction_status
+)
 from keyboards import get_main_keyboard
+from handlers.gifts import receipt_key
+from callbacks import on_callback, pack, PayCard, PaySbp, SendReceipt
 from config import SUPER_ADMIN_ID, SUPPORT_ADMIN_ID, CHANNEL_ID, OZON_CARD_LAST, OZON_BANK_NAME, OZON_RECEIVER, OZON_SBP_QR_URL
 
 logger = logging.getLogger(__name__)
@@ -17,21 +22,21 @@ class PaymentStates(StatesGroup):
 def get_sbp_payment_keyboard(gift_id, sbp_link):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="💳 Оплатить по ссылке", url=sbp_link)],
-        [InlineKeyboardButton(text="📸 Отправить чек об оплате", callback_data=f"send_receipt_{gift_id}"),
+        [InlineKeyboardButton(text="📸 Отправить чек об оплате", callback_data=pack(SendReceipt(gift_id))),
          InlineKeyboardButton(text="❌ Отмена", callback_data="back_to_gifts")]
     ])
     return keyboard
 
 def get_card_payment_keyboard(gift_id):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📸 Отправить чек об оплате", callback_data=f"send_receipt_{gift_id}"),
+        [InlineKeyboardButton(text="📸 Отправить чек об оплате", callback_data=pack(SendReceipt(gift_id))),
          InlineKeyboardButton(text="❌ Отмена", callback_data="back_to_gifts")]
     ])
     return keyboard
 
-@router.callback_query(lambda c: c.data and c.data.startswith("pay_card_"))
-async def pay_by_card(callback: types.CallbackQuery, state: FSMContext):
-    gift_id = int(callback.data.split("_")[2])
+@on_callback(PayCard)
+async def pay_by_card(callback: types.CallbackQuery, state: FSMContext, payload: PayCard):
+    gift_id = payload.gift_id
     gift = await get_gift_by_id(gift_id)
     if not gift:
         await callback.answer("Подарок не найден!", show_alert=True)
@@ -55,9 +60,9 @@ async def pay_by_card(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
     await callback.answer()
 
-@router.callback_query(lambda c: c.data and c.data.startswith("pay_sbp_"))
-async def pay_by_sbp(callback: types.CallbackQuery, state: FSMContext):
-    gift_id = int(callback.data.split("_")[2])
+@on_callback(PaySbp)
+async def pay_by_sbp(callback: types.CallbackQuery, state: FSMContext, payload: PaySbp):
+    gift_id = payload.gift_id
     gift = await get_gift_by_id(gift_id)
     if not gift:
         await callback.answer("Подарок не найден!", show_alert=True)
@@ -83,9 +88,9 @@ async def pay_by_sbp(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
     await callback.answer()
 
-@router.callback_query(lambda c: c.data and c.data.startswith("send_receipt_"))
-async def send_receipt_prompt(callback: types.CallbackQuery, state: FSMContext):
-    gift_id = int(callback.data.split("_")[2])
+@on_callback(SendReceipt)
+async def send_receipt_prompt(callback: types.CallbackQuery, state: FSMContext, payload: SendReceipt):
+    gift_id = payload.gift_id
     await state.update_data(gift_id=gift_id)
     await state.set_state(PaymentStates.waiting_for_screenshot)
     
@@ -116,8 +121,14 @@ async def receive_screenshot(message: types.Message, state: FSMContext):
     username = message.from_user.username
     first_name = message.from_user.first_name
     
-    await register_user(user_id, username, first_name)
-    transaction_id = await add_transaction(user_id, gift_id, gift['price'], "sbp")
+    # Состояние остаётся: повторно присланный тот же чек попадёт в тот же заказ
+    try:
+        transaction_id = await add_transaction(user_id, gift_id, gift['price'], "sbp",
+                                               username=username, receipt_id=receipt_key(message))
+    except Exception as e:
+        logger.error(f"Ошибка receive_screenshot: {e}")
+        await message.answer("❌ Ошибка при сохранении чека. Отправьте его ещё раз через минуту.")
+        return
     
     admin_text = (
         f"🆕 <b>НОВЫЙ ЗАКАЗ С ЧЕКОМ!</b>\n\n"
@@ -160,7 +171,7 @@ async def invalid_screenshot(message: types.Message):
         parse_mode="HTML"
     )
 
-@router.callback_query(lambda c: c.data == "back_to_gifts")
+@on_callback("back_to_gifts")
 async def back_to_gifts(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     from handlers.gifts import show_gifts_list
@@ -184,55 +195,92 @@ async def manage_orders(message: types.Message):
     
     await message.answer(text, parse_mode="HTML")
 
-@router.message(lambda message: message.text and message.text.startswith("/approve"))
-async def approve_order(message: types.Message):
-    if not await is_admin(message.from_user.id):
-        await message.answer("❌ Нет доступа.")
-        return
-    
+# Уведомления пишутся в outbox той же транзакцией, что и смена статуса (см. outbox.py)
+
+def confirmed_messages(transaction, position):
+    """Пользователю — подтверждение с местом в топе, в канал — крупный донат"""
+    user_text = f"✅ <b>Ваш заказ #{transaction['id']} подтверждён!</b>\n\n🎁 {transaction['gift_name']}\n💰 Сумма: {transaction['amount']}₽\n\n"
+    if position:
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        user_text += f"{medals.get(position, '🎖️')} <b>Вы в топ-{position} героев!</b>\n\n"
+    user_text += "❤️ Спасибо за поддержку Ланы!"
+    messages = [(f"order:{transaction['id']}:confirmed", transaction['user_id'], user_text)]
+    
+    if transaction['amount'] >= 5000 and CHANNEL_ID:
+        channel_text = f"🎉 <b>Новый донат!</b>\n\n@{transaction.get('username') or 'Аноним'} подарил(а) {transaction['gift_name']} на {transaction['amount']}₽"
+        messages.append((f"order:{transaction['id']}:channel", CHANNEL_ID, channel_text))
+    return messages
+
+def rejected_messages(transaction):
+    return [(
+        f"order:{transaction['id']}:rejected",
+        transaction['user_id'],
+        f"❌ <b>Ваш заказ #{transaction['id']} отклонён.</b>\n\n"
+        f"Причина: чек не соответствует требованиям.\n\n"
+        f"Пожалуйста, повторите оплату с корректным чеком."
+    )]
+
+async def find_transaction(message: types.Message, command: str):
+    """Запись журнала по аргументу /approve или /reject; None — админу уже ответили
+
+    Номер из старой подписи к чеку может совпасть с id другой записи (см.
+    find_orders_by_number). Тогда ничего не меняем, а показываем кандидатов:
+    «#id» выбирает запись журнала точно.
+    """
     parts = message.text.split()
     if len(parts) != 2:
-        await message.answer("❌ Используй: <code>/approve 123</code>", parse_mode="HTML")
-        return
+        await message.answer(f"❌ Используй: <code>/{command} 123</code>", parse_mode="HTML")
+        return None
     
+    exact = parts[1].startswith("#")
     try:
-        transaction_id = int(parts[1])
+        number = int(parts[1].lstrip("#"))
     except ValueError:
         await message.answer("❌ ID заказа должен быть числом.")
-        return
+        return None
     
-    transactions = await get_all_transactions(limit=100)
-    transaction = next((t for t in transactions if t['id'] == transaction_id), None)
+    if exact:
+        transaction = await get_order(number)
+        candidates = [transaction] if transaction else []
+    else:
+        candidates = await find_orders_by_number(number)
+    
+    if not candidates:
+        await message.answer(f"❌ Заказ #{number} не найден.")
+        return None
+    if len(candidates) > 1:
+        text = f"⚠️ <b>Номер #{number} подходит к нескольким записям</b>, выберите нужную:\n\n"
+        for t in candidates:
+            if t['source'] == 'transaction':
+                origin = f"чек до переноса, был #{t['legacy_id']}" if t['legacy_id'] else "оплата по реквизитам"
+            else:
+                origin = "заказ"
+            text += (f"┌ <b>#{t['id']}</b> ({origin})\n├ 🎁 {t['gift_name']} — {t['amount']}₽\n"
+                     f"├ 👤 @{t.get('username') or t['user_id']}, статус: {t['status']}\n"
+                     f"└ <code>/{command} #{t['id']}</code>\n\n")
+        await message.answer(text, parse_mode="HTML")
+        return None
+    return candidates[0]
+
+@router.message(lambda message: message.text and message.text.startswith("/approve"))
+async def approve_order(message: types.Message):
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ Нет доступа.")
+        return
     
+    transaction = await find_transaction(message, "approve")
     if not transaction:
-        await message.answer(f"❌ Заказ #{transaction_id} не найден.")
         return
+    transaction_id = transaction['id']
     
-    if transaction['status'] == 'paid':
+    if transaction['status'] == 'confirmed':
         await message.answer(f"✅ Заказ #{transaction_id} уже подтверждён.")
         return
     
-    await update_transaction_status(transaction_id, 'paid', confirmed_by=message.from_user.id)
-    
-    from database import update_top_heroes
-    position = await update_top_heroes(transaction['user_id'], transaction['amount'], transaction.get('username'))
-    
-    try:
-        user_text = f"✅ <b>Ваш заказ #{transaction_id} подтверждён!</b>\n\n🎁 {transaction['gift_name']}\n💰 Сумма: {transaction['amount']}₽\n\n"
-        if position:
-            medals = {1: "🥇", 2: "🥈", 3: "🥉"}
-            user_text += f"{medals.get(position, '🎖️')} <b>Вы в топ-{position} героев!</b>\n\n"
-        user_text += "❤️ Спасибо за поддержку Ланы!"
-        await message.bot.send_message(transaction['user_id'], user_text, parse_mode="HTML")
-    except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя: {e}")
-    
-    if transaction['amount'] >= 5000:
-        try:
-            channel_text = f"🎉 <b>Новый донат!</b>\n\n@{transaction.get('username') or 'Аноним'} подарил(а) {transaction['gift_name']} на {transaction['amount']}₽"
-            await message.bot.send_message(CHANNEL_ID, channel_text, parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Ошибка отправки в канал: {e}")
+    if not await update_transaction_status(transaction_id, 'confirmed', confirmed_by=message.from_user.id,
+                                           notify=confirmed_messages):
+        await message.answer(f"❌ Заказ #{transaction_id} нельзя подтвердить (статус: {transaction['status']}).")
+        return
     
     await message.answer(f"✅ Заказ #{transaction_id} подтверждён!")
 
@@ -242,40 +290,19 @@ async def reject_order(message: types.Message):
         await message.answer("❌ Нет доступа.")
         return
     
-    parts = message.text.split()
-    if len(parts) != 2:
-        await message.answer("❌ Используй: <code>/reject 123</code>", parse_mode="HTML")
-        return
-    
-    try:
-        transaction_id = int(parts[1])
-    except ValueError:
-        await message.answer("❌ ID заказа должен быть числом.")
-        return
-    
-    transactions = await get_all_transactions(limit=100)
-    transaction = next((t for t in transactions if t['id'] == transaction_id), None)
-    
+    transaction = await find_transaction(message, "reject")
     if not transaction:
-        await message.answer(f"❌ Заказ #{transaction_id} не найден.")
         return
+    transaction_id = transaction['id']
     
-    if transaction['status'] == 'paid':
+    if transaction['status'] == 'confirmed':
         await message.answer(f"✅ Заказ #{transaction_id} уже подтверждён. Отмена невозможна.")
         return
     
-    await update_transaction_status(transaction_id, 'rejected', confirmed_by=message.from_user.id)
-    
-    try:
-        await message.bot.send_message(
-            transaction['user_id'],
-            f"❌ <b>Ваш заказ #{transaction_id} отклонён.</b>\n\n"
-            f"Причина: чек не соответствует требованиям.\n\n"
-            f"Пожалуйста, повторите оплату с корректным чеком.",
-            parse_mode="HTML"
-        )
-    except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя: {e}")
+    if not await update_transaction_status(transaction_id, 'rejected', confirmed_by=message.from_user.id,
+                                           notify=rejected_messages):
+        await message.answer(f"❌ Заказ #{transaction_id} нельзя отклонить (статус: {transaction['status']}).")
+        return
     
     await message.answer(f"❌ Заказ #{transaction_id} отклонён!")
 
@@ -287,7 +314,6 @@ async def show_statistics(message: types.Message):
     
     from database import get_stats
     stats = await get_stats()
-    pending = await get_pending_transactions(limit=1)
     
     text = (
         f"📊 <b>Статистика бота</b>\n\n"
@@ -295,6 +321,6 @@ async def show_statistics(message: types.Message):
         f"🎁 Всего донатов: {stats.get('total_donations', 0)}\n"
         f"💰 Общая сумма: {stats.get('total_amount', 0):,}₽\n"
         f"📅 За месяц: {stats.get('month_amount', 0):,}₽\n"
-        f"⏳ Ожидают: {len(pending)} заказов"
+        f"⏳ Ожидают: {stats.get('total_pending', 0)} заказов"
     )
     await message.answer(text, parse_mode="HTML")
@@ -4,7 +4,8 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
-from database import register_user, get_top_heroes, is_admin
+from database import is_admin
+from render import render_top
 from config import SUPER_ADMIN_ID, SUPPORT_ADMIN_ID
 
 logger = logging.getLogger(__name__)
@@ -56,15 +57,7 @@ async def start_command(message: types.Message, state: FSMContext):
     await state.clear()
     
     user_id = message.from_user.id
-    username = message.from_user.username
-    first_name = message.from_user.first_name
-    last_name = message.from_user.last_name
-    
-    # Регистрируем пользователя
-    try:
-        await register_user(user_id, username, first_name, last_name)
-    except Exception as e:
-        logger.error(f"Ошибка регистрации: {e}")
+    # Пользователя регистрирует UserActivityMiddleware
     
     welcome_text = (
         "🐉 <b>Добро пожаловать!</b>\n\n"
@@ -151,26 +144,12 @@ async def top_heroes_button(message: types.Message, state: FSMContext):
     await state.clear()
     
     try:
-        heroes = await get_top_heroes(limit=10)
+        text = await render_top("public", limit=10)
     except Exception as e:
         logger.error(f"Ошибка получения топа: {e}")
         await message.answer("⚠️ Не удалось загрузить топ героев. Попробуйте позже.")
         return
     
-    if not heroes:
-        await message.answer("🏆 <b>Топ героев пока пуст</b>\n\nСтань первым!", parse_mode="HTML")
-        return
-    
-    text = "🏆 <b>Топ героев</b>\n\n"
-    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
-    
-    for i, hero in enumerate(heroes, 1):
-        medal = medals.get(i, f"{i}.")
-        username = hero.get('username') or f"user_{hero['user_id']}"
-        amount = hero.get('total_amount', 0)
-        text += f"{medal} @{username} — {amount:,}₽\n"
-    
-    text += "\n💎 Топ-1 получит секретный приз!"
     await message.answer(text, parse_mode="HTML")
 
 @router.message(lambda message: message.text == "❓ О конкурсе")
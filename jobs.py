@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+import metrics
+from config import (
+    PENDING_EXPIRE_HOURS, PENDING_SWEEP_INTERVAL, SWEEP_BATCH_SIZE, SWEEP_BATCH_PAUSE,
+    ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL, BACKUP_INTERVAL,
+    DB_MAINTENANCE_INTERVAL, DB_IDLE_SECONDS, DB_OPTIMIZE_INTERVAL, OUTBOX_KEEP_DAYS, OUTBOX_PRUNE_INTERVAL
+)
+from database import (
+    expire_pending_batch, archive_batch, checkpoint_wal, optimize_database,
+    seconds_since_write, wal_size, prune_outbox
+)
+from backup import run_backup
+from scheduler import Scheduler, Every
+
+logger = logging.getLogger(__name__)
+
+# ============ ОЧИСТКА ЗАВИСШИХ ЗАКАЗОВ ============
+
+async def sweep_stale_pending(older_than_hours: int = PENDING_EXPIRE_HOURS) -> int:
+    """Перевести ожидающие записи журнала старше срока в 'expired'
+
+    Работает короткими пачками с паузами, чтобы не держать блокировку записи.
+    Возвращает число изменённых строк.
+    """
+    total = 0
+    after_id = 0
+    while after_id is not None:
+        count, after_id = await expire_pending_batch(older_than_hours, after_id, SWEEP_BATCH_SIZE)
+        total += count
+        if after_id is not None:
+            await asyncio.sleep(SWEEP_BATCH_PAUSE)
+    metrics.inc("sweeper.expired", total)
+    
+    if total:
+        logger.info(f"🧹 Просрочено ожидающих заказов: {total}")
+    return total
+
+# ============ АРХИВАЦИЯ ============
+
+async def archive_finalized(older_than_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    """Перенести завершённые записи журнала старше срока в архивную БД пачками"""
+    total = 0
+    while True:
+        count = await archive_batch(older_than_days, ARCHIVE_BATCH_SIZE)
+        total += count
+        if count < ARCHIVE_BATCH_SIZE:
+            break
+        await asyncio.sleep(SWEEP_BATCH_PAUSE)
+    metrics.inc("archive.moved", total)
+    
+    if total:
+        logger.info(f"📦 В архив перенесено записей: {total}")
+    return total
+
+# ============ ОЧИСТКА OUTBOX ============
+
+async def prune_delivered(older_than_days: int = OUTBOX_KEEP_DAYS) -> int:
+    """Удалить старые доставленные и брошенные уведомления"""
+    total = await prune_outbox(older_than_days)
+    metrics.inc("outbox.pruned", total)
+    if total:
+        logger.info(f"📨 Удалено старых уведомлений: {total}")
+    return total
+
+# ============ ОБСЛУЖИВАНИЕ БД ============
+
+def collect_db_metrics():
+    """Размер WAL и время с последней записи — для снимка метрик"""
+    metrics.set_gauge("db.wal_size", wal_size())
+    metrics.set_gauge("db.seconds_since_write", round(seconds_since_write(), 1))
+
+metrics.register_collector(collect_db_metrics)
+
+async def checkpoint_if_idle():
+    """Checkpoint WAL, если БД простаивает без записей"""
+    if seconds_since_write() >= DB_IDLE_SECONDS:
+        result = await checkpoint_wal("PASSIVE")
+        metrics.inc("db.checkpoints")
+        metrics.set_gauge("db.wal_frames", result["wal_frames"])
+        metrics.set_gauge("db.checkpoint_lag", result["lag"])
+    collect_db_metrics()
+
+async def optimize_statistics():
+    """ANALYZE/optimize для планировщика запросов SQLite"""
+    started = time.monotonic()
+    await optimize_database()
+    metrics.inc("db.optimize_runs")
+    logger.info(f"📐 Статистика БД обновлена за {time.monotonic() - started:.2f} с")
+
+# ============ РЕГИСТРАЦИЯ В ПЛАНИРОВЩИКЕ ============
+
+def register_jobs(scheduler: Scheduler):
+    """Служебные периодические задачи бота"""
+    scheduler.add_job("pending_sweeper", sweep_stale_pending, Every(PENDING_SWEEP_INTERVAL))
+    scheduler.add_job("archiver", archive_finalized, Every(ARCHIVE_INTERVAL))
+    scheduler.add_job("outbox_prune", prune_delivered, Every(OUTBOX_PRUNE_INTERVAL, first_delay=OUTBOX_PRUNE_INTERVAL))
+    # Первая копия — через BACKUP_INTERVAL после первого запуска бота
+    scheduler.add_job("backup", run_backup, Every(BACKUP_INTERVAL, first_delay=BACKUP_INTERVAL))
+    scheduler.add_job("db_optimize", optimize_statistics, Every(DB_OPTIMIZE_INTERVAL, first_delay=DB_MAINTENANCE_INTERVAL))
+    scheduler.add_job("db_checkpoint", checkpoint_if_idle,
+                      Every(DB_MAINTENANCE_INTERVAL, first_delay=DB_MAINTENANCE_INTERVAL), persist=False)
@@ -1,5 +1,7 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+from callbacks import pack, GiftPick, PayCard, PaySbp, OrderApprove, OrderReject, OrdersPage
+
 # ========== REPLY КЛАВИАТУРЫ ==========
 
 def get_main_keyboard():
@@ -33,7 +35,8 @@ def get_admin_keyboard():
         keyboard=[
             [KeyboardButton(text="📦 Управление заказами")],
             [KeyboardButton(text="🖼️ Управление галереей")],
-            [KeyboardButton(text="✏️ Создать пост"), KeyboardButton(text="📊 Статистика")],
+            [KeyboardButton(text="✏️ Создать пост"), KeyboardButton(text="🗓 Отложенные посты")],
+            [KeyboardButton(text="📊 Статистика")],
             [KeyboardButton(text="🏆 Топ героев (админ)"), KeyboardButton(text="➕ Добавить подарок")],
             [KeyboardButton(text="🏠 Главное меню")]
         ],
@@ -70,7 +73,7 @@ def get_gifts_keyboard(gifts):
         keyboard.inline_keyboard.append([
             InlineKeyboardButton(
                 text=f"{gift['icon']} {gift['name']} — {gift['price']}₽",
-                callback_data=f"gift_{gift['id']}"
+                callback_data=pack(GiftPick(gift['id']))
             )
         ])
     keyboard.inline_keyboard.append([
@@ -82,8 +85,8 @@ def get_payment_keyboard(gift_id, gift_name, gift_price):
     """Клавиатура оплаты для подарка"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="💳 Оплатить картой", callback_data=f"pay_card_{gift_id}"),
-            InlineKeyboardButton(text="📱 СБП/QR-код", callback_data=f"pay_sbp_{gift_id}")
+            InlineKeyboardButton(text="💳 Оплатить картой", callback_data=pack(PayCard(gift_id))),
+            InlineKeyboardButton(text="📱 СБП/QR-код", callback_data=pack(PaySbp(gift_id)))
         ],
         [
             InlineKeyboardButton(text="🔙 Назад к подаркам", callback_data="back_to_gifts_catalog")
@@ -105,7 +108,7 @@ def get_admin_orders_keyboard(orders):
     """Клавиатура для управления заказами (админка)"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
     for order in orders[:10]:
-        status_emoji = "✅" if order.get('status') == 'paid' else "⏳"
+        status_emoji = "✅" if order.get('status') == 'confirmed' else "⏳"
         keyboard.inline_keyboard.append([
             InlineKeyboardButton(
                 text=f"{status_emoji} Заказ #{order['id']} — {order['gift_name']} — {order['amount']}₽",
@@ -117,12 +120,33 @@ def get_admin_orders_keyboard(orders):
     ])
     return keyboard
 
+def get_pending_orders_page_keyboard(orders, has_prev, has_next):
+    """Клавиатура страницы ожидающих заказов: действия по строкам и листание"""
+    anchor = orders[0]['id'] if orders else 0
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+    for order in orders:
+        keyboard.inline_keyboard.append([
+            InlineKeyboardButton(text=f"✅ #{order['id']}", callback_data=pack(OrderApprove(order['id'], anchor))),
+            InlineKeyboardButton(text=f"❌ #{order['id']}", callback_data=pack(OrderReject(order['id'], anchor)))
+        ])
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀️ Новее", callback_data=pack(OrdersPage("prev", orders[0]['id']))))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Старше ▶️", callback_data=pack(OrdersPage("next", orders[-1]['id']))))
+    if nav:
+        keyboard.inline_keyboard.append(nav)
+    keyboard.inline_keyboard.append([
+        InlineKeyboardButton(text="🔄 Обновить", callback_data=pack(OrdersPage("at", anchor)))
+    ])
+    return keyboard
+
 def get_order_actions_keyboard(order_id):
     """Клавиатура действий с заказом"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="✅ Подтвердить оплату", callback_data=f"approve_{order_id}"),
-            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{order_id}")
+            InlineKeyboardButton(text="✅ Подтвердить оплату", callback_data=pack(OrderApprove(order_id))),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=pack(OrderReject(order_id)))
         ],
         [
             InlineKeyboardButton(text="🔙 Назад к заказам", callback_data="back_to_orders")
@@ -155,11 +179,27 @@ def get_confirm_post_keyboard():
             InlineKeyboardButton(text="🖼️ Изменить фото", callback_data="edit_post_photo")
         ],
         [
+            InlineKeyboardButton(text="⏰ Запланировать", callback_data="schedule_post"),
             InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_post")
         ]
     ])
     return keyboard
 
+def get_channel_post_keyboard():
+    """Клавиатура для поста в канале (только ссылки - ТОЛЬКО ТАК РАБОТАЕТ В КАНАЛЕ)"""
+    bot_username = "GiftFlowDB_bot"
+    twitch_url = "https://www.twitch.tv/lanatwitchh"
+    instagram_url = "https://www.instagram.com/lanawolfyy"
+    telegram_channel_url = "https://t.me/lanatwitchh"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📺 Twitch", url=twitch_url)],
+        [InlineKeyboardButton(text="📷 Instagram", url=instagram_url)],
+        [InlineKeyboardButton(text="🎁 Подарки", url=f"https://t.me/{bot_username}?start=gifts")],
+        [InlineKeyboardButton(text="❓ Помощь", url=f"https://t.me/{bot_username}?start=help")]
+    ])
+    return keyboard
+
 def get_back_to_admin_keyboard():
     """Кнопка возврата в админку"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
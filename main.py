@@ -1,16 +1,21 @@
 import asyncio
 import logging
-from datetime import datetime, timedelta
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import BotCommand
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 # ✅ Исправленный импорт для aiogram 3.x
 from aiogram.exceptions import TelegramForbiddenError, TelegramAPIError
 
 from config import BOT_TOKEN, SUPER_ADMIN_ID, SUPPORT_ADMIN_ID, CHANNEL_ID
-from database import init_db, update_stats_cache, get_top_heroes
+from database import init_db, update_stats_cache, close_db_pool
+from render import render_top
+from fsm_storage import SQLiteStorage
+from middlewares import UpdatePoolMiddleware, UserActivityMiddleware, ThrottlingMiddleware
+from jobs import register_jobs
+from scheduler import scheduler, Weekly
+from posts import post_publisher
+from outbox import outbox
 from handlers import routers
 
 logging.basicConfig(
@@ -21,8 +26,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-storage = MemoryStorage()
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
+# Очередь апдейтов первой: всё, что ниже (в т.ч. записи в БД), выполняется воркерами
+update_pool = UpdatePoolMiddleware(dp)
+dp.update.outer_middleware(update_pool)
+user_activity = UserActivityMiddleware()
+dp.update.outer_middleware(user_activity)
+dp.message.outer_middleware(ThrottlingMiddleware("message"))
+dp.callback_query.outer_middleware(ThrottlingMiddleware("callback"))
 
 # ПОДКЛЮЧАЕМ ВСЕ РОУТЕРЫ
 for router in routers:
@@ -41,49 +53,24 @@ async def set_commands():
 
 
 async def weekly_top_post():
-    """Раз в неделю постим топ героев в канал"""
-    while True:
-        now = datetime.now()
-        days_until_sunday = (6 - now.weekday()) % 7
-        if days_until_sunday == 0 and now.hour >= 19:
-            days_until_sunday = 7
-        next_sunday = now + timedelta(days=days_until_sunday)
-        next_sunday = next_sunday.replace(hour=19, minute=0, second=0, microsecond=0)
-        wait_seconds = (next_sunday - now).total_seconds()
+    """Пост топа героев в канал (по воскресеньям в 19:00, см. on_startup)"""
+    try:
+        bot_info = await bot.get_me()
+        post_text = await render_top("channel", limit=10, bot_username=bot_info.username)
         
-        logger.info(f"⏰ Следующий пост топа через {wait_seconds / 3600:.1f} часов")
-        await asyncio.sleep(wait_seconds)
+        if not post_text:
+            logger.info("Нет героев для поста")
+            return
         
-        try:
-            heroes = await get_top_heroes(limit=10)
-            
-            if not heroes:
-                logger.info("Нет героев для поста")
-                continue
-            
-            post_text = "🏆 <b>Топ героев канала за неделю</b>\n\n"
-            medals = ["🥇", "🥈", "🥉"]
-            
-            for i, hero in enumerate(heroes[:10]):
-                medal = medals[i] if i < 3 else "🎖️"
-                # ✅ Безопасное получение данных с дефолтами
-                username = hero.get('username') or f"user_{hero.get('user_id', '?')}"
-                amount = hero.get('total_amount', 0) or 0
-                post_text += f"{medal} {username} — {amount:,}₽\n"
-            
-            post_text += "\n💡 <i>Хочешь попасть в топ? Дари подарки через бота!</i>\n"
-            bot_info = await bot.get_me()
-            post_text += f"👉 @{bot_info.username}"
-            
-            await bot.send_message(CHANNEL_ID, post_text, parse_mode="HTML")
-            logger.info("✅ Пост топа опубликован")
-            
-        except TelegramForbiddenError:
-            logger.error("❌ Бот не имеет прав на отправку в канал (403 Forbidden)")
-        except TelegramAPIError as e:
-            logger.error(f"❌ Ошибка Telegram API при публикации топа: {e}")
-        except Exception as e:
-            logger.error(f"❌ Неожиданная ошибка публикации топа: {type(e).__name__}: {e}", exc_info=True)
+        await bot.send_message(CHANNEL_ID, post_text, parse_mode="HTML")
+        logger.info("✅ Пост топа опубликован")
+        
+    except TelegramForbiddenError:
+        logger.error("❌ Бот не имеет прав на отправку в канал (403 Forbidden)")
+        raise
+    except TelegramAPIError as e:
+        logger.error(f"❌ Ошибка Telegram API при публикации топа: {e}")
+        raise
 
 
 async def on_startup():
@@ -117,9 +104,14 @@ async def on_startup():
     else:
         logger.warning("⚠️ CHANNEL_ID не настроен!")
     
+    # Периодические задачи: очистка, архив, копии, обслуживание БД и пост топа
+    register_jobs(scheduler)
     if CHANNEL_ID:
-        asyncio.create_task(weekly_top_post())
-        logger.info("📅 Запущена задача еженедельной публикации топа")
+        # Пропущенный за время простоя пост публикуем, если опоздали меньше чем на сутки
+        scheduler.add_job("weekly_top_post", weekly_top_post, Weekly(6, 19), misfire_grace=24 * 3600)
+    await scheduler.start()
+    post_publisher.start(bot)
+    outbox.start(bot)
     
     # ✅ Уведомление админа с обработкой ошибок
     try:
@@ -152,6 +144,39 @@ async def on_shutdown():
     except Exception:
         pass
     
+    # Останавливаем планировщик; прерванные задачи выполнятся после перезапуска
+    try:
+        await scheduler.close()
+    except Exception as e:
+        logger.error(f"❌ Ошибка остановки планировщика: {e}")
+    
+    await post_publisher.close()
+    
+    # Дорабатываем уже принятые апдейты
+    try:
+        await update_pool.close()
+    except Exception as e:
+        logger.error(f"❌ Ошибка остановки обработки апдейтов: {e}")
+    
+    # Недоставленные уведомления остаются в outbox до следующего запуска
+    await outbox.close()
+    
+    # Сбрасываем незаписанные состояния FSM в БД, включая изменения
+    # апдейтов, доработанных после закрытия хранилища Dispatcher'ом
+    try:
+        await storage.close()
+    except Exception as e:
+        logger.error(f"❌ Ошибка сохранения состояний FSM: {e}")
+    
+    # И накопленную активность пользователей
+    try:
+        await user_activity.close()
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи активности пользователей: {e}")
+    
+    # Закрытие последних соединений переносит WAL в основной файл
+    close_db_pool()
+    
     # ✅ В aiogram 3 сессией управляет Dispatcher — не закрываем вручную
     logger.info("✅ Бот остановлен")
 
@@ -161,7 +186,9 @@ async def main():
     await on_startup()
     try:
         # ✅ allowed_updates можно не указывать — aiogram сам определит
-        await dp.start_polling(bot)
+        # Апдейты обрабатывает update_pool; polling подаёт их по одному и ждёт только места
+        # в очереди пользователей (не дольше UPDATE_QUEUE_WAIT), но не самой обработки
+        await dp.start_polling(bot, handle_as_tasks=False)
     except KeyboardInterrupt:
         logger.info("👋 Получен сигнал остановки (Ctrl+C)")
     except TelegramAPIError as e:
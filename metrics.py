@@ -0,0 +1,45 @@
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+# ============ ПРОСТЫЕ МЕТРИКИ В ПАМЯТИ ============
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = defaultdict(int)
+_gauges: Dict[str, float] = {}
+_collectors: List[Callable[[], None]] = []
+
+def inc(name: str, value: int = 1):
+    """Увеличить счётчик"""
+    with _lock:
+        _counters[name] += value
+
+def set_gauge(name: str, value: float):
+    """Установить текущее значение показателя"""
+    with _lock:
+        _gauges[name] = value
+
+def set_gauges(prefix: str, values: Dict[str, float]):
+    """Заменить все показатели с префиксом prefix новым набором"""
+    with _lock:
+        for name in [n for n in _gauges if n.startswith(prefix)]:
+            del _gauges[name]
+        for name, value in values.items():
+            _gauges[prefix + name] = value
+
+def get_counter(name: str) -> int:
+    return _counters.get(name, 0)
+
+def register_collector(collector: Callable[[], None]):
+    """Функция, обновляющая показатели перед снятием снимка"""
+    _collectors.append(collector)
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """Снимок всех счётчиков и показателей"""
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception:
+            pass
+    with _lock:
+        return {"counters": dict(_counters), "gauges": dict(_gauges)}
@@ -0,0 +1,417 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Router
+from aiogram.dispatcher.event.bases import UNHANDLED, CancelHandler, SkipHandler
+from aiogram.types import CallbackQuery, ErrorEvent, Message, TelegramObject, Update, User
+
+import metrics
+from config import (
+    USER_SEEN_CACHE_SIZE, USER_ACTIVITY_FLUSH_INTERVAL,
+    THROTTLE_LIMIT, THROTTLE_WINDOW, THROTTLE_REPEAT, THROTTLE_MAX_USERS,
+    UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_ADMIN_WORKERS, UPDATE_QUEUE_WAIT, is_admin
+)
+from database import upsert_users, touch_users
+from sender import sender
+
+logger = logging.getLogger(__name__)
+
+# (username, first_name, last_name)
+Profile = Tuple[Optional[str], Optional[str], Optional[str]]
+# (handler, event, data, момент постановки в очередь)
+Job = Tuple[Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], TelegramObject, Dict[str, Any], float]
+
+# ============ ОЧЕРЕДЬ АПДЕЙТОВ ============
+
+class UpdatePoolMiddleware(BaseMiddleware):
+    """Обработка апдейтов фиксированным числом воркеров с ограниченной очередью
+
+    По умолчанию aiogram запускает на каждый апдейт отдельную задачу, и
+    всплеск (пост в канале со ссылкой на каталог) становится тысячами
+    одновременных обработчиков поверх SQLite и Telegram API. Здесь апдейт
+    кладётся в очередь, а обрабатывают его workers воркеров. Очередей три,
+    общие воркеры берут их по старшинству:
+    - апдейты админов; admin_workers воркеров ждут только их, поэтому
+      подтверждение заказа не стоит за листающими каталог;
+    - апдейты пользователей внутри сценария (есть состояние FSM) и
+      сообщения с вложениями (чеки) — они не теряются и не ждут места;
+    - остальные апдейты пользователей, не больше queue_size.
+    Когда последняя очередь заполнена, приём ждёт места не дольше
+    put_timeout секунд: polling с handle_as_tasks=False подаёт апдейты по
+    одному, и пока он ждёт, новые апдейты остаются у Telegram. Дольше
+    ждать нельзя — за этим апдейтом могут стоять апдейты админов. Если
+    место не освободилось, апдейт не обрабатывается, а пользователю
+    отвечаем, что бот перегружен и нужно повторить (метрика updates.shed);
+    пока очередь не разгрузится наполовину, следующие такие апдейты
+    получают этот ответ сразу, без повторного ожидания.
+    Подключается первым outer-middleware апдейтов; обработчик считается
+    выполненным, как только апдейт принят в очередь. Ошибки обработчиков
+    воркеры передают в router.errors (обычно Dispatcher), как это делает
+    ErrorsMiddleware aiogram для апдейтов без очереди.
+    """
+
+    # Ответов «повторите позже», ожидающих отправки через sender
+    MAX_PENDING_REPLIES = 1000
+
+    def __init__(self, router: Optional[Router] = None, workers: int = UPDATE_WORKERS,
+                 queue_size: int = UPDATE_QUEUE_SIZE, admin_workers: int = UPDATE_ADMIN_WORKERS,
+                 put_timeout: float = UPDATE_QUEUE_WAIT):
+        self.router = router
+        self.workers = max(1, workers)
+        self.admin_workers = max(0, admin_workers)
+        self.put_timeout = put_timeout
+        self._users: "asyncio.Queue[Job]" = asyncio.Queue(maxsize=queue_size)
+        self._flows: "asyncio.Queue[Job]" = asyncio.Queue()
+        self._admins: "asyncio.Queue[Job]" = asyncio.Queue()
+        # Сколько апдейтов ждёт во всех очередях (для общих воркеров)
+        self._ready = asyncio.Semaphore(0)
+        self._tasks: List[asyncio.Task] = []
+        self._active = 0
+        self._shedding = False
+        self._replies = set()
+        metrics.register_collector(self.collect_metrics)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self._tasks:
+            self.start()
+        user: Optional[User] = data.get("event_from_user")
+        job = (handler, event, data, time.monotonic())
+        if user is not None and is_admin(user.id):
+            self._admins.put_nowait(job)
+            metrics.inc("updates.admin")
+        elif self._in_flow(event, data):
+            self._flows.put_nowait(job)
+            metrics.inc("updates.flow")
+        elif not await self._put_user(job):
+            metrics.inc("updates.shed")
+            self._ask_to_repeat(event, data)
+            return None
+        self._ready.release()
+        return None
+
+    @staticmethod
+    def _in_flow(event: TelegramObject, data: Dict[str, Any]) -> bool:
+        """Апдейт внутри сценария FSM или сообщение с вложением (чек)"""
+        if data.get("raw_state") is not None:
+            return True
+        message = event.message if isinstance(event, Update) else None
+        return message is not None and bool(message.photo or message.document or message.media_group_id)
+
+    async def _put_user(self, job: Job) -> bool:
+        """Поставить апдейт в очередь пользователей, подождав место не дольше put_timeout"""
+        try:
+            self._users.put_nowait(job)
+        except asyncio.QueueFull:
+            if self._shedding:
+                return False
+            metrics.inc("updates.waited")
+            try:
+                await asyncio.wait_for(self._users.put(job), self.put_timeout)
+            except asyncio.TimeoutError:
+                self._shedding = True
+                logger.warning(f"Очередь апдейтов заполнена ({self._users.maxsize}) дольше {self.put_timeout:g} с: "
+                               f"пользователей просим повторить")
+                return False
+        if self._shedding and self._users.qsize() < self._users.maxsize // 2:
+            self._shedding = False
+            logger.info("Очередь апдейтов освободилась, приём восстановлен")
+        return True
+
+    def _ask_to_repeat(self, event: TelegramObject, data: Dict[str, Any]):
+        """Ответить на необработанный апдейт, не задерживая приём"""
+        if not isinstance(event, Update):
+            return
+        if len(self._replies) >= self.MAX_PENDING_REPLIES:
+            metrics.inc("updates.shed_unanswered")
+            return
+        bot = data.get("bot")
+        if event.callback_query is not None:
+            reply = event.callback_query.answer("⏳ Бот перегружен, нажмите ещё раз через минуту", show_alert=True)
+        elif event.message is not None and bot is not None:
+            reply = sender.send_message(bot, event.message.chat.id,
+                                        "⏳ Бот сейчас перегружен, и это сообщение не обработано. "
+                                        "Отправьте его ещё раз через минуту.")
+        else:
+            return
+        task = asyncio.create_task(reply)
+        self._replies.add(task)
+        task.add_done_callback(self._reply_done)
+
+    def _reply_done(self, task: asyncio.Task):
+        self._replies.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Не удалось ответить на необработанный апдейт: {task.exception()}")
+
+    def start(self):
+        """Запустить воркеры (вызывается при первом апдейте)"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks += [asyncio.create_task(self._admin_worker()) for _ in range(self.admin_workers)]
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            if not self._admins.empty():
+                queue = self._admins
+            elif not self._flows.empty():
+                queue = self._flows
+            elif not self._users.empty():
+                queue = self._users
+            else:
+                # Апдейт уже забрал воркер админов
+                continue
+            await self._run(queue, queue.get_nowait())
+
+    async def _admin_worker(self):
+        while True:
+            job = await self._admins.get()
+            await self._run(self._admins, job)
+
+    async def _run(self, queue: asyncio.Queue, job: Job):
+        handler, event, data, queued_at = job
+        self._active += 1
+        metrics.set_gauge("updates.wait_ms", round((time.monotonic() - queued_at) * 1000, 1))
+        try:
+            await handler(event, data)
+        except (SkipHandler, CancelHandler):
+            pass
+        except Exception as e:
+            await self._handle_error(event, data, e)
+        finally:
+            self._active -= 1
+            queue.task_done()
+            metrics.inc("updates.processed")
+
+    async def _handle_error(self, event: TelegramObject, data: Dict[str, Any], error: Exception):
+        """Передать ошибку обработчикам router.errors; необработанную — в лог"""
+        router = self.router or data.get("dispatcher")
+        if router is not None:
+            try:
+                response = await router.propagate_event(
+                    update_type="error", event=ErrorEvent(update=event, exception=error), **data
+                )
+                if response is not UNHANDLED:
+                    return
+            except Exception as e:
+                error = e
+        logger.error(f"Ошибка обработки апдейта: {type(error).__name__}: {error}", exc_info=error)
+
+    async def close(self, timeout: float = 10):
+        """Дождаться принятых апдейтов (не дольше timeout) и остановить воркеры"""
+        if self._tasks:
+            try:
+                await asyncio.wait_for(asyncio.gather(self._admins.join(), self._flows.join(), self._users.join()), timeout)
+            except asyncio.TimeoutError:
+                left = self._users.qsize() + self._flows.qsize() + self._admins.qsize()
+                logger.warning(f"Не обработано апдейтов при остановке: {left}")
+        tasks, self._tasks = self._tasks + list(self._replies), []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def collect_metrics(self):
+        metrics.set_gauges("updates.", {
+            "queued": self._users.qsize(),
+            "queued_flow": self._flows.qsize(),
+            "queued_admin": self._admins.qsize(),
+            "active": self._active,
+        })
+
+# ============ АКТИВНОСТЬ ПОЛЬЗОВАТЕЛЕЙ ============
+
+class UserActivityMiddleware(BaseMiddleware):
+    """Регистрация пользователей и учёт last_active без записи в БД на каждый апдейт
+
+    Пользователь, которого процесс ещё не видел (или у которого сменился
+    профиль), записывается одним UPSERT до вызова обработчика — дальше
+    обработчики могут рассчитывать на строку в users. Для недавно виденных
+    только запоминается время, а last_active пишется пачкой раз в flush_interval.
+    Подключается как outer-middleware апдейтов после UserContextMiddleware.
+    """
+
+    def __init__(self, seen_size: int = USER_SEEN_CACHE_SIZE, flush_interval: float = USER_ACTIVITY_FLUSH_INTERVAL):
+        self.seen_size = seen_size
+        self.flush_interval = flush_interval
+        self._seen: "OrderedDict[int, Profile]" = OrderedDict()
+        self._touched: Dict[int, float] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            try:
+                await self.seen(user)
+            except Exception as e:
+                # Учёт активности не должен мешать обработке апдейта
+                logger.error(f"Ошибка учёта пользователя {user.id}: {e}")
+        return await handler(event, data)
+
+    async def seen(self, user: User):
+        """Отметить пользователя; новый или сменивший профиль записывается сразу"""
+        profile = (user.username, user.first_name, user.last_name)
+        if self._seen.get(user.id) == profile:
+            self._seen.move_to_end(user.id)
+            self._touched[user.id] = time.time()
+            metrics.inc("users.seen_cached")
+        else:
+            await upsert_users([(user.id, *profile)])
+            # Свежий UPSERT уже записал last_active
+            self._touched.pop(user.id, None)
+            self._seen[user.id] = profile
+            self._seen.move_to_end(user.id)
+            while len(self._seen) > self.seen_size:
+                self._seen.popitem(last=False)
+            metrics.inc("users.upserted")
+        if self._task is None and not self._closed:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи активности пользователей: {e}")
+
+    async def flush(self):
+        """Записать накопленные last_active одной транзакцией"""
+        async with self._flush_lock:
+            if not self._touched:
+                return
+            touches, self._touched = self._touched, {}
+            try:
+                await touch_users(list(touches.items()))
+            except Exception:
+                # Вернуть в очередь всё, что не обновилось за время записи
+                for user_id, seen_at in touches.items():
+                    self._touched.setdefault(user_id, seen_at)
+                raise
+            metrics.inc("users.touched", len(touches))
+
+    async def close(self):
+        """Остановить фоновую запись и сбросить остаток"""
+        self._closed = True
+        task, self._task = self._task, None
+        if task is not None:
+            async with self._flush_lock:
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+# ============ АНТИ-ФЛУД ============
+
+class _Window:
+    """Скользящее окно одного пользователя"""
+    __slots__ = ("hits", "last_data", "last_at", "last_group", "warned_until")
+
+    def __init__(self):
+        self.hits = deque()
+        self.last_data = None
+        self.last_at = 0.0
+        self.last_group = None
+        self.warned_until = 0.0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты сообщений или нажатий одного пользователя
+
+    Пропускается не больше limit апдейтов за последние window секунд;
+    повторное нажатие той же кнопки в пределах repeat секунд склеивается
+    с первым. Альбом (сообщения с общим media_group_id) считается одним
+    сообщением: Telegram присылает каждое фото отдельным апдейтом, и чек
+    из нескольких скриншотов не должен терять фото. Лишние апдейты
+    отбрасываются до фильтров и обработчиков. На каждое отброшенное нажатие
+    отвечаем, иначе кнопка останется с «часиками»; предупреждение в ответе
+    и на отброшенное сообщение — не чаще раза за окно, остальные сообщения
+    отбрасываются без запросов к API.
+    Админы не ограничиваются. Окна живут в LRU на max_users пользователей.
+    Подключается как outer-middleware наблюдателя message или callback_query.
+    """
+
+    def __init__(self, kind: str, limit: int = THROTTLE_LIMIT, window: float = THROTTLE_WINDOW,
+                 repeat: float = THROTTLE_REPEAT, max_users: int = THROTTLE_MAX_USERS):
+        self.kind = kind
+        self.limit = limit
+        self.window = window
+        self.repeat = repeat
+        self.max_users = max_users
+        self._windows: "OrderedDict[int, _Window]" = OrderedDict()
+        metrics.register_collector(self.collect_metrics)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is None or is_admin(user.id):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        window = self._window(user.id)
+        group = event.media_group_id if isinstance(event, Message) else None
+        if group is not None and group == window.last_group:
+            # Следующее фото уже пропущенного альбома
+            return await handler(event, data)
+        payload = event.data if isinstance(event, CallbackQuery) else None
+        if payload is not None and payload == window.last_data and now - window.last_at < self.repeat:
+            metrics.inc(f"throttle.{self.kind}.coalesced")
+            return await self._reject(event, window, now, silent=True)
+
+        hits = window.hits
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        if len(hits) >= self.limit:
+            metrics.inc(f"throttle.{self.kind}.dropped")
+            return await self._reject(event, window, now)
+
+        hits.append(now)
+        window.last_data, window.last_at = payload, now
+        if group is not None:
+            window.last_group = group
+        return await handler(event, data)
+
+    def _window(self, user_id: int) -> _Window:
+        window = self._windows.get(user_id)
+        if window is None:
+            window = self._windows[user_id] = _Window()
+            while len(self._windows) > self.max_users:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(user_id)
+        return window
+
+    async def _reject(self, event: TelegramObject, window: _Window, now: float, silent: bool = False):
+        """Снять «часики» с отброшенного нажатия; предупредить не чаще раза за окно"""
+        warn = now >= window.warned_until and not silent
+        if warn:
+            window.warned_until = now + self.window
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Слишком часто, подождите пару секунд" if warn else None)
+            elif isinstance(event, Message) and warn:
+                await event.answer("⏳ Слишком много сообщений подряд — это не обработано. Подождите пару секунд и повторите.")
+        except Exception as e:
+            logger.debug(f"Не удалось ответить на отброшенный апдейт: {e}")
+        return None
+
+    def collect_metrics(self):
+        metrics.set_gauge(f"throttle.{self.kind}.users", len(self._windows))
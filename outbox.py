@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound
+
+import metrics
+from config import OUTBOX_BATCH, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX
+from database import (
+    set_outbox_listener, claim_outbox, finish_outbox, next_outbox_at, requeue_sending_outbox
+)
+from sender import sender
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, которые повтор не исправит: бот заблокирован, чат не найден, текст не принят
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramNotFound, TelegramBadRequest)
+
+# ============ ДОСТАВКА УВЕДОМЛЕНИЙ ============
+
+class OutboxWorker:
+    """Фоновая доставка уведомлений из таблицы outbox
+
+    Обработчик только записывает уведомление в той же транзакции, что и
+    подтверждение заказа, и сразу отвечает админу; медленный или упавший
+    Telegram API его больше не задерживает, а уведомление не теряется.
+    Как и PostPublisher, воркер спит до ближайшей попытки (MIN по индексу
+    status, next_attempt_at), а COMMIT с новыми уведомлениями будит его.
+    Подошедшие уведомления забираются UPDATE ... RETURNING (pending ->
+    sending) и отправляются через общий sender параллельно. Временная
+    ошибка откладывает повтор с удвоением паузы, после max_attempts или
+    при постоянной ошибке (403, 400) уведомление помечается 'failed'.
+    Повторная постановка того же dedup_key ничего не добавляет.
+    Доставка — «хотя бы раз»: если бот остановился между отправкой и
+    отметкой 'sent', после перезапуска уведомление уйдёт ещё раз.
+    """
+
+    # Таймер просыпается не реже, чтобы подхватить уведомления других процессов
+    MAX_SLEEP = 60
+
+    def __init__(self, batch: int = OUTBOX_BATCH, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 retry_base: float = OUTBOX_RETRY_BASE, retry_max: float = OUTBOX_RETRY_MAX):
+        self.batch = batch
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        self._loop = asyncio.get_running_loop()
+        set_outbox_listener(self.wake_threadsafe)
+        self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Проверить очередь сейчас"""
+        self._wakeup.set()
+
+    def wake_threadsafe(self):
+        """wake() из потока БД (после COMMIT в asyncio.to_thread)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        requeued = await requeue_sending_outbox()
+        if requeued:
+            logger.warning(f"📨 Возвращено в очередь прерванных уведомлений: {requeued}")
+        while True:
+            self._wakeup.clear()
+            try:
+                messages = await claim_outbox(time.time(), self.batch)
+                if messages:
+                    await asyncio.gather(*(self._deliver(message) for message in messages))
+                    continue
+                next_at = await next_outbox_at()
+            except Exception as e:
+                logger.error(f"❌ Ошибка очереди уведомлений: {e}")
+                next_at = None
+            delay = self.MAX_SLEEP if next_at is None else next_at - time.time()
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(delay, self.MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, message: Dict):
+        try:
+            await sender.send_message(self._bot, message['chat_id'], message['text'], parse_mode="HTML")
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, PERMANENT_ERRORS) or message['attempts'] >= self.max_attempts:
+                logger.error(f"❌ Уведомление {message['dedup_key']} не доставлено: {error}")
+                await finish_outbox(message['id'], "failed", error)
+                metrics.inc("outbox.failed")
+                return
+            delay = min(self.retry_base * 2 ** (message['attempts'] - 1), self.retry_max)
+            logger.warning(f"⚠️ Уведомление {message['dedup_key']}: повтор через {delay:g} с ({error})")
+            await finish_outbox(message['id'], "pending", error, time.time() + delay)
+            metrics.inc("outbox.retried")
+            return
+        await finish_outbox(message['id'], "sent")
+        metrics.inc("outbox.sent")
+
+    async def close(self):
+        set_outbox_listener(None)
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+outbox = OutboxWorker()
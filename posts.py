@@ -0,0 +1,137 @@
+import asyncio
+import html
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from aiogram import Bot
+
+import metrics
+from config import CHANNEL_ID
+from database import claim_due_posts, finish_scheduled_post, next_scheduled_post_at, requeue_sending_posts
+from keyboards import get_channel_post_keyboard
+from sender import sender
+
+logger = logging.getLogger(__name__)
+
+# ============ ПУБЛИКАЦИЯ ПОСТОВ ============
+
+async def publish_post(bot: Bot, text: str, photo: Optional[str] = None):
+    """Пост в канал с кнопками через отправку с ограничением частоты и повторами"""
+    if photo:
+        return await sender.send_photo(bot, CHANNEL_ID, photo, caption=text, parse_mode="HTML",
+                                       reply_markup=get_channel_post_keyboard())
+    return await sender.send_message(bot, CHANNEL_ID, text, parse_mode="HTML",
+                                     reply_markup=get_channel_post_keyboard())
+
+def parse_publish_time(text: str, now: datetime = None) -> Optional[datetime]:
+    """Время публикации из «ЧЧ:ММ», «ДД.ММ ЧЧ:ММ» или «ДД.ММ.ГГГГ ЧЧ:ММ» (местное время)
+
+    «ЧЧ:ММ» — сегодня, а если время уже прошло, завтра; дата без года —
+    ближайшая будущая. None — формат не распознан или время в прошлом.
+    """
+    now = now or datetime.now()
+    text = " ".join(text.split())
+    for fmt in ("%d.%m.%Y %H:%M", "%d.%m %H:%M", "%H:%M"):
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if fmt == "%H:%M":
+            moment = now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+            return moment if moment > now else moment + timedelta(days=1)
+        if fmt == "%d.%m %H:%M":
+            try:
+                moment = parsed.replace(year=now.year)
+                if moment <= now:
+                    moment = parsed.replace(year=now.year + 1)
+            except ValueError:
+                # 29.02 в невисокосный год
+                return None
+            return moment
+        return parsed if parsed > now else None
+    return None
+
+# ============ ОТЛОЖЕННЫЕ ПОСТЫ ============
+
+class PostPublisher:
+    """Публикация отложенных постов в назначенное время
+
+    Один таймер спит до ближайшего publish_at (MIN по индексу
+    status, publish_at), а не опрашивает таблицу. Новый или отменённый
+    пост будит таймер через wake(). Подошедшие посты забираются
+    UPDATE ... RETURNING (scheduled -> sending), поэтому пост не уйдёт
+    дважды при нескольких процессах. Посты, прерванные остановкой бота,
+    при старте возвращаются в очередь. Об итоге пишем создавшему пост админу.
+    """
+
+    # Таймер просыпается не реже, чтобы перевод часов не сбивал расписание
+    MAX_SLEEP = 60
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Пересчитать ближайшее время публикации (после добавления или отмены)"""
+        self._wakeup.set()
+
+    async def _run(self):
+        requeued = await requeue_sending_posts()
+        if requeued:
+            logger.warning(f"⏰ Возвращено в очередь прерванных постов: {requeued}")
+        while True:
+            self._wakeup.clear()
+            try:
+                for post in await claim_due_posts(time.time()):
+                    await self._publish(post)
+                next_at = await next_scheduled_post_at()
+            except Exception as e:
+                logger.error(f"❌ Ошибка очереди отложенных постов: {e}")
+                next_at = None
+            delay = self.MAX_SLEEP if next_at is None else next_at - time.time()
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(delay, self.MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _publish(self, post: Dict):
+        late = time.time() - post['publish_at']
+        try:
+            message = await publish_post(self._bot, post['text'], post['photo'])
+        except Exception as e:
+            logger.error(f"❌ Ошибка публикации отложенного поста #{post['id']}: {e}")
+            await finish_scheduled_post(post['id'], "failed", error=f"{type(e).__name__}: {e}")
+            metrics.inc("posts.failed")
+            await self._notify(post, f"❌ Отложенный пост #{post['id']} не опубликован:\n<code>{html.escape(str(e))}</code>")
+            return
+        await finish_scheduled_post(post['id'], "sent", message_id=message.message_id)
+        metrics.inc("posts.sent")
+        metrics.set_gauge("posts.late_seconds", round(late, 1))
+        logger.info(f"✅ Отложенный пост #{post['id']} опубликован")
+        await self._notify(post, f"✅ Отложенный пост #{post['id']} опубликован в канале")
+
+    async def _notify(self, post: Dict, text: str):
+        if not post['created_by']:
+            return
+        try:
+            await sender.send_message(self._bot, post['created_by'], text, parse_mode="HTML")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось уведомить админа {post['created_by']}: {e}")
+
+    async def close(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+post_publisher = PostPublisher()
@@ -0,0 +1,133 @@
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+# ============ ЗАПИСИ БД ============
+
+_tuple_getitem = tuple.__getitem__
+
+
+class Record(tuple):
+    """Строка БД: кортеж со слотами вместо dict
+
+    Значения лежат в кортеже в порядке _fields, поля доступны атрибутами
+    (order.amount) и по ключу, как у dict (order['amount'], order.get('username')),
+    поэтому обработчики, написанные под dict(row), работают без изменений.
+    Целочисленные индексы и срезы ведут себя как у обычного кортежа.
+    """
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _index: Dict[str, int] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._index = {name: i for i, name in enumerate(cls._fields)}
+        for name, i in cls._index.items():
+            setattr(cls, name, property(itemgetter(i), doc=f"Поле {name}"))
+
+    def __new__(cls, *values, **fields):
+        """Record(1, 'a', ...) или Record(id=1, name='a'); недостающие поля — None"""
+        if fields:
+            values += tuple(fields.get(name) for name in cls._fields[len(values):])
+        return tuple.__new__(cls, values + (None,) * (len(cls._fields) - len(values)))
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            try:
+                return _tuple_getitem(self, self._index[key])
+            except KeyError:
+                raise KeyError(key) from None
+        return _tuple_getitem(self, key)
+
+    def __contains__(self, key) -> bool:
+        return key in self._index
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{k}={v!r}' for k, v in zip(self._fields, self))})"
+
+    def __reduce__(self):
+        return type(self), tuple(self)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        i = self._index.get(key)
+        return default if i is None else _tuple_getitem(self, i)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._fields
+
+    def values(self) -> Tuple:
+        return tuple(self)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return zip(self._fields, self)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(zip(self._fields, self))
+
+    @classmethod
+    def picker(cls, *names: str) -> Callable[["Record"], Tuple]:
+        """Быстрый выбор нескольких полей кортежем (для выгрузок)"""
+        return itemgetter(*(cls._index[name] for name in names))
+
+
+class User(Record):
+    __slots__ = ()
+    _fields = ("id", "user_id", "username", "first_name", "last_name", "registered_at", "last_active")
+
+
+class Gift(Record):
+    __slots__ = ()
+    _fields = ("id", "name", "description", "price", "icon", "is_active", "created_at")
+
+
+class Order(Record):
+    """Запись журнала пожертвований; user_username и first_name — из users, если запрос их выбирает"""
+    __slots__ = ()
+    _fields = (
+        "id", "source", "legacy_id", "user_id", "username", "gift_id", "gift_name", "amount", "status",
+        "payment_method", "payment_details", "created_at", "confirmed_at", "confirmed_by", "receipt_id",
+        "user_username", "first_name"
+    )
+
+
+# Транзакции СБП хранятся в том же журнале, что и заказы
+Transaction = Order
+
+
+class Hero(Record):
+    __slots__ = ()
+    _fields = ("user_id", "username", "total_amount", "last_donate", "updated_at")
+
+
+class GalleryPhoto(Record):
+    __slots__ = ()
+    _fields = ("id", "file_id", "description", "added_by", "added_at")
+
+# ============ ФАБРИКА СТРОК ============
+
+def record_factory(record_type: type, description) -> Callable[[tuple], Record]:
+    """Функция, превращающая кортеж строки курсора в record_type
+
+    Раскладка строится один раз на запрос по cursor.description.
+    Колонки, которых нет в record_type, отбрасываются; поля, которых
+    нет в запросе, получают None.
+    """
+    return _factory(record_type, tuple(column[0] for column in description))
+
+@lru_cache(maxsize=256)
+def _factory(record_type: type, names: Tuple[str, ...]) -> Callable[[tuple], Record]:
+    fields = record_type._fields
+    new = tuple.__new__
+    if names == fields:
+        return lambda row: new(record_type, row)
+    if names == fields[:len(names)]:
+        padding = (None,) * (len(fields) - len(names))
+        return lambda row: new(record_type, row + padding)
+
+    positions = {name: i for i, name in enumerate(names)}
+    # Отсутствующие в запросе поля берём из хвостового None
+    missing = len(names)
+    pick = itemgetter(*(positions.get(name, missing) for name in fields))
+    if len(fields) == 1:
+        return lambda row: new(record_type, (pick(row + (None,)),))
+    return lambda row: new(record_type, pick(row + (None,)))
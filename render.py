@@ -0,0 +1,125 @@
+import asyncio
+import html
+import time
+from typing import Dict, Optional, Sequence
+
+import metrics
+from config import RENDER_CACHE_TTL
+from database import get_top_heroes, get_statistics, data_version
+from records import Hero
+
+# ============ ВИДЫ ТОПА ГЕРОЕВ ============
+
+# title — заголовок, medals — значки первых мест (дальше rest с номером {i}),
+# at — писать @ перед именем, footer — подпись ({bot_username} подставляется),
+# empty — текст пустого топа (None — текста нет, вызывающий решает сам)
+TOP_VIEWS = {
+    "public": {
+        "title": "🏆 <b>Топ героев</b>",
+        "medals": ("🥇", "🥈", "🥉"), "rest": "{i}.", "at": True,
+        "footer": "\n💎 Топ-1 получит секретный приз!",
+        "empty": "🏆 <b>Топ героев пока пуст</b>\n\nСтань первым!",
+    },
+    "admin": {
+        "title": "🏆 <b>Топ героев (админ-панель)</b>",
+        "medals": ("🥇", "🥈", "🥉"), "rest": "{i}.", "at": True,
+        "footer": "",
+        "empty": "🏆 Топ героев пока пуст.",
+    },
+    "check": {
+        "title": "📊 <b>ТЕКУЩИЙ ТОП</b>",
+        "medals": (), "rest": "{i}.", "at": True,
+        "footer": "",
+        "empty": "📭 Топ пуст",
+    },
+    "channel": {
+        "title": "🏆 <b>Топ героев канала за неделю</b>",
+        "medals": ("🥇", "🥈", "🥉"), "rest": "🎖️", "at": False,
+        "footer": "\n💡 <i>Хочешь попасть в топ? Дари подарки через бота!</i>\n👉 @{bot_username}",
+        "empty": None,
+    },
+}
+
+def format_heroes(heroes: Sequence[Hero], medals: Sequence[str] = (), rest: str = "{i}.", at: bool = True) -> str:
+    """Строки топа: «🥇 @имя — 1,000₽», по одной на героя"""
+    lines = []
+    for i, hero in enumerate(heroes, 1):
+        mark = medals[i - 1] if i <= len(medals) else rest.format(i=i)
+        name = html.escape(hero.username or f"user_{hero.user_id}")
+        lines.append(f"{mark} {'@' if at else ''}{name} — {hero.total_amount or 0:,}₽\n")
+    return "".join(lines)
+
+def format_top(heroes: Sequence[Hero], view: str = "public", bot_username: str = "") -> Optional[str]:
+    """Готовый HTML-текст топа в виде view"""
+    spec = TOP_VIEWS[view]
+    if not heroes:
+        return spec["empty"]
+    body = format_heroes(heroes, spec["medals"], spec["rest"], spec["at"])
+    return f"{spec['title']}\n\n{body}{spec['footer'].format(bot_username=bot_username)}"
+
+def format_statistics(stats: Dict, heroes: Sequence[Hero]) -> str:
+    """Готовый HTML-текст сводной статистики с топ-3"""
+    return (
+        f"📊 <b>СТАТИСТИКА</b>\n\n"
+        f"💰 Всего собрано: {stats['total_amount']:,}₽\n"
+        f"🎁 Всего подарков: {stats['total_orders']}\n"
+        f"👥 Участников: {stats['total_users']}\n"
+        f"⏳ Ожидает проверки: {stats['total_pending']}\n\n"
+        f"🏆 <b>Топ-3 героев:</b>\n{format_heroes(heroes)}"
+    )
+
+# ============ КЭШ ГОТОВЫХ ТЕКСТОВ ============
+
+# ключ -> (версии данных, момент истечения, текст)
+_texts: Dict[tuple, tuple] = {}
+# Построения в процессе: ключ -> (версии данных, future); одновременные промахи ждут одно построение
+_building: Dict[tuple, tuple] = {}
+
+async def _cached(key: tuple, versions: Sequence[str], build) -> Optional[str]:
+    """Текст из кэша, если данные versions не менялись, иначе build() (один на всех ждущих)
+
+    Функции чтения БД при ошибке отдают пустой результат, поэтому текст
+    живёт не дольше RENDER_CACHE_TTL даже без изменений данных.
+    """
+    # Версию читаем до запроса в БД: запись, успевшая после, сменит версию
+    version = data_version(*versions)
+    cached = _texts.get(key)
+    if cached is not None and cached[0] == version and cached[1] > time.monotonic():
+        metrics.inc("render.hits")
+        return cached[2]
+
+    building = _building.get(key)
+    if building is not None and building[0] == version:
+        metrics.inc("render.hits")
+        return await asyncio.shield(building[1])
+
+    metrics.inc("render.misses")
+    future = asyncio.get_running_loop().create_future()
+    _building[key] = (version, future)
+    try:
+        text = await build()
+    except BaseException as e:
+        # Ждущие получают ту же ошибку (отмену построения — как RuntimeError)
+        future.set_exception(e if isinstance(e, Exception) else RuntimeError("Построение текста прервано"))
+        future.exception()
+        raise
+    else:
+        _texts[key] = (version, time.monotonic() + RENDER_CACHE_TTL, text)
+        future.set_result(text)
+        return text
+    finally:
+        if _building.get(key, (None, None))[1] is future:
+            del _building[key]
+
+async def render_top(view: str = "public", limit: int = 10, bot_username: str = "") -> Optional[str]:
+    """Топ героев в виде view; пока топ не менялся, БД не запрашивается"""
+    async def build():
+        return format_top(await get_top_heroes(limit=limit), view, bot_username)
+    return await _cached(("top", view, limit, bot_username), ("heroes",), build)
+
+async def render_statistics() -> str:
+    """Сводная статистика для админов; пока данные не менялись, БД не запрашивается"""
+    async def build():
+        stats, heroes = await asyncio.gather(get_statistics(), get_top_heroes(limit=3))
+        return format_statistics(stats, heroes)
+    return await _cached(("stats",), ("heroes", "stats"), build)
@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from config import JOB_HISTORY_KEEP, JOB_TIMEOUT
+from database import load_jobs, save_job, start_job_run, finish_job_run
+
+logger = logging.getLogger(__name__)
+
+# ============ РАСПИСАНИЯ ============
+
+class Every:
+    """Запуск через равные промежутки: следующий — через seconds после окончания предыдущего
+
+    first_delay — задержка первого запуска задачи, которой ещё нет в БД.
+    """
+
+    def __init__(self, seconds: float, first_delay: float = 0):
+        self.seconds = seconds
+        self.first_delay = first_delay
+
+    def first_run(self, now: float) -> float:
+        return now + self.first_delay
+
+    def next_after(self, ts: float) -> float:
+        return ts + self.seconds
+
+    def __str__(self) -> str:
+        return f"every {self.seconds:g}s"
+
+
+class Weekly:
+    """Раз в неделю в weekday (0 — понедельник) в hour:minute по местному времени"""
+
+    def __init__(self, weekday: int, hour: int, minute: int = 0):
+        self.weekday = weekday
+        self.hour = hour
+        self.minute = minute
+
+    def first_run(self, now: float) -> float:
+        return self.next_after(now)
+
+    def next_after(self, ts: float) -> float:
+        moment = datetime.fromtimestamp(ts)
+        candidate = moment.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        candidate += timedelta(days=(self.weekday - moment.weekday()) % 7)
+        if candidate.timestamp() <= ts:
+            candidate += timedelta(days=7)
+        return candidate.timestamp()
+
+    def __str__(self) -> str:
+        return f"weekly {self.weekday} {self.hour:02d}:{self.minute:02d}"
+
+# ============ ПЛАНИРОВЩИК ============
+
+class Job:
+    """Задача планировщика
+
+    persist=False — частые служебные задачи: состояние только в памяти,
+    без истории (запись в БД каждые полминуты мешала бы checkpoint в простое).
+    misfire_grace — насколько можно опоздать с пропущенным за время простоя
+    запуском; опоздавший сильнее запуск пропускается (None — выполнять всегда).
+    """
+
+    def __init__(self, name: str, func: Callable[[], Awaitable], schedule, persist: bool = True,
+                 timeout: float = JOB_TIMEOUT, misfire_grace: Optional[float] = None):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.persist = persist
+        self.timeout = timeout
+        self.misfire_grace = misfire_grace
+        self.next_run_at: Optional[float] = None
+        self.last_run_at: Optional[float] = None
+        self.last_status: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class Scheduler:
+    """Планировщик периодических задач с одним таймером на куче времён запуска
+
+    Время следующего запуска хранится в scheduled_jobs, поэтому перезапуск
+    бота не сдвигает расписание, а запуск, пропущенный за время простоя,
+    выполняется сразу после старта (один раз, сколько бы ни пропустили).
+    Задача не запускается повторно, пока выполняется: в процессе — по
+    job.task, между процессами — по аренде в БД. Следующий запуск
+    планируется после окончания текущего. Итоги пишутся в job_runs.
+    """
+
+    # Таймер просыпается не реже, чтобы перевод часов не сбивал недельные задачи
+    MAX_SLEEP = 60
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._wakeup = asyncio.Event()
+        self._timer: Optional[asyncio.Task] = None
+        self._owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def add_job(self, name: str, func: Callable[[], Awaitable], schedule, **options) -> Job:
+        """Зарегистрировать задачу (до start())"""
+        if name in self.jobs:
+            raise ValueError(f"Задача {name} уже зарегистрирована")
+        job = self.jobs[name] = Job(name, func, schedule, **options)
+        return job
+
+    async def start(self):
+        """Восстановить расписание из БД и запустить таймер"""
+        now = time.time()
+        stored = await load_jobs()
+        for job in self.jobs.values():
+            state = stored.get(job.name) if job.persist else None
+            if state is None or state['schedule'] != str(job.schedule):
+                job.next_run_at = job.schedule.first_run(now)
+                if job.persist:
+                    await save_job(job.name, str(job.schedule), job.next_run_at)
+            else:
+                job.next_run_at = state['next_run_at']
+                job.last_run_at = state['last_run_at']
+                job.last_status = state['last_status']
+                late = now - job.next_run_at
+                if late > 0 and job.misfire_grace is not None and late > job.misfire_grace:
+                    logger.warning(f"⏰ Пропущенный запуск {job.name} опоздал на {late / 3600:.1f} ч — пропускаем")
+                    job.next_run_at = job.schedule.next_after(now)
+                    await save_job(job.name, str(job.schedule), job.next_run_at)
+                elif late > 0:
+                    logger.info(f"⏰ Задача {job.name} пропустила запуск — выполняем сейчас")
+            self._push(job)
+        self._timer = asyncio.create_task(self._run_timer())
+        logger.info(f"📅 Планировщик запущен, задач: {len(self.jobs)}")
+
+    def _push(self, job: Job):
+        heapq.heappush(self._heap, (job.next_run_at, job.name))
+        self._wakeup.set()
+
+    async def _run_timer(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                run_at, name = heapq.heappop(self._heap)
+                job = self.jobs[name]
+                # Запись устарела: задачу уже перепланировали
+                if job.next_run_at != run_at or job.task is not None:
+                    continue
+                job.task = asyncio.create_task(self._execute(job, run_at))
+            delay = self._heap[0][0] - now if self._heap else self.MAX_SLEEP
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(delay, self.MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_now(self, name: str) -> bool:
+        """Запустить задачу вне расписания; False — она уже выполняется"""
+        job = self.jobs[name]
+        if job.task is not None:
+            return False
+        job.task = asyncio.create_task(self._execute(job, time.time()))
+        await asyncio.shield(job.task)
+        return True
+
+    async def _execute(self, job: Job, scheduled_for: float):
+        started = time.time()
+        run_id = None
+        try:
+            if job.persist:
+                run_id = await start_job_run(job.name, self._owner, scheduled_for, started, started + job.timeout + 60)
+                if run_id is None:
+                    # Выполняется в другом процессе — проверим после окончания аренды
+                    metrics.inc(f"scheduler.{job.name}.overlap")
+                    job.next_run_at = started + min(job.timeout, self.MAX_SLEEP * 5)
+                    return
+            status, error = "ok", None
+            try:
+                await asyncio.wait_for(job.func(), job.timeout)
+            except asyncio.CancelledError:
+                # Остановка бота: снимаем аренду, после перезапуска задача выполнится снова
+                if run_id is not None:
+                    await finish_job_run(run_id, job.name, self._owner, "interrupted", None, time.time(), scheduled_for, JOB_HISTORY_KEEP)
+                raise
+            except asyncio.TimeoutError:
+                status, error = "timeout", f"дольше {job.timeout:g} с"
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+                logger.error(f"❌ Ошибка задачи {job.name}: {error}", exc_info=True)
+            finished = time.time()
+            job.last_run_at, job.last_status = finished, status
+            job.next_run_at = job.schedule.next_after(finished)
+            metrics.inc(f"scheduler.{job.name}.{status}")
+            metrics.set_gauge(f"scheduler.{job.name}.duration", round(finished - started, 3))
+            if run_id is not None:
+                await finish_job_run(run_id, job.name, self._owner, status, error, finished, job.next_run_at, JOB_HISTORY_KEEP)
+        except Exception as e:
+            # Не удалось записать состояние — повторим позже, не теряя задачу
+            logger.error(f"❌ Ошибка планировщика для {job.name}: {e}")
+            job.next_run_at = time.time() + self.MAX_SLEEP
+        finally:
+            job.task = None
+            self._push(job)
+
+    async def close(self, timeout: float = 10):
+        """Остановить таймер и дождаться выполняющихся задач (не дольше timeout)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+        running = [job.task for job in self.jobs.values() if job.task is not None]
+        if running:
+            done, pending = await asyncio.wait(running, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+scheduler = Scheduler()
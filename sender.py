@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import SendMessage, SendPhoto, TelegramMethod
+
+import metrics
+from config import SEND_RATE, SEND_CHAT_INTERVAL, SEND_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# ============ ОТПРАВКА С ОГРАНИЧЕНИЕМ ЧАСТОТЫ ============
+
+class RateLimitedSender:
+    """Вызовы Bot API с ограничением частоты и повторами
+
+    Каждый вызов занимает очередной слот: не чаще rate в секунду на бота
+    и не чаще раза в chat_interval секунд в один чат (лимиты Telegram
+    30/с и ~1/с на чат). Слоты раздаются по порядку под блокировкой,
+    ожидание — вне её. Flood control (RetryAfter) сдвигает слоты всех
+    отправок на retry_after; сетевые ошибки и 5xx повторяются с растущей
+    паузой. Остальные ошибки (403, 400) не повторяются.
+    """
+
+    def __init__(self, rate: float = SEND_RATE, chat_interval: float = SEND_CHAT_INTERVAL,
+                 retries: int = SEND_RETRIES):
+        self.interval = 1 / rate
+        self.chat_interval = chat_interval
+        self.retries = max(1, retries)
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+        self._chat_slots: Dict[Union[int, str], float] = {}
+
+    async def _wait_turn(self, chat_id: Optional[Union[int, str]]):
+        async with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next_slot, self._chat_slots.get(chat_id, 0.0))
+            self._next_slot = at + self.interval
+            if chat_id is not None:
+                self._chat_slots[chat_id] = at + self.chat_interval
+                if len(self._chat_slots) > 10000:
+                    self._chat_slots = {chat: slot for chat, slot in self._chat_slots.items() if slot > now}
+        if at > now:
+            metrics.inc("sender.delayed")
+            await asyncio.sleep(at - now)
+
+    async def call(self, bot: Bot, method: TelegramMethod) -> Any:
+        """Выполнить метод Bot API в свой слот, повторяя временные ошибки"""
+        chat_id = getattr(method, "chat_id", None)
+        for attempt in range(1, self.retries + 1):
+            await self._wait_turn(chat_id)
+            try:
+                result = await bot(method)
+                metrics.inc("sender.sent")
+                return result
+            except TelegramRetryAfter as e:
+                error, delay = e, e.retry_after
+                metrics.inc("sender.retry_after")
+                async with self._lock:
+                    self._next_slot = max(self._next_slot, time.monotonic() + delay)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                error, delay = e, min(2 ** (attempt - 1), 30)
+                metrics.inc("sender.retried")
+                if attempt < self.retries:
+                    logger.warning(f"⚠️ Ошибка отправки в {chat_id}, повтор через {delay} с: {e}")
+            if attempt == self.retries:
+                metrics.inc("sender.failed")
+                raise error
+            await asyncio.sleep(delay)
+
+    async def send_message(self, bot: Bot, chat_id: Union[int, str], text: str, **kwargs) -> Any:
+        return await self.call(bot, SendMessage(chat_id=chat_id, text=text, **kwargs))
+
+    async def send_photo(self, bot: Bot, chat_id: Union[int, str], photo: str, caption: str = None, **kwargs) -> Any:
+        return await self.call(bot, SendPhoto(chat_id=chat_id, photo=photo, caption=caption, **kwargs))
+
+
+sender = RateLimitedSender()